@@ -1,149 +1,4190 @@
 import streamlit as st
-import mysql.connector
-import requests
 from datetime import datetime
-import plotly.express as px 
+import csv
+import hashlib
+import itertools
+import json
+import math
 import os
+import pickle
+import queue
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import NamedTuple
 from dotenv import load_dotenv
 
+# Optional faster JSON codec for API pages and the response cache
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Streamlit re-executes this script on every interaction; each run is timed
+# from here (see main). mysql.connector, requests and plotly are imported
+# where they are first used, so pages that do not need them do not pay for them.
+SCRIPT_STARTED = time.perf_counter()
+
 # --- Environment Setup ---
 load_dotenv()
 
 # ──────────────────────────────────────────────
-# 1. Database Connection
+# 1. Database Connection
+# ──────────────────────────────────────────────
+def connect_mysql(host, port=None, user=None, password=None):
+    import mysql.connector
+    return mysql.connector.connect(
+        host=host,
+        port=port or int(os.getenv('DB_PORT', 3306)),
+        user=user or os.getenv('DB_USER', 'root'),
+        password=password if password is not None else os.getenv('DB_PASSWORD', 'admin'),
+        database=os.getenv('DB_NAME', 'bookscape'),
+        auth_plugin='mysql_native_password'
+    )
+
+def get_db_connection():
+    # A connection to the configured storage backend (see 1f)
+    try:
+        return get_storage_backend().connect()
+    except Exception as e:
+        st.error(f"Connection failed: {str(e)}")
+        return None
+
+# ──────────────────────────────────────────────
+# 1a. Connection Pool
+# ──────────────────────────────────────────────
+class ConnectionPool:
+    # Fixed-size pool of MySQL connections shared by every session.
+    # Connections are created lazily and handed out LIFO so the warmest one is
+    # reused first. Checkout and release cost no server round trip: only a
+    # connection idle for `recycle` seconds is pinged before reuse, and one
+    # older than `max_lifetime` is closed instead of being reused.
+    def __init__(self, size=5, timeout=10.0, recycle=300.0, max_lifetime=3600.0, connect=None):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.max_lifetime = max_lifetime
+        self._connect = connect or get_db_connection
+        self._idle = queue.LifoQueue()
+        self._opened = {}               # id(conn) -> monotonic time it was opened
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self.stats = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+            'connections_created': 0,
+            'reconnects': 0,
+            'discarded': 0,
+            'expired': 0,
+            'pings': 0,
+        }
+
+    def _expired(self, conn):
+        return time.monotonic() - self._opened.get(id(conn), 0.0) >= self.max_lifetime
+
+    def _healthy(self, conn, idle_for):
+        if self._expired(conn):
+            with self._lock:
+                self.stats['expired'] += 1
+            return False
+        if idle_for < self.recycle:
+            return True
+        with self._lock:
+            self.stats['pings'] += 1
+        # The server thread id changes only when the ping had to reconnect
+        before = getattr(conn, 'connection_id', None)
+        try:
+            conn.ping(reconnect=True, attempts=1, delay=0)
+        except Exception:
+            return False
+        if before is not None and getattr(conn, 'connection_id', None) != before:
+            with self._lock:
+                self.stats['reconnects'] += 1
+        return True
+
+    def _discard(self, conn):
+        with self._lock:
+            self._opened.pop(id(conn), None)
+            self._created -= 1
+            self.stats['discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def checkout(self):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.stats['timeouts'] += 1
+            raise TimeoutError(f"No database connection available after {self.timeout}s "
+                               f"(pool size {self.size})")
+        try:
+            conn = None
+            while conn is None:
+                try:
+                    conn, returned_at = self._idle.get_nowait()
+                except queue.Empty:
+                    conn = self._connect()
+                    if conn is None:
+                        raise ConnectionError("Could not open a database connection")
+                    with self._lock:
+                        self._opened[id(conn)] = time.monotonic()
+                        self._created += 1
+                        self.stats['connections_created'] += 1
+                    break
+                if not self._healthy(conn, time.monotonic() - returned_at):
+                    self._discard(conn)
+                    conn = None
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._in_use += 1
+            self.stats['checkouts'] += 1
+            self.stats['wait_seconds'] += waited
+            self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], waited)
+        return conn
+
+    def release(self, conn, broken=False):
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if broken or self._expired(conn):
+                self._discard(conn)
+            else:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put((conn, time.monotonic()))
+        except Exception:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def metrics(self):
+        with self._lock:
+            checkouts = self.stats['checkouts']
+            return {
+                **self.stats,
+                'size': self.size,
+                'open': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'avg_wait_ms': round(self.stats['wait_seconds'] * 1000 / checkouts, 3) if checkouts else 0.0,
+            }
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+# One pool per process, shared across Streamlit sessions and reruns
+@st.cache_resource
+def get_connection_pool():
+    return ConnectionPool(
+        size=int(os.getenv('DB_POOL_SIZE', 5)),
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        recycle=float(os.getenv('DB_POOL_RECYCLE', 300)),
+        max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', 3600)),
+    )
+
+@contextmanager
+def pooled_connection(pool=None):
+    # A connection from `pool`, the primary's by default
+    pool = pool or get_connection_pool()
+    conn = pool.checkout()
+    broken = False
+    try:
+        yield conn
+    except Exception:
+        broken = not conn.is_connected()
+        raise
+    finally:
+        pool.release(conn, broken=broken)
+
+def execute_query(query, params=None, name=None, min_version=None):
+    # Reads may go to a replica that has applied at least `min_version` (see
+    # route_read); a replica that cannot be reached is retried on the primary
+    profiler = get_query_profiler()
+    name = name or query_name(query)
+    started = time.perf_counter()
+    try:
+        replica = route_read(min_version) if is_read_query(query) else None
+        try:
+            return _run_query(replica.pool if replica else None, query, params, name, started)
+        except Exception as e:
+            if replica is None or not (is_connection_error(e) or isinstance(e, TimeoutError)):
+                raise
+            if is_connection_error(e):
+                get_read_router().mark_down(replica, e)
+            return _run_query(None, query, params, name, started)
+    except Exception as e:
+        profiler.record(name, time.perf_counter() - started, error=e, sql=query)
+        st.error(f"Database Error: {str(e)}")
+        return None
+
+def _run_query(pool, query, params, name, started):
+    profiler = get_query_profiler()
+    with pooled_connection(pool) as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+
+            if 'SELECT' in query.upper():
+                result = cursor.fetchall()
+                rows = len(result)
+            else:
+                conn.commit()
+                result = rows = cursor.rowcount
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        elapsed = time.perf_counter() - started
+        explain = None
+        if profiler.is_slow(elapsed) and query.lstrip().upper().startswith(('SELECT', 'WITH')):
+            explain = explain_query(conn, query, params)
+        profiler.record(name, elapsed, rows=rows, sql=query, explain=explain)
+        return result
+
+# ──────────────────────────────────────────────
+# 1b. Query Profiling
+# ──────────────────────────────────────────────
+# Upper bounds (ms) of the latency histogram buckets; slower calls land in "inf"
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class QueryProfiler:
+    # Per-name latency histograms, row and error counts, plus a bounded
+    # log of slow calls with their EXPLAIN plans
+    def __init__(self, slow_ms=500, slow_log_size=100):
+        self.slow_ms = slow_ms
+        self.slow_log = deque(maxlen=slow_log_size)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def is_slow(self, seconds):
+        return seconds * 1000 >= self.slow_ms
+
+    def record(self, name, seconds, rows=0, error=None, sql=None, explain=None):
+        ms = seconds * 1000
+        bucket = next((str(b) for b in LATENCY_BUCKETS_MS if ms <= b), 'inf')
+        with self._lock:
+            stats = self._stats.setdefault(name, {
+                'calls': 0, 'errors': 0, 'rows': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'histogram': {str(b): 0 for b in LATENCY_BUCKETS_MS + ('inf',)},
+                'last_error': None,
+            })
+            stats['calls'] += 1
+            stats['rows'] += rows if isinstance(rows, int) and rows > 0 else 0
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+            stats['histogram'][bucket] += 1
+            if error is not None:
+                stats['errors'] += 1
+                stats['last_error'] = str(error)
+            if ms >= self.slow_ms:
+                self.slow_log.appendleft({
+                    'name': name,
+                    'ms': round(ms, 2),
+                    'rows': rows,
+                    'at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    'sql': " ".join(sql.split()) if sql else None,
+                    'explain': explain,
+                })
+
+    @staticmethod
+    def _percentile(histogram, calls, fraction):
+        # Upper bound of the bucket holding the given fraction of calls
+        target = calls * fraction
+        seen = 0
+        for bucket, count in histogram.items():
+            seen += count
+            if seen >= target:
+                return bucket
+        return 'inf'
+
+    def snapshot(self):
+        with self._lock:
+            queries = {}
+            for name, stats in self._stats.items():
+                queries[name] = {
+                    **stats,
+                    'histogram': dict(stats['histogram']),
+                    'avg_ms': round(stats['total_ms'] / stats['calls'], 3),
+                    'p50_ms': self._percentile(stats['histogram'], stats['calls'], 0.5),
+                    'p95_ms': self._percentile(stats['histogram'], stats['calls'], 0.95),
+                    'total_ms': round(stats['total_ms'], 3),
+                    'max_ms': round(stats['max_ms'], 3),
+                }
+            return {'slow_ms': self.slow_ms, 'queries': queries, 'slow_log': list(self.slow_log)}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.slow_log.clear()
+
+@st.cache_resource
+def get_query_profiler():
+    return QueryProfiler(
+        slow_ms=float(os.getenv('SLOW_QUERY_MS', 500)),
+        slow_log_size=int(os.getenv('SLOW_QUERY_LOG_SIZE', 100)),
+    )
+
+def query_name(query):
+    # Default profile name: the statement's first 80 characters
+    return " ".join(query.split())[:80]
+
+def explain_query(conn, query, params=None):
+    try:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(get_storage_backend().explain_prefix + query, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+    except Exception as e:
+        return [{'error': str(e)}]
+
+def metrics_snapshot():
+    # Everything the admin page shows, as one JSON-serialisable dict
+    return {
+        'generated_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'queries': get_query_profiler().snapshot(),
+        'connection_pool': get_connection_pool().metrics(),
+        'api_cache': get_response_cache().metrics(),
+        'query_cache': get_query_cache().metrics(),
+        'thumbnails': get_thumbnail_cache().metrics(),
+        'similar_books': get_similarity_index().metrics() if get_similarity_index() else None,
+        'read_routing': get_read_router().metrics(),
+        'storage': get_storage_backend().metrics(),
+        'import_jobs': get_import_jobs().metrics(),
+        'edition_clusters': get_dedup_stats().metrics(),
+    }
+
+def write_metrics(path):
+    with open(path, 'w') as f:
+        json.dump(metrics_snapshot(), f, indent=2, default=str)
+
+# ──────────────────────────────────────────────
+# 1c. Schema
+# ──────────────────────────────────────────────
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS books (
+        book_id VARCHAR(255) PRIMARY KEY,
+        title VARCHAR(255),
+        authors TEXT,
+        publisher VARCHAR(255),
+        published_year VARCHAR(10),
+        description TEXT,
+        isbn VARCHAR(20),
+        page_count INT,
+        categories TEXT,
+        average_rating FLOAT,
+        ratings_count INT,
+        price FLOAT,
+        currency VARCHAR(10),
+        thumbnail TEXT,
+        import_timestamp DATETIME
+    )
+    """,
+    # One row per (book, author) and (book, category), split from the
+    # pipe-joined columns so filters and GROUP BYs can use an index
+    """
+    CREATE TABLE IF NOT EXISTS book_authors (
+        book_id VARCHAR(255) NOT NULL,
+        author VARCHAR(255) NOT NULL,
+        PRIMARY KEY (book_id, author),
+        INDEX idx_book_authors_author (author, book_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS book_categories (
+        book_id VARCHAR(255) NOT NULL,
+        category VARCHAR(255) NOT NULL,
+        PRIMARY KEY (book_id, category),
+        INDEX idx_book_categories_category (category, book_id)
+    )
+    """,
+    # Summary tables behind the Query Explorer, kept current by store_books
+    """
+    CREATE TABLE IF NOT EXISTS agg_publishers (
+        publisher VARCHAR(255) PRIMARY KEY,
+        book_count INT NOT NULL,
+        rating_sum DOUBLE NOT NULL,
+        rated_count INT NOT NULL,
+        rated_sum DOUBLE NOT NULL,
+        INDEX idx_agg_publishers_count (book_count)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS agg_authors (
+        author VARCHAR(255) PRIMARY KEY,
+        book_count INT NOT NULL,
+        INDEX idx_agg_authors_count (book_count)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS agg_global (
+        id TINYINT PRIMARY KEY,
+        book_count INT NOT NULL DEFAULT 0,
+        rated_count INT NOT NULL DEFAULT 0,
+        rating_sum DOUBLE NOT NULL DEFAULT 0,
+        rating_sq_sum DOUBLE NOT NULL DEFAULT 0,
+        reviewed_count INT NOT NULL DEFAULT 0,
+        ratings_count_sum DOUBLE NOT NULL DEFAULT 0
+    )
+    """,
+    # Bumped by every write to books; part of every query-result cache key
+    """
+    CREATE TABLE IF NOT EXISTS data_version (
+        id TINYINT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0,
+        updated_at DATETIME
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS summary_state (
+        name VARCHAR(64) PRIMARY KEY,
+        is_fresh TINYINT NOT NULL,
+        refreshed_at DATETIME
+    )
+    """,
+    # MinHash LSH buckets of each book's normalized title (see assign_works)
+    """
+    CREATE TABLE IF NOT EXISTS lsh_buckets (
+        band TINYINT NOT NULL,
+        bucket BIGINT NOT NULL,
+        book_id VARCHAR(255) NOT NULL,
+        PRIMARY KEY (band, bucket, book_id),
+        INDEX idx_lsh_buckets_book (book_id)
+    )
+    """,
+]
+
+def schema_query(query, params=None):
+    # Like execute_query, but raises instead of reporting to the page, so a
+    # failed migration step stops the migration before it is recorded
+    with pooled_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(query, params)
+            rows = cursor.fetchall() if cursor.with_rows else None
+            conn.commit()
+            return rows
+        finally:
+            cursor.close()
+
+def ensure_index(table, name, definition):
+    # MySQL has no CREATE INDEX IF NOT EXISTS, so look the index up first.
+    # Backends without FULLTEXT or secondary indexes skip them (see 1f).
+    backend = get_storage_backend()
+    if not backend.secondary_indexes or (definition.startswith('FULLTEXT') and not backend.fulltext):
+        return False
+    found = schema_query(backend.index_exists_sql, (table, name))
+    if not found:
+        schema_query(f"ALTER TABLE {table} ADD {definition}")
+        return True
+    return False
+
+def ensure_column(table, name, definition):
+    # Same as ensure_index, for columns added after the original CREATE TABLE
+    found = schema_query(get_storage_backend().column_exists_sql, (table, name))
+    if not found:
+        schema_query(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+        return True
+    return False
+
+# Versioned migrations, applied in order by init_schema and recorded in
+# schema_migrations. Each returns True when the summary tables need a
+# rebuild afterwards. The steps are idempotent, so a database created before
+# schema_migrations existed is adopted by re-running them as no-ops.
+def migrate_base_tables():
+    for statement in SCHEMA_STATEMENTS:
+        schema_query(statement)
+    schema_query("INSERT IGNORE INTO agg_global (id) VALUES (1)")
+    schema_query("INSERT IGNORE INTO data_version (id, version, updated_at) VALUES (1, 0, NOW())")
+    return False
+
+def migrate_search_indexes():
+    ensure_index('books', 'ft_books_text', f"FULLTEXT INDEX ft_books_text ({FULLTEXT_COLUMNS})")
+    # Used to recompute the summary rows touched by each store_books batch
+    ensure_index('books', 'idx_books_publisher', "INDEX idx_books_publisher (publisher)")
+    ensure_index('books', 'idx_books_year', "INDEX idx_books_year (published_year)")
+    # Incremental refresh of the analytics snapshot, stalest-first catalog refresh
+    ensure_index('books', 'idx_books_import_timestamp', "INDEX idx_books_import_timestamp (import_timestamp)")
+    return False
+
+def migrate_book_relations():
+    # One-off backfill for books stored before the join tables existed
+    if schema_query("SELECT 1 AS found FROM book_authors LIMIT 1") == [] and \
+            schema_query("SELECT 1 AS found FROM books LIMIT 1"):
+        backfill_book_relations()
+        return True
+    return False
+
+def migrate_content_hash():
+    # Fingerprint of the stored content, compared by refresh_stale_books
+    ensure_column('books', 'content_hash', "CHAR(40)")
+    return False
+
+def migrate_editions():
+    # Edition clustering: canonical ISBN-13 and the work each volume belongs to
+    ensure_column('books', 'isbn13', "CHAR(13)")
+    ensure_column('books', 'work_id', "VARCHAR(255)")
+    ensure_index('books', 'idx_books_isbn13', "INDEX idx_books_isbn13 (isbn13)")
+    ensure_index('books', 'idx_books_work_id', "INDEX idx_books_work_id (work_id)")
+    # Appended last, matching the column order of its SUMMARY_TABLES select
+    return ensure_column('agg_publishers', 'work_count', "INT NOT NULL DEFAULT 0")
+
+def migrate_typed_columns():
+    # Numeric year and the ebook flag. pub_year is backfilled from
+    # published_year here; is_ebook has no stored source, so older books get
+    # it when they are re-imported or reached by refresh_stale_books.
+    ensure_column('books', 'pub_year', "SMALLINT")
+    ensure_column('books', 'is_ebook', "TINYINT(1)")
+    backfill_pub_year()
+    return False
+
+def migrate_covering_indexes():
+    # Query Explorer: 1, 7 and 18 read only (is_ebook, page_count, price);
+    # 5 walks page_count downwards and checks pub_year in the index; 15
+    # groups (pub_year, price) without touching the rows
+    ensure_index('books', 'idx_books_ebook', "INDEX idx_books_ebook (is_ebook, page_count, price)")
+    ensure_index('books', 'idx_books_pages_year', "INDEX idx_books_pages_year (page_count, pub_year)")
+    ensure_index('books', 'idx_books_pub_year_price', "INDEX idx_books_pub_year_price (pub_year, price)")
+    # Advanced Search: year, minimum rating and minimum pages, and the
+    # rating order used when there is no title to rank by
+    ensure_index('books', 'idx_books_year_rating',
+                 "INDEX idx_books_year_rating (pub_year, average_rating, page_count)")
+    ensure_index('books', 'idx_books_rating_pages', "INDEX idx_books_rating_pages (average_rating, page_count)")
+    return False
+
+def migrate_format_summary():
+    # Ebook vs physical totals behind Query Explorer 1, 7 and 18
+    schema_query("""
+        CREATE TABLE IF NOT EXISTS agg_formats (
+            format VARCHAR(16) PRIMARY KEY,
+            book_count INT NOT NULL DEFAULT 0,
+            paged_count INT NOT NULL DEFAULT 0,
+            page_sum DOUBLE NOT NULL DEFAULT 0,
+            priced_count INT NOT NULL DEFAULT 0,
+            price_sum DOUBLE NOT NULL DEFAULT 0
+        )
+    """)
+    return True
+
+def migrate_summary_keys():
+    # Key the summaries the way the live Query Explorer queries group: 6 and
+    # 10 by the whole categories string, 15 by pub_year. Publishers also count
+    # their non-NULL ratings, which is what AVG(average_rating) divides by.
+    schema_query("DROP TABLE IF EXISTS agg_categories")
+    if schema_query(get_storage_backend().column_exists_sql, ('agg_years', 'published_year')):
+        schema_query("DROP TABLE agg_years")
+    schema_query("""
+        CREATE TABLE IF NOT EXISTS agg_category_sets (
+            categories TEXT NOT NULL,
+            book_count INT NOT NULL,
+            price_count INT NOT NULL,
+            price_sum DOUBLE NOT NULL,
+            paged_count INT NOT NULL,
+            page_sum DOUBLE NOT NULL
+        )
+    """)
+    schema_query("""
+        CREATE TABLE IF NOT EXISTS agg_years (
+            pub_year SMALLINT PRIMARY KEY,
+            book_count INT NOT NULL,
+            priced_count INT NOT NULL,
+            price_sum DOUBLE NOT NULL
+        )
+    """)
+    ensure_column('agg_publishers', 'rating_count', "INT NOT NULL DEFAULT 0")
+    # Finds the agg_category_sets rows a store_books batch touches
+    ensure_index('books', 'idx_books_categories', "INDEX idx_books_categories (categories(255))")
+    return True
+
+def migrate_category_set_index():
+    # The per-batch DELETE/INSERT of agg_category_sets and query 6's join
+    # look rows up by the categories string; without this they scan the table
+    ensure_index('agg_category_sets', 'idx_agg_category_sets_categories',
+                 "INDEX idx_agg_category_sets_categories (categories(255))")
+    return False
+
+MIGRATIONS = [
+    (1, "base tables", migrate_base_tables),
+    (2, "search and summary indexes", migrate_search_indexes),
+    (3, "book_authors / book_categories backfill", migrate_book_relations),
+    (4, "content_hash", migrate_content_hash),
+    (5, "edition clustering", migrate_editions),
+    (6, "typed pub_year and is_ebook", migrate_typed_columns),
+    (7, "covering indexes", migrate_covering_indexes),
+    (8, "ebook/physical summary", migrate_format_summary),
+    (9, "summaries keyed like the live queries", migrate_summary_keys),
+    (10, "agg_category_sets lookup index", migrate_category_set_index),
+]
+
+def applied_migrations():
+    return schema_query("SELECT version, name, applied_at, seconds FROM schema_migrations ORDER BY version")
+
+def run_migrations(progress=None):
+    # Apply pending migrations under a named lock, so two app processes
+    # starting together do not run them twice. Returns whether the summary
+    # tables need a rebuild.
+    schema_query("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL,
+            seconds DOUBLE NOT NULL
+        )
+    """)
+    applied = {row['version'] for row in applied_migrations()}
+    if all(version in applied for version, _, _ in MIGRATIONS):
+        return False
+    rebuild = False
+    with get_storage_backend().named_lock('bookscape_migrations', int(os.getenv('MIGRATION_LOCK_TIMEOUT', 600))):
+        applied = {row['version'] for row in applied_migrations()}
+        for version, name, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            if progress:
+                progress(version, name)
+            started = time.perf_counter()
+            rebuild = migrate() or rebuild
+            schema_query(
+                "INSERT INTO schema_migrations (version, name, applied_at, seconds) VALUES (%s, %s, NOW(), %s)",
+                (version, name, round(time.perf_counter() - started, 3))
+            )
+    return rebuild
+
+def init_schema():
+    rebuild = run_migrations()
+    # Build the summary tables the first time they appear, or after a
+    # migration that changed what they hold
+    if rebuild or execute_query("SELECT 1 AS found FROM summary_state "
+                                "WHERE name = 'aggregates' AND refreshed_at IS NOT NULL") == []:
+        rebuild_aggregates()
+
+@st.cache_resource
+def get_schema_state():
+    return {'ready': False, 'error': None, 'failed_at': 0.0, 'lock': threading.Lock()}
+
+def ensure_schema():
+    # init_schema once per process (and storage backend), not on every rerun.
+    # A failure is remembered for SCHEMA_RETRY_SECONDS and raised again
+    # without touching the database, so a down server costs each rerun
+    # nothing rather than a connection timeout.
+    state = get_schema_state()
+    if state['ready']:
+        return True
+    with state['lock']:
+        if state['ready']:
+            return True
+        if state['error'] is not None and \
+                time.monotonic() - state['failed_at'] < float(os.getenv('SCHEMA_RETRY_SECONDS', 30)):
+            raise state['error']
+        try:
+            init_schema()
+        except Exception as e:
+            state.update(error=e, failed_at=time.monotonic())
+            raise
+        state.update(ready=True, error=None)
+    return True
+
+@st.cache_resource
+def get_run_counter():
+    # Script runs in this process; run 0 is the cold start
+    return itertools.count()
+
+def backfill_pub_year(chunk_size=None, progress=None):
+    # Fill pub_year in primary-key ranges, one short transaction each, so the
+    # table stays writable while it runs; rows already filled are skipped
+    chunk_size = chunk_size or int(os.getenv('MIGRATION_CHUNK_SIZE', 5000))
+    last_id = ''
+    total = 0
+    while True:
+        rows = schema_query(
+            "SELECT book_id FROM books WHERE book_id > %s ORDER BY book_id LIMIT %s",
+            (last_id, chunk_size)
+        )
+        if not rows:
+            break
+        schema_query(
+            "UPDATE books SET pub_year = CAST(published_year AS UNSIGNED) "
+            "WHERE book_id > %s AND book_id <= %s AND pub_year IS NULL "
+            "AND published_year REGEXP '^[0-9]{4}$'",
+            (last_id, rows[-1]['book_id'])
+        )
+        total += len(rows)
+        last_id = rows[-1]['book_id']
+        if progress:
+            progress(total)
+    return total
+
+def backfill_book_relations(chunk_size=1000):
+    # Walk books in primary-key order, one short transaction per chunk
+    last_id = ''
+    total = 0
+    while True:
+        with primary_reads():
+            rows = execute_query(
+                "SELECT book_id, authors, categories FROM books "
+                "WHERE book_id > %s ORDER BY book_id LIMIT %s",
+                (last_id, chunk_size)
+            )
+        if not rows:
+            return total
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                sync_book_relations(cursor, [(row['book_id'], row['authors'] or '', row['categories'] or '')
+                                             for row in rows])
+                mark_aggregates_stale(cursor)
+                bump_data_version(cursor)
+                conn.commit()
+            finally:
+                cursor.close()
+        get_query_cache().expire_version()
+        total += len(rows)
+        last_id = rows[-1]['book_id']
+
+# ──────────────────────────────────────────────
+# 1d. Query Result Cache
+# ──────────────────────────────────────────────
+class QueryResultCache:
+    # Byte-bounded LRU of SELECT results keyed on (sql, params, data version).
+    # Writers bump data_version, so results from before a write are never
+    # served again and are dropped as soon as the new version is seen.
+    def __init__(self, max_bytes=32 * 1024 * 1024, version_ttl=1.0):
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def data_version(self):
+        # Re-read the version at most every version_ttl seconds
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked > self.version_ttl:
+            version = read_data_version()
+            with self._lock:
+                if version != self._version:
+                    stale = [key for key in self._entries if key[2] != version]
+                    for key in stale:
+                        self._bytes -= self._entries.pop(key)[1]
+                    self.stats['invalidations'] += len(stale)
+                self._version = version
+                self._version_checked = now
+        return self._version
+
+    def expire_version(self):
+        # Called after a local write so the next lookup re-reads the version
+        self._version_checked = 0.0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key, rows):
+        size = len(pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (rows, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.stats['evictions'] += 1
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'data_version': self._version,
+                'hit_rate': round(self.stats['hits'] / lookups, 3) if lookups else 0.0,
+            }
+
+@st.cache_resource
+def get_query_cache():
+    return QueryResultCache(
+        max_bytes=int(os.getenv('QUERY_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+        version_ttl=float(os.getenv('QUERY_CACHE_VERSION_TTL', 1)),
+    )
+
+def cached_query(query, params=None, name=None):
+    # execute_query for dashboard SELECTs, shared across sessions until the data changes
+    cache = get_query_cache()
+    version = cache.data_version()
+    required = session_read_version()
+    if required is not None and (version is None or version < required):
+        # The shared cache has not caught up with this session's own import yet
+        return execute_query(query, params, name=name)
+    key = (query, repr(params), version)
+    rows = cache.get(key)
+    if rows is None:
+        # Only from a copy that has applied `version`, so the entry matches its key
+        rows = execute_query(query, params, name=name, min_version=version)
+        if rows is not None:
+            cache.put(key, rows)
+    return rows
+
+def bump_data_version(cursor):
+    cursor.execute("UPDATE data_version SET version = version + 1, updated_at = NOW() WHERE id = 1")
+
+# ──────────────────────────────────────────────
+# 1e. Read Routing
+# ──────────────────────────────────────────────
+# With DB_REPLICAS set, reads (SELECT/WITH/SHOW through execute_query, and
+# stream_query_rows) go to replica pools and everything else to the primary.
+# A replica is used only while it is reachable, lags by at most
+# DB_REPLICA_MAX_LAG seconds, and has applied the data version the caller
+# needs: the session's own last import (read-your-writes) or the version a
+# cached result is filed under. Otherwise the read falls back to the primary.
+def parse_hosts(value):
+    # "host[:port],host[:port]" -> [(host, port or None)]
+    hosts = []
+    for entry in (value or '').split(','):
+        entry = entry.strip()
+        if entry:
+            host, _, port = entry.partition(':')
+            hosts.append((host, int(port) if port else None))
+    return hosts
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.version = None      # highest data version seen on this replica
+        self.lag = None          # seconds; None while unknown or replication is stopped
+        self.lag_source = None
+        self.checked_at = 0.0
+        self.down_until = 0.0
+        self.reads = 0
+        self.errors = 0
+        self.last_error = None
+        self.check_lock = threading.Lock()
+
+class ReadRouter:
+    def __init__(self, primary, replicas=(), max_lag=5.0, check_interval=2.0, retry_after=30.0):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._next = 0
+        # (version, when first seen) for recent primary versions, oldest first,
+        # to estimate lag for replicas that cannot report it themselves
+        self._primary_versions = deque(maxlen=512)
+        self._primary_checked = 0.0
+        self.stats = {'primary_reads': 0, 'replica_reads': 0, 'fallbacks': 0, 'lag_skips': 0,
+                      'version_skips': 0, 'replica_errors': 0}
+
+    @staticmethod
+    def _read_version(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT version FROM data_version WHERE id = 1")
+            row = cursor.fetchone()
+            return row[0] if row else None
+        finally:
+            cursor.close()
+
+    def primary_version(self, refresh=False):
+        now = time.monotonic()
+        if refresh or now - self._primary_checked > self.check_interval:
+            with pooled_connection(self.primary) as conn:
+                version = self._read_version(conn)
+            with self._lock:
+                self._primary_checked = now
+                if version is not None and (not self._primary_versions or version > self._primary_versions[-1][0]):
+                    self._primary_versions.append((version, now))
+        with self._lock:
+            return self._primary_versions[-1][0] if self._primary_versions else None
+
+    def _estimated_lag(self, version):
+        # Seconds since the primary first showed a version the replica has not applied
+        if version is None:
+            return None
+        with self._lock:
+            for primary_version, seen in self._primary_versions:
+                if primary_version > version:
+                    return time.monotonic() - seen
+        return 0.0
+
+    def _check(self, replica):
+        # Refresh a replica's version and lag at most every check_interval
+        # seconds; a thread finding a check in progress uses the last result
+        if time.monotonic() - replica.checked_at < self.check_interval or not replica.check_lock.acquire(False):
+            return
+        try:
+            self.primary_version()
+            with pooled_connection(replica.pool) as conn:
+                version = self._read_version(conn)
+                status = None
+                cursor = conn.cursor(dictionary=True)
+                try:
+                    for statement in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):
+                        try:
+                            cursor.execute(statement)
+                            status = cursor.fetchall()
+                            break
+                        except Exception:
+                            continue   # older server, or no REPLICATION CLIENT privilege
+                finally:
+                    cursor.close()
+            if status:
+                reported = status[0].get('Seconds_Behind_Source', status[0].get('Seconds_Behind_Master'))
+                replica.lag = None if reported is None else float(reported)
+                replica.lag_source = 'replication status'
+            else:
+                replica.lag = self._estimated_lag(version)
+                replica.lag_source = 'data version'
+            if version is not None:
+                replica.version = max(version, replica.version or 0)
+            replica.checked_at = time.monotonic()
+        except Exception as e:
+            self.mark_down(replica, e)
+        finally:
+            replica.check_lock.release()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def choose(self, min_version=None):
+        # The replica to read from, or None for the primary
+        if not self.replicas:
+            self._count('primary_reads')
+            return None
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        now = time.monotonic()
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.down_until > now:
+                continue
+            self._check(replica)
+            if replica.down_until > now:
+                continue
+            if replica.lag is None or replica.lag > self.max_lag:
+                self._count('lag_skips')
+                continue
+            if min_version is not None and (replica.version is None or replica.version < min_version):
+                self._count('version_skips')
+                continue
+            replica.reads += 1
+            self._count('replica_reads')
+            return replica
+        self._count('fallbacks')
+        self._count('primary_reads')
+        return None
+
+    def observe(self, replica, version):
+        if replica is not None and version is not None:
+            replica.version = max(version, replica.version or 0)
+
+    def mark_down(self, replica, error):
+        # Skip the replica for retry_after seconds
+        replica.errors += 1
+        replica.last_error = str(error)
+        replica.down_until = time.monotonic() + self.retry_after
+        self._count('replica_errors')
+
+    def metrics(self):
+        now = time.monotonic()
+        return {
+            **self.stats,
+            'max_lag': self.max_lag,
+            'primary_version': self._primary_versions[-1][0] if self._primary_versions else None,
+            'replicas': [{
+                'name': replica.name,
+                'up': replica.down_until <= now,
+                'version': replica.version,
+                'lag_seconds': None if replica.lag is None else round(replica.lag, 2),
+                'lag_source': replica.lag_source,
+                'reads': replica.reads,
+                'errors': replica.errors,
+                'last_error': replica.last_error,
+                'pool': replica.pool.metrics(),
+            } for replica in self.replicas],
+        }
+
+@st.cache_resource
+def get_read_router():
+    replicas = []
+    # An embedded database file has no replicas
+    hosts = [] if get_storage_backend().embedded else parse_hosts(os.getenv('DB_REPLICAS'))
+    for host, port in hosts:
+        pool = ConnectionPool(
+            size=int(os.getenv('DB_REPLICA_POOL_SIZE', os.getenv('DB_POOL_SIZE', 5))),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            recycle=float(os.getenv('DB_POOL_RECYCLE', 300)),
+            max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', 3600)),
+            connect=lambda host=host, port=port: connect_mysql(
+                host, port,
+                user=os.getenv('DB_REPLICA_USER', os.getenv('DB_USER', 'root')),
+                password=os.getenv('DB_REPLICA_PASSWORD', os.getenv('DB_PASSWORD', 'admin')),
+            ),
+        )
+        replicas.append(Replica(f"{host}:{port or 3306}", pool))
+    return ReadRouter(
+        get_connection_pool(), replicas,
+        max_lag=float(os.getenv('DB_REPLICA_MAX_LAG', 5)),
+        check_interval=float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 2)),
+        retry_after=float(os.getenv('DB_REPLICA_RETRY', 30)),
+    )
+
+_routing = threading.local()
+
+@contextmanager
+def primary_reads():
+    # Send every read in this block, on this thread, to the primary; for
+    # read-then-write maintenance that must not act on a lagging copy
+    depth = getattr(_routing, 'primary', 0)
+    _routing.primary = depth + 1
+    try:
+        yield
+    finally:
+        _routing.primary = depth
+
+def route_read(min_version=None):
+    # The replica for a read on this thread, or None for the primary
+    if getattr(_routing, 'primary', 0):
+        return None
+    required = session_read_version()
+    if required is not None:
+        min_version = required if min_version is None else max(min_version, required)
+    return get_read_router().choose(min_version)
+
+def session_read_version():
+    # The data version of this session's last import, if it made one
+    try:
+        return st.session_state.get('read_after_version')
+    except Exception:
+        return None   # no Streamlit session (background thread, CLI)
+
+def note_session_write():
+    # Read-your-writes: after an import, this session reads only from copies
+    # that have applied it. Replicas qualify again as soon as they catch up.
+    router = get_read_router()
+    if not router.replicas:
+        return
+    try:
+        version = router.primary_version(refresh=True)
+        if version is not None:
+            st.session_state['read_after_version'] = max(version, st.session_state.get('read_after_version') or 0)
+    except Exception:
+        pass
+
+def is_read_query(query):
+    statement = query.lstrip().upper()
+    return statement.startswith(('SELECT', 'WITH', 'SHOW', 'EXPLAIN')) and 'FOR UPDATE' not in statement
+
+def is_connection_error(error):
+    # mysql.connector is only loaded once a MySQL connection has been made;
+    # until then no error can have come from it
+    connector = sys.modules.get('mysql.connector')
+    driver_errors = (connector.errors.InterfaceError, connector.errors.OperationalError) if connector else ()
+    return isinstance(error, (ConnectionError, *driver_errors))
+
+def read_data_version():
+    # The data version as seen where reads are going, recorded against that
+    # replica so results filed under it come from a copy at least as new
+    router = get_read_router()
+    replica = route_read() if router.replicas else None
+    if replica is not None:
+        try:
+            with pooled_connection(replica.pool) as conn:
+                version = router._read_version(conn)
+            router.observe(replica, version)
+            return version
+        except Exception as e:
+            if not (is_connection_error(e) or isinstance(e, TimeoutError)):
+                raise
+            if is_connection_error(e):
+                router.mark_down(replica, e)
+    with primary_reads():
+        row = execute_query("SELECT version FROM data_version WHERE id = 1", name="data_version")
+    return row[0]['version'] if row else None
+
+# ──────────────────────────────────────────────
+# 1f. Storage Backends
+# ──────────────────────────────────────────────
+# DB_BACKEND picks where the catalog lives: the MySQL server (default), or an
+# embedded database file at DB_PATH - SQLite for small deployments and CI,
+# or DuckDB, a columnar engine for the Query Explorer's scans and GROUP BYs.
+# The app's SQL is written for MySQL. An embedded backend rewrites each
+# statement once into its dialect (placeholders, upserts, functions, inline
+# indexes) and hands out connections with the slice of the mysql.connector
+# API the app uses. Writes to an embedded file are serialised per process,
+# and there are no replicas and no FULLTEXT index (search falls back to LIKE).
+class MySQLBackend:
+    name = 'mysql'
+    embedded = False
+    fulltext = True
+    secondary_indexes = True
+    explain_prefix = "EXPLAIN "
+    index_exists_sql = ("SELECT 1 AS found FROM information_schema.statistics "
+                        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1")
+    column_exists_sql = ("SELECT 1 AS found FROM information_schema.columns "
+                         "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s LIMIT 1")
+
+    def connect(self):
+        return connect_mysql(os.getenv('DB_HOST', 'localhost'))
+
+    def translate(self, query, with_params=True):
+        return [(query, None)]
+
+    @contextmanager
+    def named_lock(self, name, timeout):
+        # GET_LOCK belongs to the connection, so it also excludes other processes
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT GET_LOCK(%s, %s)", (name, int(timeout)))
+                if cursor.fetchone()[0] != 1:
+                    raise TimeoutError(f"Timed out after {timeout}s waiting for the {name} lock")
+                yield
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+                cursor.fetchall()
+                cursor.close()
+
+    def metrics(self):
+        return {'backend': self.name, 'host': os.getenv('DB_HOST', 'localhost'),
+                'database': os.getenv('DB_NAME', 'bookscape')}
+
+    def close(self):
+        pass
+
+# Quoted literals, `identifiers`, and the pyformat placeholders mysql.connector takes
+SQL_TOKEN = re.compile(r"'(?:[^']|'')*'|`([^`]*)`|%\((\w+)\)s|%s|%%")
+CREATE_TABLE = re.compile(r'CREATE TABLE(?: IF NOT EXISTS)? (\w+)', re.IGNORECASE)
+INLINE_INDEX = re.compile(r',\s*INDEX (\w+) \(([^)]*)\)', re.IGNORECASE)
+# UPDATE t SET a = ?, b = ? WHERE key = ?
+KEYED_UPDATE = re.compile(r'\s*UPDATE (\w+) SET ((?:\w+ = \?, )*\w+ = \?) WHERE (\w+) = \?\s*$', re.IGNORECASE)
+# Rewrites every embedded dialect needs: SQLite and DuckDB share the upsert syntax
+EMBEDDED_REWRITES = (
+    (r'\bINSERT IGNORE INTO\b', 'INSERT OR IGNORE INTO'),
+    (r'(?<!OR )\bREPLACE INTO\b', 'INSERT OR REPLACE INTO'),
+    (r'\bON DUPLICATE KEY UPDATE\b', 'ON CONFLICT DO UPDATE SET'),
+    (r'\bVALUES\((\w+)\)', r'excluded.\1'),
+    (r'\bAS UNSIGNED\)', 'AS INTEGER)'),
+    (r'\bALTER TABLE (\w+) ADD INDEX (\w+) \(', r'CREATE INDEX \2 ON \1 ('),
+    (r'(\bCREATE INDEX \w+ ON \w+ \(\w+)\(\d+\)\)', r'\1)'),
+)
+
+def _bind_placeholders(statement, with_params):
+    # pyformat -> qmark placeholders. Returns (statement, names): the
+    # parameter names in order for %(name)s placeholders, else None. Like
+    # mysql.connector, a statement run without parameters is left as written.
+    names = []
+
+    def replace(match):
+        token = match.group(0)
+        if token.startswith("'"):
+            return token.replace('%%', '%') if with_params else token
+        if match.group(1) is not None:
+            return f'"{match.group(1)}"'
+        if not with_params:
+            return token
+        if match.group(2):
+            names.append(match.group(2))
+            return '?'
+        return '?' if token == '%s' else '%'
+    return SQL_TOKEN.sub(replace, statement), (names or None)
+
+class EmbeddedCursor:
+    # mysql.connector-style cursor: dictionary rows, column_names, with_rows,
+    # and rowcount for writes
+    def __init__(self, conn, dictionary=False):
+        self._conn = conn
+        self._raw = conn.backend.raw_cursor(conn.raw)
+        self._dictionary = dictionary
+        self.rowcount = -1
+        self.column_names = ()
+        self.with_rows = False
+
+    def execute(self, query, params=None):
+        reads = is_read_query(query)
+        if not reads:
+            self._conn.begin()
+        for statement, names in self._conn.backend.translate(query, params is not None):
+            if params is None:
+                self._raw.execute(statement)
+            else:
+                self._raw.execute(statement, [params[name] for name in names] if names else list(params))
+        self.with_rows = reads
+        self.column_names = tuple(column[0] for column in self._raw.description or ()) if reads else ()
+        self.rowcount = -1 if reads else self._conn.backend.rowcount(self._raw)
+
+    def executemany(self, query, seq_params):
+        self._conn.begin()
+        self.with_rows = False
+        self.rowcount = self._conn.backend.executemany(self._raw, query, seq_params)
+
+    def _shape(self, rows):
+        if self._dictionary:
+            return [dict(zip(self.column_names, row)) for row in rows]
+        return [tuple(row) for row in rows]
+
+    def fetchone(self):
+        row = self._raw.fetchone() if self.with_rows else None
+        return None if row is None else self._shape([row])[0]
+
+    def fetchmany(self, size=1):
+        return self._shape(self._raw.fetchmany(size)) if self.with_rows else []
+
+    def fetchall(self):
+        return self._shape(self._raw.fetchall()) if self.with_rows else []
+
+    def close(self):
+        self._conn.backend.close_cursor(self._raw)
+
+class EmbeddedConnection:
+    # mysql.connector-style connection over an embedded database. The first
+    # write (or start_transaction) opens a transaction and takes the backend's
+    # write lock; commit/rollback end both. Plain reads run in autocommit.
+    def __init__(self, backend, raw):
+        self.backend = backend
+        self.raw = raw
+        self.in_transaction = False
+        self._open = True
+
+    def is_connected(self):
+        return self._open
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        if not self._open:
+            raise ConnectionError("Embedded database connection is closed")
+
+    def cursor(self, dictionary=False, buffered=True):
+        return EmbeddedCursor(self, dictionary)
+
+    def begin(self):
+        if self.in_transaction:
+            return
+        self.backend.acquire_writer()
+        try:
+            self.raw.execute(self.backend.begin_sql)
+        except Exception:
+            self.backend.release_writer()
+            raise
+        self.in_transaction = True
+
+    start_transaction = begin
+
+    def _end(self, statement):
+        if not self.in_transaction:
+            return
+        try:
+            self.raw.execute(statement)
+        finally:
+            self.in_transaction = False
+            self.backend.release_writer()
+
+    def commit(self):
+        self._end("COMMIT")
+
+    def rollback(self):
+        self._end("ROLLBACK")
+
+    def close(self):
+        if not self._open:
+            return
+        try:
+            self.rollback()
+        finally:
+            self._open = False
+            self.raw.close()
+
+class EmbeddedBackend:
+    embedded = True
+    fulltext = False
+    begin_sql = "BEGIN"
+    rewrites = EMBEDDED_REWRITES
+
+    def __init__(self, path, busy_timeout=30.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._rewrites = [(re.compile(pattern, re.IGNORECASE), replacement)
+                          for pattern, replacement in self.rewrites]
+        self._translated = {}
+        self._writer = threading.Lock()
+        self._named = {}
+        self._lock = threading.Lock()
+        self.stats = {'translations': 0, 'write_transactions': 0, 'write_wait_seconds': 0.0,
+                      'max_write_wait_seconds': 0.0}
+
+    def connect(self):
+        return EmbeddedConnection(self, self._open())
+
+    def rewrite(self, query):
+        # One MySQL statement -> the statements to run here. CREATE TABLE loses
+        # its inline INDEX clauses, which follow as CREATE INDEX when supported.
+        statements = [query]
+        table = CREATE_TABLE.search(query)
+        if table:
+            indexes = INLINE_INDEX.findall(query)
+            statements = [INLINE_INDEX.sub('', query)]
+            if self.secondary_indexes:
+                statements += [f"CREATE INDEX IF NOT EXISTS {name} ON {table.group(1)} ({columns})"
+                               for name, columns in indexes]
+        for pattern, replacement in self._rewrites:
+            statements = [pattern.sub(replacement, statement) for statement in statements]
+        return statements
+
+    def translate(self, query, with_params=True):
+        # [(statement, parameter names or None)], cached per distinct query;
+        # IN lists are built per batch size, so the cache is bounded
+        key = (query, with_params)
+        translated = self._translated.get(key)
+        if translated is None:
+            translated = [_bind_placeholders(statement, with_params) for statement in self.rewrite(query)]
+            with self._lock:
+                if len(self._translated) >= 4096:
+                    self._translated.clear()
+                self._translated[key] = translated
+                self.stats['translations'] += 1
+        return translated
+
+    def raw_cursor(self, raw):
+        return raw.cursor()
+
+    def close_cursor(self, cursor):
+        cursor.close()
+
+    def rowcount(self, cursor):
+        return cursor.rowcount
+
+    def executemany(self, cursor, query, seq_params):
+        (statement, _), = self.translate(query)
+        cursor.executemany(statement, [list(params) for params in seq_params])
+        return cursor.rowcount
+
+    def acquire_writer(self):
+        started = time.perf_counter()
+        if not self._writer.acquire(timeout=self.busy_timeout):
+            raise TimeoutError(f"Timed out after {self.busy_timeout}s waiting to write to {self.path}")
+        waited = time.perf_counter() - started
+        with self._lock:
+            self.stats['write_transactions'] += 1
+            self.stats['write_wait_seconds'] += waited
+            self.stats['max_write_wait_seconds'] = max(self.stats['max_write_wait_seconds'], waited)
+
+    def release_writer(self):
+        self._writer.release()
+
+    @contextmanager
+    def named_lock(self, name, timeout):
+        with self._lock:
+            lock = self._named.setdefault(name, threading.Lock())
+        if not lock.acquire(timeout=timeout):
+            raise TimeoutError(f"Timed out after {timeout}s waiting for the {name} lock")
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'backend': self.name,
+                'path': self.path,
+                'size_bytes': os.path.getsize(self.path) if os.path.exists(self.path) else None,
+                **self.stats,
+                'write_wait_seconds': round(self.stats['write_wait_seconds'], 3),
+                'max_write_wait_seconds': round(self.stats['max_write_wait_seconds'], 3),
+                'cached_translations': len(self._translated),
+            }
+
+    def close(self):
+        pass
+
+def _sqlite_datetime(value):
+    try:
+        return datetime.fromisoformat(value.decode())
+    except ValueError:
+        return value.decode()
+
+def _sqlite_regexp(pattern, value):
+    return value is not None and re.search(pattern, str(value)) is not None
+
+def _sqlite_greatest(*values):
+    return None if any(value is None for value in values) else max(values)
+
+class _SqliteStddev:
+    # MySQL's STDDEV: population standard deviation
+    def __init__(self):
+        self.count, self.total, self.squares = 0, 0.0, 0.0
+
+    def step(self, value):
+        if value is not None:
+            self.count += 1
+            self.total += value
+            self.squares += value * value
+
+    def finalize(self):
+        if not self.count:
+            return None
+        mean = self.total / self.count
+        return math.sqrt(max(self.squares / self.count - mean * mean, 0.0))
+
+class SQLiteBackend(EmbeddedBackend):
+    name = 'sqlite'
+    secondary_indexes = True
+    # Take SQLite's write lock up front; a deferred transaction that reads
+    # first can fail to upgrade when another process wrote in between
+    begin_sql = "BEGIN IMMEDIATE"
+    explain_prefix = "EXPLAIN QUERY PLAN "
+    index_exists_sql = "SELECT 1 AS found FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s"
+    column_exists_sql = "SELECT 1 AS found FROM pragma_table_info(%s) WHERE name = %s"
+    # NOW, REGEXP, GREATEST, POW, SQRT and STDDEV are registered as functions
+    rewrites = EMBEDDED_REWRITES + (
+        (r'\bNOW\(\)\s*-\s*INTERVAL (%s|\d+) (HOUR|MINUTE|DAY)\b', r"datetime(NOW(), '-' || \1 || ' \2S')"),
+    )
+
+    def __init__(self, path, busy_timeout=30.0):
+        if path == ':memory:' or not path:
+            raise ValueError("The SQLite backend needs a file (DB_PATH); each connection would "
+                             "get its own in-memory database")
+        super().__init__(path, busy_timeout)
+        sqlite3.register_converter('DATETIME', _sqlite_datetime)
+        sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+
+    def _open(self):
+        raw = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                              check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        raw.execute("PRAGMA journal_mode=WAL")
+        raw.execute("PRAGMA synchronous=NORMAL")
+        raw.create_function('NOW', 0, lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        raw.create_function('REGEXP', 2, _sqlite_regexp, deterministic=True)
+        raw.create_function('GREATEST', -1, _sqlite_greatest, deterministic=True)
+        raw.create_function('POW', 2, lambda x, y: None if x is None or y is None else math.pow(x, y),
+                            deterministic=True)
+        raw.create_function('SQRT', 1, lambda x: None if x is None or x < 0 else math.sqrt(x),
+                            deterministic=True)
+        raw.create_aggregate('STDDEV', 1, _SqliteStddev)
+        return raw
+
+    @contextmanager
+    def named_lock(self, name, timeout):
+        # Also hold an exclusive transaction on a side file, so the lock covers
+        # other processes using the same database (e.g. bookscape_import.py)
+        with super().named_lock(name, timeout):
+            lock = sqlite3.connect(f"{self.path}.{name}.lock", timeout=timeout, isolation_level=None)
+            try:
+                lock.execute("BEGIN EXCLUSIVE")
+                yield
+            finally:
+                lock.close()
+
+class DuckDBBackend(EmbeddedBackend):
+    name = 'duckdb'
+    # Columnar scans with per-row-group min/max already serve the analytical
+    # queries; ART indexes would only slow writes and block ALTER TABLE
+    secondary_indexes = False
+    begin_sql = "BEGIN TRANSACTION"
+    explain_prefix = "EXPLAIN "
+    index_exists_sql = "SELECT 1 AS found FROM duckdb_indexes() WHERE table_name = %s AND index_name = %s"
+    column_exists_sql = ("SELECT 1 AS found FROM information_schema.columns "
+                         "WHERE table_name = %s AND column_name = %s")
+    rewrites = EMBEDDED_REWRITES + (
+        (r'\bNOW\(\)\s*-\s*INTERVAL (%s|\d+) (HOUR|MINUTE|DAY)\b', r'current_localtimestamp() - \1 * INTERVAL 1 \2'),
+        (r'\bNOW\(\)', "date_trunc('second', current_localtimestamp())"),
+        (r'\bSTDDEV\(', 'STDDEV_POP('),
+        # MySQL's default collation compares case-insensitively
+        (r'\bLIKE\b', 'ILIKE'),
+        (r"([\w.]+) REGEXP ('(?:[^']|'')*'|%s)", r'regexp_matches(\1, \2)'),
+        (r'\bTINYINT\(\d+\)', 'TINYINT'),
+        # DuckDB cannot add a column with a constraint; the DEFAULT still fills old rows
+        (r'(\bADD COLUMN \w+ \w+(?:\(\d+\))?) NOT NULL\b', r'\1'),
+    )
+
+    def __init__(self, path, busy_timeout=30.0):
+        import duckdb
+        super().__init__(path, busy_timeout)
+        # Every pooled connection is a cursor of this one database instance
+        self._root = duckdb.connect(path)
+
+    def _open(self):
+        with self._lock:
+            return self._root.cursor()
+
+    def raw_cursor(self, raw):
+        # A DuckDB connection runs one statement at a time, so it is its own cursor
+        return raw
+
+    def close_cursor(self, cursor):
+        pass
+
+    def rowcount(self, cursor):
+        # Writes return their affected-row count as a one-row "Count" result
+        if cursor.description and cursor.description[0][0] == 'Count':
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        return -1
+
+    def executemany(self, cursor, query, seq_params):
+        # Binding thousands of scalars is what makes row-at-a-time writes slow
+        # here, so INSERTs and keyed UPDATEs pass each column as one list and
+        # UNNEST it into a single statement; anything else runs once per row
+        (statement, _), = self.translate(query)
+        rows = [tuple(params) for params in seq_params]
+        if not rows:
+            return 0
+        columns = [list(column) for column in zip(*rows)]
+        unnest = ', '.join(f'UNNEST(?) AS c{i}' for i in range(len(columns)))
+        values = re.search(r'\bVALUES\s*\([?,\s]*\)', statement, re.IGNORECASE)
+        update = KEYED_UPDATE.match(statement)
+        if values and statement.lstrip().upper().startswith('INSERT'):
+            cursor.execute(f"{statement[:values.start()]}SELECT {unnest}{statement[values.end():]}", columns)
+            return self.rowcount(cursor)
+        if update:
+            table, assignments, key = update.groups()
+            targets = re.findall(r'(\w+) = \?', assignments)
+            cursor.execute(f"UPDATE {table} SET {', '.join(f'{col} = v.c{i}' for i, col in enumerate(targets))} "
+                           f"FROM (SELECT {unnest}) AS v WHERE {table}.{key} = v.c{len(targets)}", columns)
+            return self.rowcount(cursor)
+        total = 0
+        for params in rows:
+            cursor.execute(statement, list(params))
+            total += self.rowcount(cursor)
+        return total
+
+    def close(self):
+        self._root.close()
+
+STORAGE_BACKENDS = {'mysql': MySQLBackend, 'sqlite': SQLiteBackend, 'duckdb': DuckDBBackend}
+DEFAULT_DB_PATHS = {'sqlite': 'bookscape.sqlite', 'duckdb': 'bookscape.duckdb'}
+
+@st.cache_resource
+def get_storage_backend():
+    name = os.getenv('DB_BACKEND', 'mysql').lower()
+    if name not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown DB_BACKEND {name!r}; expected one of {', '.join(STORAGE_BACKENDS)}")
+    if name == 'mysql':
+        return MySQLBackend()
+    try:
+        return STORAGE_BACKENDS[name](os.getenv('DB_PATH', DEFAULT_DB_PATHS[name]),
+                                      busy_timeout=float(os.getenv('DB_BUSY_TIMEOUT', 30)))
+    except ImportError:
+        raise RuntimeError("DB_BACKEND=duckdb needs the duckdb package (pip install duckdb)")
+
+def dialect_sql(query):
+    # The statement(s) the current backend actually runs for a MySQL query
+    return ";\n".join(statement for statement, _ in get_storage_backend().translate(query, with_params=False))
+
+def reset_storage():
+    # Close and forget every per-process resource bound to the current
+    # backend, so the next call picks up a changed DB_BACKEND / DB_PATH
+    # (bookscape_bench.py compares backends this way)
+    get_connection_pool().close()
+    get_storage_backend().close()
+    for resource in (get_similarity_index, get_analytics_snapshot, get_query_cache, get_read_router,
+                     get_connection_pool, get_storage_backend, get_schema_state):
+        resource.clear()
+
+# ──────────────────────────────────────────────
+# 2. Core Functions
+# ──────────────────────────────────────────────
+BOOKS_API_URL = os.getenv('BOOKS_API_URL', "https://www.googleapis.com/books/v1/volumes")
+BOOKS_API_KEY = os.getenv('xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx')
+# Largest page the volumes endpoint will return
+BOOKS_API_PAGE_SIZE = 40
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    # Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+# Keep-alive HTTP session and rate limiter shared by every session and worker thread
+@st.cache_resource
+def get_http_session():
+    import requests
+    session = requests.Session()
+    workers = int(os.getenv('HARVEST_WORKERS', 4))
+    # One pool per host: the Books API, Google cover images and the home page image
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(10, workers * 2))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@st.cache_resource
+def get_api_rate_limiter():
+    return TokenBucket(
+        rate=float(os.getenv('API_RATE_PER_SEC', 5)),
+        capacity=float(os.getenv('API_RATE_BURST', 10)),
+    )
+
+def _retry_delay(attempt, response=None):
+    # Honour Retry-After when the server sends one, otherwise full-jitter exponential backoff
+    if response is not None and response.headers.get('Retry-After', '').isdigit():
+        return float(response.headers['Retry-After'])
+    return random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+
+def _api_get(url, params, name, label):
+    # GET a Books API URL, retrying 429/5xx and network errors.
+    # Returns the response once it is final (success or a non-retryable status).
+    import requests
+    session = get_http_session()
+    limiter = get_api_rate_limiter()
+    retries = int(os.getenv('API_MAX_RETRIES', 5))
+
+    profiler = get_query_profiler()
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = session.get(url, params=params,
+                                   timeout=float(os.getenv('API_TIMEOUT', 10)))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            profiler.record(name, time.perf_counter() - started, error=e, sql=label)
+            if attempt == retries:
+                raise
+            time.sleep(_retry_delay(attempt))
+            continue
+
+        if response.status_code >= 400:
+            profiler.record(name, time.perf_counter() - started,
+                            error=f"HTTP {response.status_code}", sql=label)
+        if response.status_code in RETRY_STATUSES and attempt < retries:
+            time.sleep(_retry_delay(attempt, response))
+            continue
+        response.elapsed_seconds = time.perf_counter() - started
+        return response
+
+def json_loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def json_dumps(value):
+    return orjson.dumps(value).decode('utf-8') if orjson else json.dumps(value)
+
+def request_volumes(query, max_results=10, start_index=0):
+    # One page of the volumes endpoint.
+    # Returns the decoded JSON body and raises once retries are exhausted.
+    params = {
+        "q": query,
+        "maxResults": max_results,
+        "startIndex": start_index,
+        "key": BOOKS_API_KEY
+    }
+    response = _api_get(BOOKS_API_URL, params, "api:volumes", query)
+    response.raise_for_status()
+    data = json_loads(response.content)
+    get_query_profiler().record("api:volumes", response.elapsed_seconds,
+                                rows=len(data.get('items', [])), sql=query)
+    return data
+
+def request_volume(volume_id):
+    # A single volume by id, or None when the API no longer knows it
+    response = _api_get(f"{BOOKS_API_URL}/{volume_id}", {"key": BOOKS_API_KEY}, "api:volume", volume_id)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    data = json_loads(response.content)
+    get_query_profiler().record("api:volume", response.elapsed_seconds, rows=1, sql=volume_id)
+    return data
+
+# ──────────────────────────────────────────────
+# 2a. API Response Cache
+# ──────────────────────────────────────────────
+class ResponseCache:
+    # Two-tier cache for Books API pages: an in-memory LRU in front of a
+    # SQLite file. Both tiers honour a per-entry TTL and a size bound.
+    def __init__(self, path, ttl=3600, memory_entries=256, disk_entries=10000):
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS api_cache (
+                cache_key TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_api_cache_accessed ON api_cache (accessed_at)")
+        self._db.commit()
+        self._disk_count = self._db.execute("SELECT COUNT(*) FROM api_cache").fetchone()[0]
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+            'stores': 0,
+        }
+
+    @staticmethod
+    def make_key(query, max_results, start_index):
+        normalized = " ".join(query.lower().split())
+        return f"{normalized}|{max_results}|{start_index}"
+
+    def _remember(self, key, payload, expires_at):
+        self._memory[key] = (payload, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.stats['memory_evictions'] += 1
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return entry[0]
+                del self._memory[key]
+
+            row = self._db.execute(
+                "SELECT payload, expires_at FROM api_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row and row[1] > now:
+                self._db.execute("UPDATE api_cache SET accessed_at = ? WHERE cache_key = ?", (now, key))
+                self._db.commit()
+                payload = json_loads(row[0])
+                self._remember(key, payload, row[1])
+                self.stats['disk_hits'] += 1
+                return payload
+            if row or entry:
+                self.stats['expired'] += 1
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key, payload, ttl=None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, payload, expires_at)
+            existed = self._db.execute("SELECT 1 FROM api_cache WHERE cache_key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO api_cache (cache_key, payload, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json_dumps(payload), expires_at, now)
+            )
+            if not existed:
+                self._disk_count += 1
+            self.stats['stores'] += 1
+            if self._disk_count > self.disk_entries:
+                # Drop expired entries first, then the least recently used 10%
+                evicted = self._db.execute("DELETE FROM api_cache WHERE expires_at <= ?", (now,)).rowcount
+                excess = self._disk_count - evicted - int(self.disk_entries * 0.9)
+                if excess > 0:
+                    evicted += self._db.execute(
+                        "DELETE FROM api_cache WHERE cache_key IN "
+                        "(SELECT cache_key FROM api_cache ORDER BY accessed_at LIMIT ?)", (excess,)
+                    ).rowcount
+                self._disk_count = self._db.execute("SELECT COUNT(*) FROM api_cache").fetchone()[0]
+                self.stats['disk_evictions'] += evicted
+            self._db.commit()
+
+    def metrics(self):
+        with self._lock:
+            hits = self.stats['memory_hits'] + self.stats['disk_hits']
+            lookups = hits + self.stats['misses']
+            return {
+                **self.stats,
+                'memory_entries': len(self._memory),
+                'disk_entries': self._disk_count,
+                'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+            }
+
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(
+        os.getenv('API_CACHE_PATH', '.bookscape_cache.sqlite'),
+        ttl=float(os.getenv('API_CACHE_TTL', 3600)),
+        memory_entries=int(os.getenv('API_CACHE_MEMORY_ENTRIES', 256)),
+        disk_entries=int(os.getenv('API_CACHE_DISK_ENTRIES', 10000)),
+    )
+
+def get_volumes_page(query, max_results=10, start_index=0, refresh=False):
+    # Cached request_volumes; refresh=True skips the lookup and overwrites the entry
+    cache = get_response_cache()
+    key = ResponseCache.make_key(query, max_results, start_index)
+    if not refresh:
+        data = cache.get(key)
+        if data is not None:
+            return data
+    data = request_volumes(query, max_results, start_index)
+    cache.put(key, data)
+    return data
+
+def fetch_books(query, max_results=10, refresh=False):
+    # Profiled end to end, so cache hits show up as fast fetch_books calls
+    started = time.perf_counter()
+    try:
+        data = get_volumes_page(query, max_results, refresh=refresh)
+        items = data.get('items', [])
+        get_query_profiler().record("fetch_books", time.perf_counter() - started, rows=len(items), sql=query)
+        return items
+    except Exception as e:
+        get_query_profiler().record("fetch_books", time.perf_counter() - started, error=e, sql=query)
+        st.error(f"API Error: {str(e)}")
+        return []
+
+def harvest_books(query, max_items=1000, page_size=BOOKS_API_PAGE_SIZE, workers=None, refresh=False):
+    # Walk startIndex pages concurrently and merge them, de-duplicated by volume id.
+    # The first page is fetched alone to learn totalItems; the rest fan out over a
+    # bounded thread pool sharing the keep-alive session and rate limiter.
+    started = time.perf_counter()
+    workers = workers or int(os.getenv('HARVEST_WORKERS', 4))
+    page_size = min(page_size, BOOKS_API_PAGE_SIZE, max_items)
+
+    first = get_volumes_page(query, page_size, 0, refresh)
+    pages = {0: first.get('items', [])}
+    total = min(max_items, first.get('totalItems', 0))
+    failed = []
+
+    if pages[0] and total > page_size:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(get_volumes_page, query, page_size, start, refresh): start
+                for start in range(page_size, total, page_size)
+            }
+            for future in as_completed(futures):
+                start = futures[future]
+                if future.cancelled():
+                    continue
+                try:
+                    pages[start] = future.result().get('items', [])
+                except Exception:
+                    failed.append(start)
+                    continue
+                if not pages[start]:
+                    # totalItems is only an estimate; nothing lies beyond an empty page
+                    for other, other_start in futures.items():
+                        if other_start > start:
+                            other.cancel()
+
+    items = {}
+    duplicates = 0
+    for start in sorted(pages):
+        for item in pages[start]:
+            if item.get('id') in items:
+                duplicates += 1
+            elif item.get('id') and len(items) < max_items:
+                items[item['id']] = item
+
+    return {
+        'items': list(items.values()),
+        'total_items': first.get('totalItems', 0),
+        'pages': len(pages),
+        'failed_pages': sorted(failed),
+        'duplicates': duplicates,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+class BookRecord(NamedTuple):
+    # One books row as parsed from the API, in column order (see BOOK_COLUMNS).
+    # A tuple, so it goes to executemany without being copied into another
+    # container; get() keeps dict-style callers such as book filters working.
+    book_id: str
+    title: str
+    authors: str
+    publisher: str
+    published_year: str
+    description: str
+    isbn: str
+    page_count: int
+    categories: str
+    average_rating: float
+    ratings_count: int
+    price: float
+    currency: str
+    thumbnail: str
+    pub_year: int       # published_year as a number, None unless four digits
+    is_ebook: int       # saleInfo.isEbook as 1/0, None when the API omits it
+    import_timestamp: str
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+def typed_year(published_year):
+    return int(published_year) if published_year and len(published_year) == 4 and published_year.isdigit() else None
+
+def book_record(item, import_timestamp):
+    volume = item.get('volumeInfo') or {}
+    sale = item.get('saleInfo') or {}
+    retail_price = sale.get('retailPrice') or {}
+    is_ebook = sale.get('isEbook')
+    get = volume.get
+    published_year = get('publishedDate', '')[:4]
+
+    isbn = ''
+    for identifier in get('industryIdentifiers') or ():
+        if identifier.get('type') in ('ISBN_10', 'ISBN_13'):
+            isbn = identifier['identifier']
+            break
+
+    # Values are bound as query parameters when stored, so no manual quote escaping here
+    return BookRecord(
+        item['id'],
+        get('title', 'Unknown'),
+        "|".join(get('authors', ('Unknown',))),
+        get('publisher', 'Unknown'),
+        published_year,
+        get('description', '')[:500],
+        isbn,
+        get('pageCount', 0),
+        "|".join(get('categories', ('Uncategorized',))),
+        float(get('averageRating', 0)),
+        int(get('ratingsCount', 0)),
+        float(retail_price.get('amount', 0)),
+        retail_price.get('currencyCode', 'USD'),
+        (get('imageLinks') or {}).get('thumbnail', ''),
+        typed_year(published_year),
+        None if is_ebook is None else int(bool(is_ebook)),
+        import_timestamp,
+    )
+
+def process_page(items, import_timestamp=None):
+    # A whole API page at once, stamped with one timestamp.
+    # Returns (records, number of items that could not be parsed).
+    import_timestamp = import_timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    records = []
+    failed = 0
+    for item in items:
+        try:
+            records.append(book_record(item, import_timestamp))
+        except Exception:
+            failed += 1
+    return records, failed
+
+def process_book(item):
+    # Single-item form returning a dict, for callers that want one
+    return book_record(item, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))._asdict()
+
+# ──────────────────────────────────────────────
+# 2b. Storing Books
+# ──────────────────────────────────────────────
+BOOK_COLUMNS = BookRecord._fields + ('content_hash',)
+# Columns that come from the API and feed content_hash
+CONTENT_COLUMNS = BOOK_COLUMNS[1:BOOK_COLUMNS.index('import_timestamp')]
+# A re-import overwrites everything but the key, so ratings, prices and
+# thumbnails never go stale and book_categories (rebuilt on every store)
+# always matches books.categories; import_timestamp moves so incremental
+# readers (the analytics snapshot, refresh_stale_books) see re-imports.
+BOOK_UPDATE_COLUMNS = BOOK_COLUMNS[1:]
+
+UPSERT_BOOK_SQL = f"""
+    INSERT INTO books ({', '.join(BOOK_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(BOOK_COLUMNS))})
+    ON DUPLICATE KEY UPDATE
+        {', '.join(f'{col}=VALUES({col})' for col in BOOK_UPDATE_COLUMNS)}
+"""
+
+def content_hash(values):
+    # SHA-1 over the CONTENT_COLUMNS values, in order
+    text = '\x1f'.join('' if value is None else str(value) for value in values)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def book_params(book, import_timestamp=None):
+    # Ensure all required fields are present with defaults, in BOOK_COLUMNS order
+    if isinstance(book, BookRecord):
+        # Already complete and in column order
+        content = book[1:-1]
+        return (*book[:-1], book.import_timestamp or import_timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                content_hash(content))
+    content = (
+        book.get('title', 'Unknown'),
+        book.get('authors', 'Unknown'),
+        book.get('publisher', 'Unknown'),
+        book.get('published_year', ''),
+        (book.get('description') or '')[:500],  # Truncate if needed
+        book.get('isbn', ''),
+        book.get('page_count', 0),
+        book.get('categories', 'Uncategorized'),
+        book.get('average_rating', 0.0),
+        book.get('ratings_count', 0),
+        book.get('price', 0.0),
+        book.get('currency', 'USD'),
+        book.get('thumbnail', ''),
+        typed_year(book.get('published_year', '')),
+        book.get('is_ebook'),
+    )
+    return (
+        book.get('book_id', ''),
+        *content,
+        book.get('import_timestamp') or import_timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        content_hash(content),
+    )
+
+def split_names(value, skip=('Unknown',)):
+    names = []
+    for name in (value or '').split('|'):
+        name = name.strip()[:255]
+        if name and name not in skip and name not in names:
+            names.append(name)
+    return names
+
+def sync_book_relations(cursor, books):
+    # Rewrite book_authors/book_categories for (book_id, authors, categories) tuples
+    ids = [book_id for book_id, _, _ in books]
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"DELETE FROM book_authors WHERE book_id IN ({placeholders})", ids)
+    cursor.execute(f"DELETE FROM book_categories WHERE book_id IN ({placeholders})", ids)
+
+    authors = [(book_id, name) for book_id, names, _ in books for name in split_names(names)]
+    categories = [(book_id, name) for book_id, _, names in books for name in split_names(names, skip=())]
+    if authors:
+        cursor.executemany("INSERT INTO book_authors (book_id, author) VALUES (%s, %s)", authors)
+    if categories:
+        cursor.executemany("INSERT INTO book_categories (book_id, category) VALUES (%s, %s)", categories)
+
+def store_books_bulk(books, batch_size=None):
+    # Upsert books in multi-row batches inside one transaction.
+    # Returns one stats dict per batch with inserted/updated/unchanged counts;
+    # unchanged books (same content_hash) are still written, to move their
+    # import_timestamp.
+    batch_size = batch_size or int(os.getenv('STORE_BATCH_SIZE', 500))
+    import_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # Later duplicates of the same id win, like they would with row-by-row upserts
+    rows = {}
+    for book in books:
+        params = book_params(book, import_timestamp)
+        if params[0]:
+            rows[params[0]] = params
+    rows = list(rows.values())
+
+    # SUMMARY_TABLES=0 skips per-batch maintenance (e.g. for a large load
+    # followed by rebuild_aggregates); the summaries are then marked stale
+    maintain_summaries = os.getenv('SUMMARY_TABLES', '1') != '0'
+    # DEDUP=0 skips edition clustering; backfill_works catches up later
+    cluster_editions = os.getenv('DEDUP', '1') != '0'
+
+    batches = []
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            conn.start_transaction()
+            if not maintain_summaries and rows:
+                mark_aggregates_stale(cursor)
+            for offset in range(0, len(rows), batch_size):
+                started = time.perf_counter()
+                batch = rows[offset:offset + batch_size]
+                ids = [row[0] for row in batch]
+
+                before = aggregate_snapshot(cursor, ids)
+                cursor.execute(f"SELECT book_id, content_hash FROM books "
+                               f"WHERE book_id IN ({', '.join(['%s'] * len(ids))})", ids)
+                stored_hashes = dict(cursor.fetchall())
+
+                cursor.executemany(UPSERT_BOOK_SQL, batch)
+                # Affected-row counts cannot tell these apart: every upsert
+                # changes at least import_timestamp
+                inserted = len(batch) - len(stored_hashes)
+                unchanged = sum(1 for row in batch if stored_hashes.get(row[0]) == row[-1])
+                updated = len(stored_hashes) - unchanged
+
+                authors_at = BOOK_COLUMNS.index('authors')
+                categories_at = BOOK_COLUMNS.index('categories')
+                sync_book_relations(cursor, [(row[0], row[authors_at], row[categories_at]) for row in batch])
+                if cluster_editions:
+                    title_at, isbn_at = BOOK_COLUMNS.index('title'), BOOK_COLUMNS.index('isbn')
+                    if assign_works(cursor, [(row[0], row[title_at], row[authors_at], row[isbn_at])
+                                             for row in batch])['merged']:
+                        # Two earlier works merged; their publishers' work counts are now off
+                        mark_aggregates_stale(cursor)
+                if maintain_summaries:
+                    maintain_aggregates(cursor, before, aggregate_snapshot(cursor, ids))
+                elapsed = time.perf_counter() - started
+                get_query_profiler().record("store_books_bulk:batch", elapsed, rows=len(batch))
+                batches.append({
+                    'batch': len(batches) + 1,
+                    'rows': len(batch),
+                    'inserted': inserted,
+                    'updated': updated,
+                    'unchanged': unchanged,
+                    'seconds': round(elapsed, 4),
+                    'rows_per_sec': round(len(batch) / elapsed, 1) if elapsed else None,
+                })
+            if rows:
+                bump_data_version(cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    get_query_cache().expire_version()
+    return batches
+
+def store_books(books):
+    if not books:
+        return 0
+
+    try:
+        batches = store_books_bulk(books)
+    except Exception as e:
+        st.error(f"Failed to store books: {str(e)}")
+        return 0
+    note_session_write()
+    return sum(b['rows'] for b in batches)
+
+# Reference path: one parameterized upsert and commit per book, kept for
+# throughput comparisons against store_books_bulk (bookscape_bench.py run --per-row)
+def store_books_row_by_row(books):
+    total = 0
+    for book in books:
+        result = execute_query(UPSERT_BOOK_SQL, book_params(book))
+        if result:
+            total += 1
+    return total
+	
+# ──────────────────────────────────────────────
+# 2c. Keyword Search
+# ──────────────────────────────────────────────
+# Ranked search over the ft_books_text FULLTEXT index. InnoDB updates the
+# index as store_books commits, so new imports are searchable immediately.
+FULLTEXT_COLUMNS = "title, authors, description"
+FULLTEXT_MATCH = f"MATCH({FULLTEXT_COLUMNS}) AGAINST (%(text)s IN NATURAL LANGUAGE MODE)"
+SEARCH_COLUMNS = """
+    book_id, title, authors, published_year,
+    average_rating, ratings_count, page_count,
+    categories, thumbnail
+"""
+# Embedded backends have no FULLTEXT index; there each query word found in
+# one of these columns adds its weight to the score instead
+KEYWORD_WEIGHTS = (('title', 2), ('authors', 1), ('description', 1))
+KEYWORD_TOKEN = re.compile(r'[^\W_]{2,}')
+
+def keyword_match(text, params):
+    # Score expression over up to 8 distinct words of `text`; adds their LIKE patterns to params
+    terms = []
+    for i, word in enumerate(list(dict.fromkeys(KEYWORD_TOKEN.findall(text.lower())))[:8]):
+        params[f'word{i}'] = f"%{word}%"
+        terms.extend(f"CASE WHEN LOWER({column}) LIKE %(word{i})s THEN {weight} ELSE 0 END"
+                     for column, weight in KEYWORD_WEIGHTS)
+    return f"({' + '.join(terms)})" if terms else "0"
+
+def book_search_query(text=None, conditions=(), params=None, limit=50):
+    # Top-k books by relevance to `text` (or by rating without one), plus extra filters
+    conditions = list(conditions)
+    params = dict(params or {})
+    query = f"SELECT {SEARCH_COLUMNS}"
+    if text and get_storage_backend().fulltext:
+        query += f", {FULLTEXT_MATCH} AS score"
+        conditions.insert(0, FULLTEXT_MATCH)
+        params['text'] = text
+    elif text:
+        match = keyword_match(text, params)
+        query += f", {match} AS score"
+        conditions.insert(0, f"{match} > 0")
+    query += " FROM books"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY " + ("score DESC, average_rating DESC" if text else "average_rating DESC")
+    query += f" LIMIT {int(limit)}"
+    return query, params
+
+def search_books(text, limit=20):
+    query, params = book_search_query(text, limit=limit)
+    return execute_query(query, params) or []
+
+# ──────────────────────────────────────────────
+# 2d. Ingestion Pipeline
+# ──────────────────────────────────────────────
+# fetch pages -> process_page -> filter/batch -> store_books_bulk, each stage
+# in its own thread and joined by bounded queues, so a slow stage applies
+# backpressure upstream instead of letting results pile up in memory.
+_PIPELINE_DONE = object()
+
+def iter_volume_pages(query, max_items, page_size=BOOKS_API_PAGE_SIZE, refresh=False, workers=None,
+                      start_index=0):
+    # Yield result pages in startIndex order (start_index, start_index + page_size, ...)
+    # up to max_items, keeping a few requests in flight
+    workers = workers or int(os.getenv('HARVEST_WORKERS', 4))
+    starts = iter(range(start_index, max_items, page_size))
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def submit_next():
+            start = next(starts, None)
+            if start is not None:
+                size = min(page_size, max_items - start)
+                pending.append(pool.submit(get_volumes_page, query, size, start, refresh))
+
+        for _ in range(workers):
+            submit_next()
+        try:
+            while pending:
+                items = pending.popleft().result().get('items', [])
+                if not items:
+                    break
+                yield items
+                submit_next()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def run_ingest_pipeline(query, max_items=BOOKS_API_PAGE_SIZE, book_filter=None, batch_size=None,
+                        refresh=False, queue_size=4, preview_size=5, progress=None, cancel=None):
+    # progress(result) is called after every fetched page and stored batch.
+    # Setting the `cancel` event stops fetching; batches not yet stored are dropped.
+    batch_size = batch_size or int(os.getenv('STORE_BATCH_SIZE', 500))
+    started = time.perf_counter()
+    stop = threading.Event()
+    errors = []
+    pages, books, batches = (queue.Queue(maxsize=queue_size) for _ in range(3))
+    stages = {name: {'busy_seconds': 0.0, 'wait_seconds': 0.0, 'items': 0}
+              for name in ('fetch', 'process', 'filter', 'store')}
+    result = {
+        'pages': 0, 'fetched': 0, 'processed': 0, 'failed': 0, 'duplicates': 0, 'filtered_out': 0,
+        'stored': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'batches': 0,
+        'preview': [], 'sample_item': None, 'cancelled': False,
+    }
+
+    def cancelled():
+        return cancel is not None and cancel.is_set()
+
+    def put(stage, outbox, value):
+        # Blocks while downstream is full; gives up if the pipeline is stopping
+        waited = time.perf_counter()
+        while not stop.is_set():
+            try:
+                outbox.put(value, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stages[stage]['wait_seconds'] += time.perf_counter() - waited
+
+    def get(stage, inbox):
+        waited = time.perf_counter()
+        while not stop.is_set():
+            try:
+                value = inbox.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        else:
+            value = _PIPELINE_DONE
+        stages[stage]['wait_seconds'] += time.perf_counter() - waited
+        return value
+
+    def fetch_stage():
+        page_iter = iter_volume_pages(query, max_items, refresh=refresh)
+        try:
+            while not stop.is_set() and not cancelled():
+                busy = time.perf_counter()
+                page = next(page_iter, None)
+                stages['fetch']['busy_seconds'] += time.perf_counter() - busy
+                if page is None:
+                    break
+                stages['fetch']['items'] += len(page)
+                result['pages'] += 1
+                result['fetched'] += len(page)
+                if result['sample_item'] is None:
+                    result['sample_item'] = page[0]
+                if progress:
+                    progress(result)
+                put('fetch', pages, page)
+        except Exception as e:
+            errors.append(('fetch', e))
+        finally:
+            page_iter.close()
+            put('fetch', pages, _PIPELINE_DONE)
+
+    def process_stage():
+        seen = set()
+        try:
+            while True:
+                page = get('process', pages)
+                if page is _PIPELINE_DONE:
+                    break
+                busy = time.perf_counter()
+                fresh = []
+                for item in page:
+                    if item.get('id') in seen:
+                        result['duplicates'] += 1
+                        continue
+                    seen.add(item.get('id'))
+                    fresh.append(item)
+                processed, failed = process_page(fresh)
+                result['failed'] += failed
+                stages['process']['items'] += len(processed)
+                result['processed'] += len(processed)
+                stages['process']['busy_seconds'] += time.perf_counter() - busy
+                put('process', books, processed)
+        except Exception as e:
+            errors.append(('process', e))
+        finally:
+            # Always, so the stages downstream finish with what they have
+            put('process', books, _PIPELINE_DONE)
+
+    def filter_stage():
+        batch = []
+        try:
+            while True:
+                processed = get('filter', books)
+                if processed is _PIPELINE_DONE:
+                    break
+                busy = time.perf_counter()
+                for book in processed:
+                    if book_filter and not book_filter(book):
+                        result['filtered_out'] += 1
+                        continue
+                    batch.append(book)
+                    if len(result['preview']) < preview_size:
+                        result['preview'].append(book)
+                stages['filter']['items'] += len(processed)
+                stages['filter']['busy_seconds'] += time.perf_counter() - busy
+                if len(batch) >= batch_size:
+                    put('filter', batches, batch)
+                    batch = []
+            if batch:
+                put('filter', batches, batch)
+        except Exception as e:
+            errors.append(('filter', e))
+        finally:
+            put('filter', batches, _PIPELINE_DONE)
+
+    threads = [threading.Thread(target=stage, daemon=True)
+               for stage in (fetch_stage, process_stage, filter_stage)]
+    for thread in threads:
+        thread.start()
+
+    # The store stage runs on the calling thread
+    try:
+        while True:
+            batch = get('store', batches)
+            if batch is _PIPELINE_DONE or cancelled():
+                break
+            busy = time.perf_counter()
+            for batch_stats in store_books_bulk(batch, batch_size):
+                for key in ('inserted', 'updated', 'unchanged'):
+                    result[key] += batch_stats[key]
+                result['stored'] += batch_stats['rows']
+                result['batches'] += 1
+            prefetch_thumbnails(batch)
+            stages['store']['items'] += len(batch)
+            stages['store']['busy_seconds'] += time.perf_counter() - busy
+            if progress:
+                progress(result)
+    except Exception as e:
+        errors.append(('store', e))
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    result['cancelled'] = cancelled()
+    result['stages'] = {name: {key: round(value, 4) if isinstance(value, float) else value
+                               for key, value in timing.items()}
+                        for name, timing in stages.items()}
+    result['errors'] = [f"{stage}: {error}" for stage, error in errors]
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    if result['stored']:
+        note_session_write()
+    return result
+
+# ──────────────────────────────────────────────
+# 2e. Summary Tables
+# ──────────────────────────────────────────────
+# table -> (key column, key expression, SELECT producing rows in table column order)
+SUMMARY_TABLES = {
+    'agg_publishers': ('publisher', 'publisher', """
+        SELECT publisher, COUNT(*), COALESCE(SUM(average_rating), 0), COALESCE(SUM(average_rating > 0), 0),
+               COALESCE(SUM(CASE WHEN average_rating > 0 THEN average_rating ELSE 0 END), 0),
+               COUNT(DISTINCT COALESCE(work_id, book_id)), COUNT(average_rating)
+        FROM books {where}
+        GROUP BY publisher
+    """),
+    'agg_authors': ('author', 'author', """
+        SELECT author, COUNT(*)
+        FROM book_authors {where}
+        GROUP BY author
+    """),
+    'agg_category_sets': ('categories', 'categories', """
+        SELECT categories, COUNT(*), COUNT(price), COALESCE(SUM(price), 0), COALESCE(SUM(page_count > 0), 0),
+               COALESCE(SUM(CASE WHEN page_count > 0 THEN page_count ELSE 0 END), 0)
+        FROM books {where}
+        GROUP BY categories
+    """),
+    'agg_years': ('pub_year', 'pub_year', """
+        SELECT pub_year, COUNT(*), COALESCE(SUM(price > 0), 0),
+               COALESCE(SUM(CASE WHEN price > 0 THEN price ELSE 0 END), 0)
+        FROM books {where}
+        GROUP BY pub_year
+    """),
+}
+
+GLOBAL_AGGREGATE_COLUMNS = ('book_count', 'rated_count', 'rating_sum', 'rating_sq_sum',
+                            'reviewed_count', 'ratings_count_sum')
+
+FORMAT_AGGREGATE_COLUMNS = ('book_count', 'paged_count', 'page_sum', 'priced_count', 'price_sum')
+
+def aggregate_snapshot(cursor, ids):
+    # The values of a batch of books that feed the summary tables:
+    # ({book_id: (publisher, pub_year, categories, rating, ratings_count, page_count, price, is_ebook)},
+    #  {authors})
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(
+        f"SELECT book_id, publisher, pub_year, categories, average_rating, ratings_count, page_count, price, "
+        f"is_ebook FROM books WHERE book_id IN ({placeholders})", ids
+    )
+    books = {row[0]: row[1:] for row in cursor.fetchall()}
+    cursor.execute(f"SELECT DISTINCT author FROM book_authors WHERE book_id IN ({placeholders})", ids)
+    authors = {row[0] for row in cursor.fetchall()}
+    return books, authors
+
+def _global_totals(books):
+    totals = [0, 0, 0.0, 0.0, 0, 0.0]
+    for _, _, _, rating, ratings_count, *_ in books.values():
+        rating = rating or 0
+        ratings_count = ratings_count or 0
+        totals[0] += 1
+        if rating > 0:
+            totals[1] += 1
+            totals[2] += rating
+            totals[3] += rating * rating
+        if ratings_count > 0:
+            totals[4] += 1
+            totals[5] += ratings_count
+    return totals
+
+def book_format(is_ebook):
+    return 'unknown' if is_ebook is None else ('ebook' if is_ebook else 'physical')
+
+def _format_totals(books):
+    # {format: FORMAT_AGGREGATE_COLUMNS values}
+    totals = {}
+    for *_, page_count, price, is_ebook in books.values():
+        row = totals.setdefault(book_format(is_ebook), [0, 0, 0.0, 0, 0.0])
+        row[0] += 1
+        if page_count and page_count > 0:
+            row[1] += 1
+            row[2] += page_count
+        if price and price > 0:
+            row[3] += 1
+            row[4] += price
+    return totals
+
+def _recompute_summary(cursor, table, keys=None):
+    key_column, key_expr, select = SUMMARY_TABLES[table]
+    if keys is None:
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"INSERT INTO {table} " + select.format(where=f"WHERE {key_expr} IS NOT NULL"))
+        return
+    keys = [key for key in keys if key is not None]
+    if not keys:
+        return
+    placeholders = ', '.join(['%s'] * len(keys))
+    cursor.execute(f"DELETE FROM {table} WHERE {key_column} IN ({placeholders})", keys)
+    cursor.execute(f"INSERT INTO {table} " + select.format(where=f"WHERE {key_expr} IN ({placeholders})"), keys)
+
+def maintain_aggregates(cursor, before, after):
+    # Recompute only the summary rows whose keys appear in the batch, before or after
+    # the write, and apply the change in global totals as a delta
+    touched = list(before[0].values()) + list(after[0].values())
+    _recompute_summary(cursor, 'agg_publishers', {row[0] for row in touched})
+    _recompute_summary(cursor, 'agg_years', {row[1] for row in touched})
+    _recompute_summary(cursor, 'agg_category_sets', {row[2] for row in touched})
+    _recompute_summary(cursor, 'agg_authors', before[1] | after[1])
+
+    delta = [new - old for new, old in zip(_global_totals(after[0]), _global_totals(before[0]))]
+    if any(delta):
+        cursor.execute(
+            "UPDATE agg_global SET " +
+            ", ".join(f"{col} = {col} + %s" for col in GLOBAL_AGGREGATE_COLUMNS) +
+            " WHERE id = 1",
+            delta
+        )
+
+    # Two or three formats cover the whole catalog, so agg_formats also moves by delta
+    before_formats, after_formats = _format_totals(before[0]), _format_totals(after[0])
+    rows = []
+    for fmt in before_formats.keys() | after_formats.keys():
+        old, new = before_formats.get(fmt, [0] * 5), after_formats.get(fmt, [0] * 5)
+        change = [b - a for a, b in zip(old, new)]
+        if any(change):
+            rows.append((fmt, *change))
+    if rows:
+        cursor.executemany(
+            f"INSERT INTO agg_formats (format, {', '.join(FORMAT_AGGREGATE_COLUMNS)}) "
+            f"VALUES ({', '.join(['%s'] * (len(FORMAT_AGGREGATE_COLUMNS) + 1))}) ON DUPLICATE KEY UPDATE " +
+            ", ".join(f"{col} = {col} + VALUES({col})" for col in FORMAT_AGGREGATE_COLUMNS),
+            rows
+        )
+
+def mark_aggregates_stale(cursor):
+    cursor.execute(
+        "INSERT INTO summary_state (name, is_fresh) VALUES ('aggregates', 0) "
+        "ON DUPLICATE KEY UPDATE is_fresh = 0"
+    )
+
+def rebuild_aggregates():
+    # Full rebuild of every summary table in one transaction
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            conn.start_transaction()
+            for table in SUMMARY_TABLES:
+                _recompute_summary(cursor, table)
+            cursor.execute("""
+                REPLACE INTO agg_global
+                SELECT 1, COUNT(*),
+                       COALESCE(SUM(average_rating > 0), 0),
+                       COALESCE(SUM(CASE WHEN average_rating > 0 THEN average_rating ELSE 0 END), 0),
+                       COALESCE(SUM(CASE WHEN average_rating > 0 THEN average_rating * average_rating ELSE 0 END), 0),
+                       COALESCE(SUM(ratings_count > 0), 0),
+                       COALESCE(SUM(CASE WHEN ratings_count > 0 THEN ratings_count ELSE 0 END), 0)
+                FROM books
+            """)
+            cursor.execute("DELETE FROM agg_formats")
+            cursor.execute("""
+                INSERT INTO agg_formats
+                SELECT CASE WHEN is_ebook IS NULL THEN 'unknown' WHEN is_ebook THEN 'ebook' ELSE 'physical' END,
+                       COUNT(*),
+                       COALESCE(SUM(page_count > 0), 0),
+                       COALESCE(SUM(CASE WHEN page_count > 0 THEN page_count ELSE 0 END), 0),
+                       COALESCE(SUM(price > 0), 0),
+                       COALESCE(SUM(CASE WHEN price > 0 THEN price ELSE 0 END), 0)
+                FROM books
+                GROUP BY is_ebook
+            """)
+            cursor.execute(
+                "INSERT INTO summary_state (name, is_fresh, refreshed_at) VALUES ('aggregates', 1, NOW()) "
+                "ON DUPLICATE KEY UPDATE is_fresh = 1, refreshed_at = NOW()"
+            )
+            bump_data_version(cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    get_query_cache().expire_version()
+
+def aggregates_state():
+    state = execute_query("SELECT is_fresh, refreshed_at FROM summary_state WHERE name = 'aggregates'")
+    return state[0] if state else {'is_fresh': 0, 'refreshed_at': None}
+
+# ──────────────────────────────────────────────
+# 2f. Paged Results
+# ──────────────────────────────────────────────
+def parse_sort_key(sort_key):
+    # "a DESC, b" -> [('a', 'DESC'), ('b', 'ASC')]
+    order = []
+    for part in sort_key.split(','):
+        column, _, direction = part.strip().partition(' ')
+        order.append((column, 'DESC' if direction.strip().upper() == 'DESC' else 'ASC'))
+    return order
+
+def keyset_predicate(order, key, named=False):
+    # WHERE clause for the rows at or after `key` (one value per sort column)
+    # in ORDER BY order, where NULLs sort last in either direction. Returns
+    # (sql, parameter values); named=True uses %(name)s placeholders.
+    values = []
+
+    def bind(value):
+        values.append(value)
+        return f"%(_key{len(values) - 1})s" if named else "%s"
+    def equal(columns):
+        return [f"q.`{column}` IS NULL" if value is None else f"q.`{column}` = {bind(value)}"
+                for (column, _), value in columns]
+    columns = list(zip(order, key))
+    terms = []
+    for i, ((column, direction), value) in enumerate(columns):
+        if value is None:
+            continue
+        prefix = equal(columns[:i])
+        after = f"(q.`{column}` {'<' if direction == 'DESC' else '>'} {bind(value)} OR q.`{column}` IS NULL)"
+        terms.append(" AND ".join(prefix + [after]))
+    terms.append(" AND ".join(equal(columns)))
+    return " OR ".join(f"({term})" for term in terms), values
+
+def fetch_query_page(query, params=None, sort_key=None, after=None, page_size=50, name=None, min_version=None):
+    # One page of an arbitrary SELECT by keyset. Rows are ordered by a sort key
+    # over the output columns (all of them when none is given), and each page
+    # starts at the previous page's last key: `after` is (that key, how many
+    # rows with exactly that key were shown), so ties across a page boundary
+    # are neither repeated nor lost. Only the page and one lookahead row are read.
+    # Reads from a replica when one qualifies, like execute_query.
+    # Returns (rows, `after` for the next page, whether more rows follow).
+    profiler = get_query_profiler()
+    name = name or query_name(query)
+    started = time.perf_counter()
+    named = isinstance(params, dict)
+
+    def read_page(pool):
+        with pooled_connection(pool) as conn:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                if sort_key:
+                    order = parse_sort_key(sort_key)
+                else:
+                    cursor.execute(f"SELECT * FROM ({query}) AS q LIMIT 0", params)
+                    cursor.fetchall()
+                    order = [(column, 'ASC') for column in cursor.column_names]
+
+                where, skip, bound = "", 0, params
+                if after is not None:
+                    key, skip = after
+                    predicate, values = keyset_predicate(order, key, named)
+                    where = f"WHERE {predicate}"
+                    if named:
+                        bound = {**params, **{f"_key{i}": value for i, value in enumerate(values)}}
+                    else:
+                        bound = [*(params or ()), *values]
+                order_by = ", ".join(f"q.`{column}` IS NULL, q.`{column}` {direction}" for column, direction in order)
+                cursor.execute(f"SELECT * FROM ({query}) AS q {where} ORDER BY {order_by} "
+                               f"LIMIT {int(skip) + int(page_size) + 1}", bound or None)
+                return order, cursor.fetchall()[skip:]
+            finally:
+                cursor.close()
+
+    try:
+        replica = route_read(min_version)
+        try:
+            order, rows = read_page(replica.pool if replica else None)
+        except Exception as e:
+            if replica is None or not (is_connection_error(e) or isinstance(e, TimeoutError)):
+                raise
+            if is_connection_error(e):
+                get_read_router().mark_down(replica, e)
+            order, rows = read_page(None)
+    except Exception as e:
+        profiler.record(name, time.perf_counter() - started, error=e, sql=query)
+        raise
+    profiler.record(name, time.perf_counter() - started, rows=len(rows), sql=query)
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if not rows:
+        return rows, after, has_more
+    columns = [column for column, _ in order]
+    last = tuple(rows[-1][column] for column in columns)
+    ties = sum(1 for row in rows if tuple(row[column] for column in columns) == last)
+    if after is not None and tuple(after[0]) == last:
+        ties += after[1]
+    return rows, (last, ties), has_more
+
+# ──────────────────────────────────────────────
+# 2g. Export
+# ──────────────────────────────────────────────
+EXPORT_FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'ndjson': ('.ndjson', 'application/x-ndjson'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+}
+
+def stream_query_rows(query, params=None, chunk_size=5000, min_version=None):
+    # Yield (column names, chunk of row tuples) from an unbuffered cursor, so
+    # neither the server nor the app holds more than one chunk at a time.
+    # Streams from a replica when one qualifies (see route_read).
+    replica = route_read(min_version)
+    pool = None
+    if replica is not None:
+        try:
+            conn = replica.pool.checkout()
+            pool = replica.pool
+        except Exception as e:
+            if is_connection_error(e):
+                get_read_router().mark_down(replica, e)
+    if pool is None:
+        pool = get_connection_pool()
+        conn = pool.checkout()
+    cursor = None
+    finished = False
+    try:
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(query, params)
+        columns = tuple(cursor.column_names)
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            yield columns, chunk
+        finished = True
+    finally:
+        if finished:
+            cursor.close()
+        else:
+            # Unread rows would poison the connection; drop it instead of draining
+            conn.close()
+        pool.release(conn, broken=not finished)
+
+class _CsvWriter:
+    def __init__(self, f, columns):
+        self._writer = csv.writer(f)
+        self._writer.writerow(columns)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+class _NdjsonWriter:
+    def __init__(self, f, columns):
+        self._f = f
+        self._columns = columns
+
+    def write(self, rows):
+        self._f.writelines(json.dumps(dict(zip(self._columns, row)), default=str) + "\n" for row in rows)
+
+class _ParquetWriter:
+    # One row group per chunk; the schema is taken from the first chunk
+    def __init__(self, path, columns):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs the pyarrow package")
+        self._pa = pa
+        self._pq = pq
+        self._path = path
+        self._columns = columns
+        self._writer = None
+
+    def write(self, rows):
+        data = {column: [row[i] for row in rows] for i, column in enumerate(self._columns)}
+        if self._writer is None:
+            table = self._pa.table(data)
+            self._writer = self._pq.ParquetWriter(self._path, table.schema)
+        else:
+            table = self._pa.table(data, schema=self._writer.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+def export_query(query, path, fmt='csv', params=None, chunk_size=None, name=None, progress=None):
+    # Stream a query's rows to `path` as CSV, NDJSON or Parquet in chunks.
+    # Memory is bounded by chunk_size regardless of the result size.
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    chunk_size = chunk_size or int(os.getenv('EXPORT_CHUNK_SIZE', 5000))
+    started = time.perf_counter()
+    rows = 0
+    writer = None
+    f = None
+    chunks = stream_query_rows(query, params, chunk_size)
+    try:
+        for columns, chunk in chunks:
+            if writer is None:
+                if fmt == 'parquet':
+                    writer = _ParquetWriter(path, columns)
+                else:
+                    f = open(path, 'w', newline='', encoding='utf-8')
+                    writer = (_CsvWriter if fmt == 'csv' else _NdjsonWriter)(f, columns)
+            writer.write(chunk)
+            rows += len(chunk)
+            if progress:
+                progress(rows)
+        if writer is None and fmt != 'parquet':
+            # Empty result: still leave a (header-less) file behind
+            open(path, 'w').close()
+    finally:
+        chunks.close()
+        if isinstance(writer, _ParquetWriter):
+            writer.close()
+        if f:
+            f.close()
+
+    elapsed = time.perf_counter() - started
+    get_query_profiler().record(f"export:{name or query_name(query)}", elapsed, rows=rows, sql=query)
+    return {
+        'path': path,
+        'format': fmt,
+        'rows': rows,
+        'bytes': os.path.getsize(path) if os.path.exists(path) else 0,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed, 1) if elapsed else None,
+    }
+
+def export_catalog(path, fmt='csv', chunk_size=None, progress=None):
+    return export_query("SELECT * FROM books", path, fmt, chunk_size=chunk_size,
+                        name="books", progress=progress)
+
+# ──────────────────────────────────────────────
+# 2h. Analytics Snapshot
 # ──────────────────────────────────────────────
-def get_db_connection():
+class AnalyticsSnapshot:
+    # Columnar in-memory copy of the books columns the Trend Analysis and
+    # Data Insights pages bucket over. Loaded once, then topped up with rows
+    # whose import_timestamp is at or after the newest one already seen.
+    # published_year is dictionary-encoded; NULL ratings/prices are NaN.
+    def __init__(self, np):
+        self.np = np
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._size = 0
+        self._year_codes = np.empty(0, dtype=np.int32)
+        self._ratings = np.empty(0, dtype=np.float64)
+        self._prices = np.empty(0, dtype=np.float64)
+        self._year_labels = []
+        self._year_lookup = {}
+        self._last_seen = None
+        self._data_version = None
+        self._loaded = False
+        self.stats = {'rows': 0, 'refreshes': 0, 'rows_loaded': 0, 'last_refresh_ms': 0.0}
+
+    def _year_code(self, year):
+        if year is None:
+            return -1
+        code = self._year_lookup.get(year)
+        if code is None:
+            code = self._year_lookup[year] = len(self._year_labels)
+            self._year_labels.append(year)
+        return code
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed <= len(self._ratings):
+            return
+        capacity = max(needed, 2 * len(self._ratings), 1024)
+        for attr in ('_year_codes', '_ratings', '_prices'):
+            old = getattr(self, attr)
+            grown = self.np.empty(capacity, dtype=old.dtype)
+            grown[:self._size] = old[:self._size]
+            setattr(self, attr, grown)
+
+    def _apply(self, rows):
+        np = self.np
+        self._reserve(len(rows))
+        positions = np.empty(len(rows), dtype=np.int64)
+        for i, (book_id, _, _, _, imported) in enumerate(rows):
+            position = self._positions.get(book_id)
+            if position is None:
+                position = self._positions[book_id] = self._size
+                self._size += 1
+            positions[i] = position
+            if imported is not None and (self._last_seen is None or imported > self._last_seen):
+                self._last_seen = imported
+        self._year_codes[positions] = [self._year_code(row[1]) for row in rows]
+        self._ratings[positions] = np.array([row[2] for row in rows], dtype=np.float64)
+        self._prices[positions] = np.array([row[3] for row in rows], dtype=np.float64)
+
+    def refresh(self):
+        # Skip the database entirely while the data version is unchanged
+        version = get_query_cache().data_version()
+        with self._lock:
+            if self._loaded and version is not None and version == self._data_version:
+                return
+            started = time.perf_counter()
+            query = "SELECT book_id, published_year, average_rating, price, import_timestamp FROM books"
+            params = None
+            if self._loaded and self._last_seen is not None:
+                # >= because timestamps have one-second resolution; re-applying a row is harmless
+                query += " WHERE import_timestamp >= %s"
+                params = (self._last_seen,)
+            loaded = 0
+            for _, chunk in stream_query_rows(query, params, chunk_size=20000, min_version=version):
+                self._apply(chunk)
+                loaded += len(chunk)
+            self._loaded = True
+            self._data_version = version
+            self.stats['rows'] = self._size
+            self.stats['refreshes'] += 1
+            self.stats['rows_loaded'] += loaded
+            self.stats['last_refresh_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+    def _columns(self):
+        return (self._year_codes[:self._size], self._ratings[:self._size], self._prices[:self._size])
+
+    @staticmethod
+    def _rows(key, labels, counts, order):
+        return [{key: labels[i], 'count': int(counts[i])} for i in order if counts[i]]
+
+    def distinct_years(self):
+        with self._lock:
+            years, _, _ = self._columns()
+            present = self.np.bincount(years[years >= 0], minlength=len(self._year_labels))
+            return sorted((label for label, n in zip(self._year_labels, present) if n and label != ''),
+                          reverse=True)
+
+    def year_counts(self, selected_years):
+        with self._lock:
+            years, _, _ = self._columns()
+            counts = self.np.bincount(years[years >= 0], minlength=len(self._year_labels))
+            return [{'published_year': year, 'count': int(counts[self._year_lookup[year]])}
+                    for year in sorted(selected_years)
+                    if year in self._year_lookup and counts[self._year_lookup[year]]]
+
+    def trend_rating_ranges(self):
+        # Same buckets and label order as the Trend Analysis SQL (NULL falls in 'Below 3.5')
+        np = self.np
+        with self._lock:
+            _, ratings, _ = self._columns()
+            buckets = np.where(np.isnan(ratings), 0, np.digitize(ratings, [3.5, 4.0, 4.5]))
+            counts = np.bincount(buckets, minlength=4)
+        labels = ['Below 3.5', '3.5-4.0', '4.0-4.5', '4.5+']
+        return self._rows('rating_range', labels, counts, sorted(range(4), key=labels.__getitem__))
+
+    def rating_ranges(self):
+        np = self.np
+        with self._lock:
+            _, ratings, _ = self._columns()
+            ratings = ratings[~np.isnan(ratings)]
+            counts = np.bincount(np.digitize(ratings, [3.0, 3.5, 4.0, 4.5]), minlength=5)
+        labels = ['Below 3.0', '3.0-3.5 Stars', '3.5-4.0 Stars', '4.0-4.5 Stars', '4.5+ Stars']
+        return self._rows('rating_range', labels, counts, [4, 3, 2, 1, 0])
+
+    def price_ranges(self):
+        np = self.np
+        with self._lock:
+            _, _, prices = self._columns()
+            prices = prices[~np.isnan(prices)]
+            buckets = np.where(prices == 0, 0, np.digitize(prices, [10, 20]) + 1)
+            counts = np.bincount(buckets, minlength=4)
+        return self._rows('price_range', ['Free', '0-10', '10-20', '20+'], counts, range(4))
+
+@st.cache_resource
+def get_analytics_snapshot():
+    # None when disabled (ANALYTICS_SNAPSHOT=0) or NumPy is not installed
+    if os.getenv('ANALYTICS_SNAPSHOT', '1') == '0':
+        return None
     try:
-        return mysql.connector.connect(
-            host=os.getenv('DB_HOST', 'localhost'),
-            user=os.getenv('DB_USER', 'root'),
-            password=os.getenv('DB_PASSWORD', 'admin'),
-            database=os.getenv('DB_NAME', 'bookscape'),
-            auth_plugin='mysql_native_password'
-        )
-    except Exception as e:
-        st.error(f"Connection failed: {str(e)}")
+        import numpy as np
+    except ImportError:
         return None
+    return AnalyticsSnapshot(np)
 
-def execute_query(query, params=None):
-    conn = None
+def analytics_snapshot():
+    # The refreshed snapshot, or None so callers fall back to SQL
+    snapshot = get_analytics_snapshot()
+    if snapshot is None:
+        return None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-            
-        if 'SELECT' in query.upper():
-            return cursor.fetchall()
-        conn.commit()
-        return cursor.rowcount
+        snapshot.refresh()
     except Exception as e:
-        st.error(f"Database Error: {str(e)}")
+        st.warning(f"Analytics snapshot unavailable, querying the database instead: {str(e)}")
         return None
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
+    return snapshot
 
 # ──────────────────────────────────────────────
-# 2. Core Functions
+# 2i. Catalog Refresh
 # ──────────────────────────────────────────────
-def fetch_books(query, max_results=10):
+# Re-fetch the books with the oldest import_timestamp through the volumes/{id}
+# endpoint and write back only the columns whose values changed. Books whose
+# content_hash still matches just get their import_timestamp moved, so they
+# go to the back of the queue. A request budget caps the API quota per run.
+def stale_books(limit, min_age_hours=0):
+    return execute_query(
+        f"SELECT {', '.join(BOOK_COLUMNS)} FROM books "
+        "WHERE import_timestamp IS NULL OR import_timestamp < NOW() - INTERVAL %s HOUR "
+        "ORDER BY import_timestamp LIMIT %s",
+        (min_age_hours, limit), name="refresh:stale_books"
+    ) or []
+
+def _same_value(stored, fresh):
+    if isinstance(stored, float) or isinstance(fresh, float):
+        # FLOAT columns come back rounded to single precision
+        try:
+            return math.isclose(float(stored or 0), float(fresh or 0), rel_tol=1e-6, abs_tol=1e-9)
+        except (TypeError, ValueError):
+            return False
+    return ('' if stored is None else str(stored)) == ('' if fresh is None else str(fresh))
+
+def changed_columns(row, params):
+    # CONTENT_COLUMNS whose fresh value differs from the stored row
+    fresh = dict(zip(BOOK_COLUMNS, params))
+    return [col for col in CONTENT_COLUMNS if not _same_value(row.get(col), fresh[col])]
+
+def _fetch_volume(row):
     try:
-        response = requests.get(
-            "https://www.googleapis.com/books/v1/volumes",
-            params={
-                "q": query,
-                "maxResults": max_results,
-                "key": os.getenv('xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx')
-            }
-        )
-        data = response.json()
-        return data.get('items', [])
+        return row, request_volume(row['book_id']), None
     except Exception as e:
-        st.error(f"API Error: {str(e)}")
-        return []
+        return row, None, e
 
-def process_book(item):
-    volume = item.get('volumeInfo', {})
-    sale_info = item.get('saleInfo', {})
-    
-    return {
-        'book_id': item['id'].replace("'", "''"),
-        'title': volume.get('title', 'Unknown').replace("'", "''"),
-        'authors': "|".join(volume.get('authors', ['Unknown'])).replace("'", "''"),
-        'publisher': volume.get('publisher', 'Unknown').replace("'", "''"),
-        'published_year': volume.get('publishedDate', '')[:4],
-        'description': volume.get('description', '')[:500].replace("'", "''"),
-        'isbn': next((id['identifier'].replace("'", "''") for id in volume.get('industryIdentifiers', [])
-                     if id.get('type') in ['ISBN_10', 'ISBN_13']), ''),
-        'page_count': volume.get('pageCount', 0),
-        'categories': "|".join(volume.get('categories', ['Uncategorized'])).replace("'", "''"),
-        'average_rating': float(volume.get('averageRating', 0)),
-        'ratings_count': int(volume.get('ratingsCount', 0)),
-        'price': float(sale_info.get('retailPrice', {}).get('amount', 0)),
-        'currency': sale_info.get('retailPrice', {}).get('currencyCode', 'USD').replace("'", "''"),
-        'thumbnail': volume.get('imageLinks', {}).get('thumbnail', '').replace("'", "''"),
-        'import_timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
+def _apply_refresh(touched, changes, timestamp):
+    # touched: book_ids to re-stamp; changes: (book_id, {column: value}) to write
+    maintain_summaries = os.getenv('SUMMARY_TABLES', '1') != '0'
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            conn.start_transaction()
+            if touched:
+                placeholders = ', '.join(['%s'] * len(touched))
+                cursor.execute(f"UPDATE books SET import_timestamp = %s WHERE book_id IN ({placeholders})",
+                               [timestamp, *touched])
+            if changes:
+                ids = [book_id for book_id, _ in changes]
+                before = aggregate_snapshot(cursor, ids) if maintain_summaries else None
+                relations = []
+                for book_id, values in changes:
+                    values = {**values, 'import_timestamp': timestamp}
+                    cursor.execute(
+                        f"UPDATE books SET {', '.join(f'{col} = %s' for col in values)} WHERE book_id = %s",
+                        [*values.values(), book_id]
+                    )
+                    if 'authors' in values or 'categories' in values:
+                        relations.append(book_id)
+                if relations:
+                    placeholders = ', '.join(['%s'] * len(relations))
+                    cursor.execute(f"SELECT book_id, authors, categories FROM books "
+                                   f"WHERE book_id IN ({placeholders})", relations)
+                    sync_book_relations(cursor, cursor.fetchall())
+                reclustered = [book_id for book_id, values in changes
+                               if {'title', 'authors', 'isbn'} & set(values)]
+                if reclustered and os.getenv('DEDUP', '1') != '0':
+                    placeholders = ', '.join(['%s'] * len(reclustered))
+                    cursor.execute(f"SELECT book_id, title, authors, isbn FROM books "
+                                   f"WHERE book_id IN ({placeholders})", reclustered)
+                    if assign_works(cursor, cursor.fetchall())['merged']:
+                        mark_aggregates_stale(cursor)
+                if maintain_summaries:
+                    maintain_aggregates(cursor, before, aggregate_snapshot(cursor, ids))
+                else:
+                    mark_aggregates_stale(cursor)
+                bump_data_version(cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    if changes:
+        get_query_cache().expire_version()
 
-def store_books(books):
-    if not books:
+def refresh_stale_books(budget=None, batch_size=None, min_age_hours=None, workers=None, progress=None):
+    # Refresh up to `budget` books (one API request each), stalest first.
+    # progress(stats) is called after every batch. Returns the run stats.
+    budget = int(os.getenv('REFRESH_BUDGET', 200)) if budget is None else budget
+    batch_size = batch_size or int(os.getenv('REFRESH_BATCH_SIZE', 40))
+    min_age_hours = float(os.getenv('REFRESH_MIN_AGE_HOURS', 24)) if min_age_hours is None else min_age_hours
+    workers = workers or int(os.getenv('HARVEST_WORKERS', 4))
+    started = time.perf_counter()
+    stats = {'checked': 0, 'changed': 0, 'unchanged': 0, 'missing': 0, 'failed': 0,
+             'requests': 0, 'columns': {}, 'batches': 0, 'seconds': 0.0}
+
+    with primary_reads():
+        rows = stale_books(budget, min_age_hours) if budget > 0 else []
+    hash_at = BOOK_COLUMNS.index('content_hash')
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for offset in range(0, len(rows), batch_size):
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            touched, changes = [], []
+            for row, item, error in pool.map(_fetch_volume, rows[offset:offset + batch_size]):
+                stats['requests'] += 1
+                if error is not None:
+                    # Left as is, so the next run picks it up again
+                    stats['failed'] += 1
+                    continue
+                stats['checked'] += 1
+                if item is None:
+                    # Gone upstream; keep the stored copy but stop retrying it every run
+                    stats['missing'] += 1
+                    touched.append(row['book_id'])
+                    continue
+                params = book_params(book_record(item, timestamp))
+                if params[hash_at] == row.get('content_hash'):
+                    stats['unchanged'] += 1
+                    touched.append(row['book_id'])
+                    continue
+                columns = changed_columns(row, params)
+                values = {col: params[BOOK_COLUMNS.index(col)] for col in columns}
+                values['content_hash'] = params[hash_at]
+                changes.append((row['book_id'], values))
+                if columns:
+                    stats['changed'] += 1
+                    for col in columns:
+                        stats['columns'][col] = stats['columns'].get(col, 0) + 1
+                else:
+                    # Stored before content_hash existed; only the hash is written
+                    stats['unchanged'] += 1
+            if touched or changes:
+                _apply_refresh(touched, changes, timestamp)
+            stats['batches'] += 1
+            stats['seconds'] = round(time.perf_counter() - started, 3)
+            if progress:
+                progress(stats)
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    get_query_profiler().record("refresh_stale_books", stats['seconds'], rows=stats['checked'])
+    return stats
+
+# ──────────────────────────────────────────────
+# 2j. Thumbnail Cache
+# ──────────────────────────────────────────────
+# Cover images are downloaded once into THUMBNAIL_DIR and served from disk.
+# Each key (a book_id) keeps the original plus JPEG variants resized to
+# THUMBNAIL_WIDTHS (Pillow permitting; without it every width gets the
+# original), and the directory stays under THUMBNAIL_MAX_BYTES by evicting
+# the least recently used keys. Misses download in the background, so a page
+# render never waits on a remote image. Responses that are not images, are
+# larger than THUMBNAIL_MAX_IMAGE_BYTES or do not decode are dropped and not
+# retried for `failure_ttl` seconds.
+HOME_IMAGE_URL = "https://images.unsplash.com/photo-1544716278-ca5e3f4abd8c"
+IMAGE_EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/gif': '.gif', 'image/webp': '.webp'}
+
+class ThumbnailCache:
+    def __init__(self, directory, max_bytes=200 * 1024 * 1024, widths=(100, 200), workers=4,
+                 failure_ttl=600, max_image_bytes=5 * 1024 * 1024, fetch=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_image_bytes = max_image_bytes
+        self.widths = tuple(widths)
+        self.failure_ttl = failure_ttl
+        self._fetch = fetch or self._download
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # digest -> bytes on disk, least recently used first
+        self._bytes = 0
+        self._pending = {}              # digest -> download future
+        self._failed = {}               # digest -> monotonic time before which it is not retried
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnails")
+        try:
+            from PIL import Image
+            self._image = Image
+        except ImportError:
+            self._image = None
+        self.stats = {'hits': 0, 'misses': 0, 'downloads': 0, 'download_errors': 0,
+                      'bytes_downloaded': 0, 'resized': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        # Rebuild the LRU order from file modification times
+        groups = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                digest = name.split('.')[0]
+                size, mtime = groups.get(digest, (0, 0))
+                groups[digest] = (size + stat.st_size, max(mtime, stat.st_mtime))
+        for digest, (size, _) in sorted(groups.items(), key=lambda item: item[1][1]):
+            self._entries[digest] = size
+            self._bytes += size
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha1(str(key).encode('utf-8')).hexdigest()[:24]
+
+    def _base(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _files(self, digest):
+        folder = os.path.join(self.directory, digest[:2])
+        try:
+            return [os.path.join(folder, name) for name in os.listdir(folder)
+                    if name.split('.')[0] == digest and not name.endswith('.tmp')]
+        except FileNotFoundError:
+            return []
+
+    def _original(self, digest):
+        return next((path for path in self._files(digest) if '.orig.' in os.path.basename(path)), None)
+
+    def _variant(self, digest, width):
+        return f"{self._base(digest)}.w{int(width)}.jpg"
+
+    @staticmethod
+    def _write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _download(self, url):
+        with get_http_session().get(url, timeout=float(os.getenv('API_TIMEOUT', 10)), stream=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+            if not content_type.startswith('image/'):
+                raise ValueError(f"not an image: {content_type or 'no content type'}")
+            # Stop reading as soon as the image is over the limit, whatever Content-Length claims
+            data = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > self.max_image_bytes:
+                    raise ValueError(f"image larger than {self.max_image_bytes} bytes")
+        return bytes(data), content_type
+
+    def _resize(self, original, width):
+        import io
+        with self._image.open(original) as image:
+            image = image.convert('RGB')
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))),
+                                     self._image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=85, optimize=True)
+        self.stats['resized'] += 1
+        return buffer.getvalue()
+
+    def _account(self, digest):
+        size = sum(os.path.getsize(path) for path in self._files(digest))
+        with self._lock:
+            self._bytes += size - self._entries.pop(digest, 0)
+            self._entries[digest] = size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                oldest, oldest_size = self._entries.popitem(last=False)
+                self._bytes -= oldest_size
+                self.stats['evictions'] += 1
+                for path in self._files(oldest):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def _fill(self, digest, url):
+        # Download the original once and write every configured variant
+        try:
+            data, content_type = self._fetch(url)
+            original = f"{self._base(digest)}.orig{IMAGE_EXTENSIONS.get(content_type, '.img')}"
+            self._write(original, data)
+            self.stats['downloads'] += 1
+            self.stats['bytes_downloaded'] += len(data)
+            if self._image:
+                for width in self.widths:
+                    self._write(self._variant(digest, width), self._resize(original, width))
+            self._account(digest)
+        except Exception:
+            self.stats['download_errors'] += 1
+            # An original that does not decode must not be served as a hit later
+            for path in self._files(digest):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            with self._lock:
+                self._failed[digest] = time.monotonic() + self.failure_ttl
+        finally:
+            with self._lock:
+                self._pending.pop(digest, None)
+
+    def _schedule(self, digest, url):
+        # The download future (an existing one if already queued), or None after a recent failure
+        with self._lock:
+            if digest in self._pending:
+                return self._pending[digest]
+            if self._failed.get(digest, 0) > time.monotonic():
+                return None
+            future = self._pending[digest] = self._pool.submit(self._fill, digest, url)
+            return future
+
+    def _touch(self, digest, path):
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def get(self, key, url, width=None, wait=False):
+        # Local path of the image for `key` at `width`, or None while it downloads
+        if not url:
+            return None
+        digest = self._digest(key)
+        for attempt in range(2):
+            original = self._original(digest)
+            if original:
+                if not (width and self._image):
+                    self._touch(digest, original)
+                    self.stats['hits'] += 1
+                    return original
+                variant = self._variant(digest, width)
+                if not os.path.exists(variant):
+                    # A width that was not configured when the original was fetched
+                    try:
+                        self._write(variant, self._resize(original, width))
+                    except Exception:
+                        self._touch(digest, original)
+                        self.stats['hits'] += 1
+                        return original
+                    self._account(digest)
+                self._touch(digest, variant)
+                self.stats['hits'] += 1
+                return variant
+            if attempt:
+                break
+            self.stats['misses'] += 1
+            future = self._schedule(digest, url)
+            if not (wait and future):
+                return None
+            future.result()
+        return None
+
+    def prefetch(self, items):
+        # Queue downloads for (key, url) pairs that are not cached yet
+        queued = 0
+        for key, url in items:
+            digest = self._digest(key)
+            if url and digest not in self._pending and not self._original(digest) \
+                    and self._schedule(digest, url):
+                queued += 1
+        return queued
+
+    def metrics(self):
+        with self._lock:
+            return {**self.stats, 'entries': len(self._entries), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, 'pending': len(self._pending),
+                    'resizing': self._image is not None}
+
+@st.cache_resource
+def get_thumbnail_cache():
+    return ThumbnailCache(
+        os.getenv('THUMBNAIL_DIR', '.bookscape_thumbnails'),
+        max_bytes=int(os.getenv('THUMBNAIL_MAX_BYTES', 200 * 1024 * 1024)),
+        widths=[int(width) for width in os.getenv('THUMBNAIL_WIDTHS', '100,200').split(',') if width.strip()],
+        workers=int(os.getenv('THUMBNAIL_WORKERS', 4)),
+        max_image_bytes=int(os.getenv('THUMBNAIL_MAX_IMAGE_BYTES', 5 * 1024 * 1024)),
+    )
+
+def thumbnail_source(key, url, width=None):
+    # What to hand st.image: the cached file, or the remote URL on a cold miss
+    try:
+        return get_thumbnail_cache().get(key, url, width) or url
+    except Exception:
+        return url
+
+def prefetch_thumbnails(books):
+    # Called after each import batch; THUMBNAIL_PREFETCH=0 turns it off
+    if os.getenv('THUMBNAIL_PREFETCH', '1') == '0':
         return 0
-    
+    try:
+        return get_thumbnail_cache().prefetch((book.get('book_id'), book.get('thumbnail')) for book in books)
+    except Exception:
+        # Best effort: covers fall back to their remote URLs
+        return 0
+
+# ──────────────────────────────────────────────
+# 2k. Edition Clustering
+# ──────────────────────────────────────────────
+# Editions of one work (reprints, ISBN-10 vs ISBN-13 listings, "2nd Edition"
+# titles) share a work_id, so analytics can count works instead of volumes.
+# A book joins a work when its canonical ISBN-13 matches, or when MinHash/LSH
+# over its normalized title finds an earlier book whose title shingles are at
+# least DEDUP_THRESHOLD similar and which shares an author surname. Candidates
+# come from lsh_buckets by index lookup, so a batch costs the same at 1M rows
+# as at 1k and no pair of books is compared unless they share a bucket.
+MINHASH_PERMUTATIONS = 64
+# Earlier books read per candidate query
+WORK_CANDIDATE_PAGE = 20000
+LSH_BANDS = 16   # 16 bands x 4 rows: pairs above ~0.5 similarity almost always share a bucket
+MINHASH_PRIME = (1 << 31) - 1
+_minhash_rng = random.Random(20240)
+MINHASH_A = [_minhash_rng.randrange(1, MINHASH_PRIME) for _ in range(MINHASH_PERMUTATIONS)]
+MINHASH_B = [_minhash_rng.randrange(0, MINHASH_PRIME) for _ in range(MINHASH_PERMUTATIONS)]
+# Odd 63-bit multipliers that fold a band's rows (and the salt) into one bucket
+LSH_MIX = [_minhash_rng.getrandbits(63) | 1 for _ in range(MINHASH_PERMUTATIONS // LSH_BANDS + 1)]
+EDITION_PATTERN = re.compile(
+    r"\b(?:\d+(?:st|nd|rd|th)|first|second|third|fourth|fifth|new|revised|updated|expanded|"
+    r"illustrated|annotated|anniversary|special|deluxe|international|student)\s+(?:edition|ed)\b|\bedition\b"
+)
+
+def canonical_isbn(value):
+    # ISBN-13 for a valid ISBN-10 or ISBN-13, else None
+    digits = re.sub(r'[^0-9Xx]', '', value or '').upper()
+    if len(digits) == 10 and digits[:9].isdigit():
+        check = sum((10 - i) * (10 if c == 'X' else int(c)) for i, c in enumerate(digits))
+        if check % 11:
+            return None
+        digits = '978' + digits[:9]
+        return digits + str((10 - sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(digits)) % 10) % 10)
+    if len(digits) == 13 and digits.isdigit():
+        if sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(digits)) % 10 == 0:
+            return digits
+    return None
+
+def _ascii_lower(text):
+    return unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii').lower()
+
+def normalize_title(title):
+    # Main title without subtitle, bracketed series names, edition wording or leading article
+    text = _ascii_lower(title)
+    text = re.sub(r'[\(\[].*?[\)\]]', ' ', text)
+    main = re.split(r':| - ', text)[0]
+    words = re.sub(r'[^a-z0-9 ]+', ' ', EDITION_PATTERN.sub(' ', main)).split()
+    if len(words) > 1 and words[0] in ('the', 'a', 'an'):
+        words = words[1:]
+    return ' '.join(words)
+
+def title_shingles(key, size=4):
+    if len(key) <= size:
+        return {key} if key else set()
+    return {key[i:i + size] for i in range(len(key) - size + 1)}
+
+def author_surnames(authors):
+    names = set()
+    for name in split_names(authors):
+        words = re.sub(r'[^a-z ]+', ' ', _ascii_lower(name)).split()
+        if words and words[-1] != 'unknown':
+            names.add(words[-1])
+    return names
+
+def _crc(text):
+    return zlib.crc32(text.encode('utf-8')) & MINHASH_PRIME
+
+def minhash_signatures(shingle_sets):
+    # One MINHASH_PERMUTATIONS-long signature per shingle set: rows of a NumPy
+    # array when NumPy is available, else tuples
+    hashed = [[_crc(shingle) for shingle in shingles] or [0] for shingles in shingle_sets]
+    try:
+        import numpy as np
+    except ImportError:
+        return [tuple(min((a * x + b) % MINHASH_PRIME for x in values) for a, b in zip(MINHASH_A, MINHASH_B))
+                for values in hashed]
+    if not hashed:
+        return np.empty((0, MINHASH_PERMUTATIONS), dtype=np.uint64)
+    values = np.fromiter((x for row in hashed for x in row), dtype=np.uint64)
+    starts = np.cumsum([0] + [len(row) for row in hashed[:-1]])
+    a = np.array(MINHASH_A, dtype=np.uint64)[:, None]
+    b = np.array(MINHASH_B, dtype=np.uint64)[:, None]
+    permuted = (a * values[None, :] + b) % np.uint64(MINHASH_PRIME)
+    return np.minimum.reduceat(permuted, starts, axis=1).T
+
+def lsh_keys(shingle_sets, salts):
+    # (band, bucket) pairs per shingle set. Each bucket mixes the band's rows
+    # with a salt (the smallest author surname), which keeps same-titled works
+    # by different authors out of each other's buckets. Arithmetic wraps at
+    # 64 bits, so buckets are stable across processes and Python versions.
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    mix = LSH_MIX
+    salts = [_crc(salt) for salt in salts]
+    signatures = minhash_signatures(shingle_sets)
+    try:
+        import numpy as np
+    except ImportError:
+        keys = []
+        for signature, salt in zip(signatures, salts):
+            entry = []
+            for band in range(LSH_BANDS):
+                value = salt * mix[0] + band
+                for i, x in enumerate(signature[band * rows:(band + 1) * rows]):
+                    value += x * mix[i + 1]
+                value &= (1 << 64) - 1
+                entry.append((band, value - (1 << 64) if value >= 1 << 63 else value))
+            keys.append(entry)
+        return keys
+    if not len(signatures):
+        return []
+    banded = signatures.reshape(len(signatures), LSH_BANDS, rows)
+    with np.errstate(over='ignore'):
+        values = (banded * np.array(mix[1:], dtype=np.uint64)).sum(axis=2, dtype=np.uint64)
+        values += np.array(salts, dtype=np.uint64)[:, None] * np.uint64(mix[0])
+        values += np.arange(LSH_BANDS, dtype=np.uint64)[None, :]
+    buckets = values.view(np.int64).tolist()
+    return [list(enumerate(row)) for row in buckets]
+
+def _edition_key(title, authors, isbn):
+    shingles = title_shingles(normalize_title(title))
+    surnames = author_surnames(authors)
+    return canonical_isbn(isbn), shingles, surnames
+
+def _same_work(a, b, threshold):
+    # a, b: (isbn13, shingles, surnames)
+    if a[0] and a[0] == b[0]:
+        return True
+    if not a[1] or not b[1] or (a[2] and b[2] and not a[2] & b[2]):
+        return False
+    return len(a[1] & b[1]) / len(a[1] | b[1]) >= threshold
+
+class DedupStats:
+    # Running totals of assign_works in this process, for the admin page
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {'batches': 0, 'merged': 0, 'hot_buckets': 0, 'skipped': 0}
+
+    def record(self, stats):
+        with self._lock:
+            self._totals['batches'] += 1
+            for key, value in stats.items():
+                self._totals[key] += value
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._totals, bucket_cap=int(os.getenv('DEDUP_BUCKET_CAP', 200)))
+
+@st.cache_resource
+def get_dedup_stats():
+    return DedupStats()
+
+def assign_works(cursor, books):
+    # books: (book_id, title, authors, isbn) already written to `books`.
+    # Sets isbn13/work_id and the LSH buckets for each, folding in any earlier
+    # books they match. Returns {'merged': earlier books that changed work_id
+    # because two existing works merged, 'hot_buckets': shared keys with more
+    # than DEDUP_BUCKET_CAP earlier books, 'skipped': earlier books in those
+    # keys that were not compared}.
+    threshold = float(os.getenv('DEDUP_THRESHOLD', 0.8))
+    bucket_cap = int(os.getenv('DEDUP_BUCKET_CAP', 200))
+    stats = {'merged': 0, 'hot_buckets': 0, 'skipped': 0}
+    nodes = {book_id: _edition_key(title, authors, isbn) for book_id, title, authors, isbn in books}
+    batch_ids = list(nodes)
+    if not batch_ids:
+        return stats
+    batch = set(batch_ids)
+    hashed_ids = [book_id for book_id in batch_ids if nodes[book_id][1]]
+    buckets = dict(zip(hashed_ids, lsh_keys([nodes[i][1] for i in hashed_ids],
+                                            [min(nodes[i][2], default='') for i in hashed_ids])))
+
+    # Earlier books sharing a canonical ISBN or an LSH bucket with the batch,
+    # grouped by what they share
+    groups = {}
+    for book_id, keys in buckets.items():
+        for key in keys:
+            groups.setdefault(key, []).append(book_id)
+    existing = {}   # book_id -> work_id
+    def collect(rows, group_of):
+        for row in rows:
+            book_id, work_id, isbn13, title, authors = row[:5]
+            if book_id in batch:
+                continue
+            if book_id not in existing:
+                existing[book_id] = work_id
+                nodes[book_id] = (isbn13, title_shingles(normalize_title(title)), author_surnames(authors))
+            members = groups.setdefault(group_of(row), [])
+            if book_id not in members:
+                members.append(book_id)
+
+    isbns = sorted({nodes[i][0] for i in batch_ids if nodes[i][0]})
+    for i in batch_ids:
+        if nodes[i][0]:
+            groups.setdefault(('isbn', nodes[i][0]), []).append(i)
+    for offset in range(0, len(isbns), 1000):
+        chunk = isbns[offset:offset + 1000]
+        cursor.execute(f"SELECT book_id, work_id, isbn13, title, authors FROM books "
+                       f"WHERE isbn13 IN ({', '.join(['%s'] * len(chunk))})", chunk)
+        collect(cursor.fetchall(), lambda row: ('isbn', row[2]))
+    pairs = sorted({key for keys in buckets.values() for key in keys})
+    for offset in range(0, len(pairs), 1000):
+        chunk = pairs[offset:offset + 1000]
+        # Pages of candidates in primary-key order
+        after = (-1, -1 << 63, '')
+        while True:
+            cursor.execute(
+                "SELECT b.book_id, b.work_id, b.isbn13, b.title, b.authors, l.band, l.bucket "
+                "FROM lsh_buckets l JOIN books b ON b.book_id = l.book_id "
+                f"WHERE (l.band, l.bucket) IN ({', '.join(['(%s, %s)'] * len(chunk))}) "
+                "AND (l.band, l.bucket, l.book_id) > (%s, %s, %s) "
+                f"ORDER BY l.band, l.bucket, l.book_id LIMIT {WORK_CANDIDATE_PAGE}",
+                [value for pair in chunk for value in pair] + list(after)
+            )
+            rows = cursor.fetchall()
+            collect(rows, lambda row: (row[5], row[6]))
+            if len(rows) < WORK_CANDIDATE_PAGE:
+                break
+            after = (rows[-1][5], rows[-1][6], rows[-1][0])
+
+    # Union-find, comparing only books that share a bucket or an ISBN
+    parent = {book_id: book_id for book_id in nodes}
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    compared = set()
+    for members in groups.values():
+        # Hot buckets (very common titles) are capped at DEDUP_BUCKET_CAP
+        # earlier books, so one batch cannot turn into millions of comparisons
+        earlier = [m for m in members if m not in batch]
+        if len(earlier) > bucket_cap:
+            stats['hot_buckets'] += 1
+            stats['skipped'] += len(earlier) - bucket_cap
+        members = [m for m in members if m in batch] + earlier[:bucket_cap]
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                if (a in batch or b in batch) and find(a) != find(b) and (a, b) not in compared:
+                    compared.add((a, b))
+                    if _same_work(nodes[a], nodes[b], threshold):
+                        parent[find(a)] = find(b)
+
+    # Label each work with its smallest existing work_id, else its smallest book_id
+    components = {}
+    for book_id in nodes:
+        components.setdefault(find(book_id), []).append(book_id)
+    updates, merged_from = [], {}
+    for members in components.values():
+        if not batch.intersection(members):
+            continue
+        labels = {existing[m] for m in members if existing.get(m)}
+        label = min(labels) if labels else min(members)
+        for other in labels - {label}:
+            merged_from[other] = label
+        updates.extend((nodes[m][0], label, m) for m in members if m in batch or not existing.get(m))
+
+    cursor.executemany("UPDATE books SET isbn13 = %s, work_id = %s WHERE book_id = %s", updates)
+    for old, new in merged_from.items():
+        cursor.execute("UPDATE books SET work_id = %s WHERE work_id = %s", (new, old))
+        stats['merged'] += cursor.rowcount
+    placeholders = ', '.join(['%s'] * len(batch_ids))
+    cursor.execute(f"DELETE FROM lsh_buckets WHERE book_id IN ({placeholders})", batch_ids)
+    rows = [(band, bucket, book_id) for book_id, keys in buckets.items() for band, bucket in keys]
+    if rows:
+        cursor.executemany("INSERT INTO lsh_buckets (band, bucket, book_id) VALUES (%s, %s, %s)", rows)
+    get_dedup_stats().record(stats)
+    return stats
+
+def backfill_works(chunk_size=2000, progress=None):
+    # Cluster books stored before work_id existed (or with DEDUP=0), one short
+    # transaction per chunk, then rebuild the summaries for the work counts
+    last_id = ''
     total = 0
-    for book in books:
-        # Ensure all required fields are present with defaults
-        book_data = {
-            'book_id': book.get('book_id', ''),
-            'title': book.get('title', 'Unknown').replace("'", "''"),
-            'authors': book.get('authors', 'Unknown').replace("'", "''"),
-            'publisher': book.get('publisher', 'Unknown').replace("'", "''"),
-            'published_year': book.get('published_year', '').replace("'", "''"),
-            'description': book.get('description', '').replace("'", "''")[:500],  # Truncate if needed
-            'isbn': book.get('isbn', '').replace("'", "''"),
-            'page_count': book.get('page_count', 0),
-            'categories': book.get('categories', 'Uncategorized').replace("'", "''"),
-            'average_rating': book.get('average_rating', 0.0),
-            'ratings_count': book.get('ratings_count', 0),
-            'price': book.get('price', 0.0),
-            'currency': book.get('currency', 'USD').replace("'", "''"),
-            'thumbnail': book.get('thumbnail', '').replace("'", "''"),
-            'import_timestamp': book.get('import_timestamp', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-        }
-        
-        # Build the exact INSERT query matching your table structure
-        query = f"""
-        INSERT INTO books (
-            book_id, title, authors, publisher, published_year,
-            description, isbn, page_count, categories,
-            average_rating, ratings_count, price, currency,
-            thumbnail, import_timestamp
-        ) VALUES (
-            '{book_data['book_id']}', '{book_data['title']}', '{book_data['authors']}',
-            '{book_data['publisher']}', '{book_data['published_year']}', '{book_data['description']}',
-            '{book_data['isbn']}', {book_data['page_count']}, '{book_data['categories']}',
-            {book_data['average_rating']}, {book_data['ratings_count']}, {book_data['price']},
-            '{book_data['currency']}', '{book_data['thumbnail']}', '{book_data['import_timestamp']}'
-        ) ON DUPLICATE KEY UPDATE
-            title='{book_data['title']}',
-            authors='{book_data['authors']}',
-            publisher='{book_data['publisher']}'
-        """
-        
-        try:
-            result = execute_query(query)
-            if result:
-                total += 1
-        except Exception as e:
-            st.error(f"Failed to insert book {book_data['title']}: {str(e)}")
-            st.write("Problematic query:", query)
-    
+    while True:
+        with primary_reads():
+            rows = execute_query(
+                "SELECT book_id, title, authors, isbn FROM books "
+                "WHERE work_id IS NULL AND book_id > %s ORDER BY book_id LIMIT %s",
+                (last_id, chunk_size), name="backfill_works"
+            )
+        if not rows:
+            break
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                conn.start_transaction()
+                assign_works(cursor, [(row['book_id'], row['title'], row['authors'], row['isbn']) for row in rows])
+                bump_data_version(cursor)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        total += len(rows)
+        last_id = rows[-1]['book_id']
+        if progress:
+            progress(total)
+    if total:
+        rebuild_aggregates()
+    get_query_cache().expire_version()
     return total
-	
+
+def works_state():
+    row = execute_query(
+        "SELECT COUNT(*) AS volumes, COUNT(DISTINCT COALESCE(work_id, book_id)) AS works, "
+        "COALESCE(SUM(work_id IS NULL), 0) AS unclustered FROM books", name="works_state"
+    )
+    return row[0] if row else {'volumes': 0, 'works': 0, 'unclustered': 0}
+
+# ──────────────────────────────────────────────
+# 2l. Similar Books
+# ──────────────────────────────────────────────
+# "More like this" over title, categories and description. Each book is a
+# TF-IDF vector over tokens hashed into SIMILAR_FEATURES buckets, folded to
+# SIMILAR_DIMENSIONS by a fixed random projection, so the index is a dense
+# float32 matrix (512 bytes per book). Up to SIMILAR_EXACT_MAX books a lookup
+# is one matrix-vector product; above that, candidates come from SimHash
+# tables (sign bits of the projected vector, widened to Hamming distance 1
+# when the exact codes find too few) and only they are ranked.
+SIMILAR_FEATURES = 1 << 14
+SIMILAR_DIMENSIONS = 128
+SIMILAR_TABLES = 10
+SIMILAR_BITS = 12   # 10 tables x 12 bits use 120 of the 128 dimensions
+SIMILAR_FIELDS = (('title', 2.0), ('categories', 2.0), ('description', 1.0))
+SIMILAR_TOKEN = re.compile(r'[a-z0-9]{3,}')
+SIMILAR_STOPWORDS = frozenset(
+    "the and for with from that this are was were has have had not but you your its into about "
+    "their they them his her our out all can will one more than which when who what how also "
+    "book books unknown description available".split()
+)
+SIMILAR_SELECT = "SELECT book_id, work_id, title, categories, description, import_timestamp FROM books"
+
+def similarity_features(title, categories, description):
+    # {feature bucket: field-weighted, log-scaled term frequency}
+    features = {}
+    for text, (_, weight) in zip((title, categories, description), SIMILAR_FIELDS):
+        counts = {}
+        for token in SIMILAR_TOKEN.findall(_ascii_lower(text or '')):
+            if token not in SIMILAR_STOPWORDS:
+                counts[token] = counts.get(token, 0) + 1
+        for token, n in counts.items():
+            bucket = zlib.crc32(token.encode('utf-8')) & (SIMILAR_FEATURES - 1)
+            features[bucket] = features.get(bucket, 0.0) + weight * (1.0 + math.log(n))
+    return features
+
+class SimilarityIndex:
+    # Loaded with two passes over `books` (document frequencies, then vectors),
+    # then topped up like AnalyticsSnapshot with rows whose import_timestamp is
+    # at or after the newest one seen, which covers every store_books batch and
+    # catalog refresh. IDF weights stay frozen between full builds; the index
+    # is rebuilt once the catalog has doubled since the last one.
+    def __init__(self, np):
+        self.np = np
+        self._lock = threading.Lock()
+        rng = np.random.default_rng(20240)
+        self._projection = (rng.standard_normal((SIMILAR_FEATURES, SIMILAR_DIMENSIONS))
+                            / math.sqrt(SIMILAR_DIMENSIONS)).astype(np.float32)
+        self._bit_values = (1 << np.arange(SIMILAR_BITS)).astype(np.uint16)
+        self._probe_masks = np.concatenate(([0], self._bit_values)).astype(np.uint16)
+        self.exact_max = int(os.getenv('SIMILAR_EXACT_MAX', 20000))
+        self._reset()
+        self._loaded = False
+        self._data_version = None
+        self.stats = {'books': 0, 'builds': 0, 'refreshes': 0, 'rows_indexed': 0, 'last_build_ms': 0.0,
+                      'lookups': 0, 'approximate_lookups': 0, 'candidates': 0, 'last_lookup_ms': 0.0}
+
+    def _reset(self):
+        np = self.np
+        self._idf = np.ones(SIMILAR_FEATURES, dtype=np.float32)
+        self._built_size = 0
+        self._positions = {}
+        self._ids = []
+        self._works = []
+        self._size = 0
+        self._vectors = np.empty((0, SIMILAR_DIMENSIONS), dtype=np.float32)
+        self._codes = np.empty((0, SIMILAR_TABLES), dtype=np.uint16)
+        # Per table: positions ordered by code, and the codes in that order.
+        # Rows added or changed since the last sort are scanned separately.
+        self._order = np.empty((SIMILAR_TABLES, 0), dtype=np.int64)
+        self._sorted_codes = np.empty((SIMILAR_TABLES, 0), dtype=np.uint16)
+        self._sorted_upto = 0
+        self._dirty = set()
+        self._last_seen = None
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed <= len(self._vectors):
+            return
+        capacity = max(needed, 2 * len(self._vectors), 1024)
+        for attr in ('_vectors', '_codes'):
+            old = getattr(self, attr)
+            grown = self.np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            grown[:self._size] = old[:self._size]
+            setattr(self, attr, grown)
+
+    def vectorize(self, feature_maps):
+        # Unit-length projected TF-IDF vectors, one row per feature map
+        np = self.np
+        vectors = np.zeros((len(feature_maps), SIMILAR_DIMENSIONS), dtype=np.float32)
+        for start in range(0, len(feature_maps), 256):
+            chunk = feature_maps[start:start + 256]
+            lengths = np.array([len(f) for f in chunk], dtype=np.int64)
+            total = int(lengths.sum())
+            if not total:
+                continue
+            features = np.fromiter((b for f in chunk for b in f), dtype=np.int64, count=total)
+            weights = np.fromiter((w for f in chunk for w in f.values()), dtype=np.float32, count=total)
+            weights *= self._idf[features]
+            nonempty = np.flatnonzero(lengths)
+            starts = (np.cumsum(lengths) - lengths)[nonempty]
+            vectors[start + nonempty] = np.add.reduceat(self._projection[features] * weights[:, None],
+                                                        starts, axis=0)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms > 0, norms, 1)
+        return vectors
+
+    def _simhash(self, vectors):
+        bits = vectors[:, :SIMILAR_TABLES * SIMILAR_BITS].reshape(len(vectors), SIMILAR_TABLES, SIMILAR_BITS) > 0
+        return (bits * self._bit_values).sum(axis=2, dtype=self.np.uint16)
+
+    def _apply(self, rows):
+        np = self.np
+        vectors = self.vectorize([similarity_features(row[2], row[3], row[4]) for row in rows])
+        codes = self._simhash(vectors)
+        self._reserve(len(rows))
+        positions = np.empty(len(rows), dtype=np.int64)
+        for i, (book_id, work_id, _, _, _, imported) in enumerate(rows):
+            position = self._positions.get(book_id)
+            if position is None:
+                position = self._positions[book_id] = self._size
+                self._ids.append(book_id)
+                self._works.append(work_id)
+                self._size += 1
+            else:
+                self._works[position] = work_id
+                if position < self._sorted_upto:
+                    self._dirty.add(position)
+            positions[i] = position
+            if imported is not None and (self._last_seen is None or imported > self._last_seen):
+                self._last_seen = imported
+        self._vectors[positions] = vectors
+        self._codes[positions] = codes
+
+    def _sort(self):
+        np = self.np
+        codes = self._codes[:self._size]
+        self._order = np.argsort(codes, axis=0, kind='stable').T
+        self._sorted_codes = np.take_along_axis(codes, self._order.T, axis=0).T
+        self._sorted_upto = self._size
+        self._dirty = set()
+
+    def _build(self, version=None):
+        np = self.np
+        df = np.zeros(SIMILAR_FEATURES, dtype=np.int64)
+        books = 0
+        for _, chunk in stream_query_rows(SIMILAR_SELECT, chunk_size=5000, min_version=version):
+            for row in chunk:
+                df[list(similarity_features(row[2], row[3], row[4]))] += 1
+            books += len(chunk)
+        self._reset()
+        self._idf = (np.log((1.0 + books) / (1.0 + df)) + 1.0).astype(np.float32)
+        for _, chunk in stream_query_rows(SIMILAR_SELECT, chunk_size=5000, min_version=version):
+            self._apply(chunk)
+        self._built_size = self._size
+        self._sort()
+        self.stats['builds'] += 1
+        return self._size
+
+    def refresh(self):
+        # Skip the database entirely while the data version is unchanged
+        version = get_query_cache().data_version()
+        with self._lock:
+            if self._loaded and version is not None and version == self._data_version:
+                return
+            started = time.perf_counter()
+            if not self._loaded or self._size >= 2 * max(self._built_size, 500):
+                loaded = self._build(version)
+                self.stats['last_build_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            else:
+                loaded = 0
+                # >= because timestamps have one-second resolution; re-applying a row is harmless
+                query = SIMILAR_SELECT + (" WHERE import_timestamp >= %s" if self._last_seen is not None else "")
+                params = (self._last_seen,) if self._last_seen is not None else None
+                for _, chunk in stream_query_rows(query, params, chunk_size=5000, min_version=version):
+                    self._apply(chunk)
+                    loaded += len(chunk)
+                if self._size - self._sorted_upto + len(self._dirty) > max(1024, self._size // 20):
+                    self._sort()
+            self._loaded = True
+            self._data_version = version
+            self.stats['books'] = self._size
+            self.stats['refreshes'] += 1
+            self.stats['rows_indexed'] += loaded
+
+    def _candidates(self, codes, wanted):
+        # Positions sharing a SimHash code with `codes` in any table; the
+        # one-bit neighbours are probed only if that finds fewer than `wanted`
+        np = self.np
+        found = np.zeros(self._size, dtype=bool)
+        tail = np.arange(self._sorted_upto, self._size)
+        if self._dirty:
+            tail = np.concatenate((tail, np.fromiter(self._dirty, dtype=np.int64)))
+        for masks in (self._probe_masks[:1], self._probe_masks[1:]):
+            probes = codes[:, None] ^ masks[None, :]
+            for table in range(SIMILAR_TABLES):
+                sorted_codes = self._sorted_codes[table]
+                lefts = np.searchsorted(sorted_codes, probes[table], 'left')
+                rights = np.searchsorted(sorted_codes, probes[table], 'right')
+                for left, right in zip(lefts, rights):
+                    found[self._order[table, left:right]] = True
+            if len(tail):
+                found[tail[(self._codes[tail][:, :, None] == probes[None, :, :]).any(axis=(1, 2))]] = True
+            candidates = np.flatnonzero(found)
+            if len(candidates) >= wanted:
+                break
+        return candidates
+
+    def similar(self, book_id, k=6):
+        # [(book_id, cosine similarity)] best first, at most one edition per
+        # work and none of book_id's own; None if book_id is not indexed
+        np = self.np
+        with self._lock:
+            started = time.perf_counter()
+            position = self._positions.get(book_id)
+            if position is None:
+                return None
+            query = self._vectors[position]
+            approximate = self._size > self.exact_max
+            if approximate:
+                candidates = self._candidates(self._codes[position], 50 * k)
+                scores = self._vectors[candidates] @ query
+                self.stats['approximate_lookups'] += 1
+            else:
+                candidates = None
+                scores = self._vectors[:self._size] @ query
+            self.stats['candidates'] += len(scores)
+            # Over-fetch so skipped editions still leave k results
+            top = min(len(scores), 4 * k + 8)
+            best = np.argpartition(-scores, top - 1)[:top] if top < len(scores) else np.arange(len(scores))
+            best = best[np.argsort(-scores[best])]
+            own_work = self._works[position] or book_id
+            seen_works = {own_work}
+            results = []
+            for i in best:
+                score = float(scores[i])
+                if score <= 0 or len(results) == k:
+                    break
+                other = int(candidates[i]) if approximate else int(i)
+                work = self._works[other] or self._ids[other]
+                if other == position or work in seen_works:
+                    continue
+                seen_works.add(work)
+                results.append((self._ids[other], round(score, 4)))
+            self.stats['lookups'] += 1
+            self.stats['last_lookup_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            return results
+
+    def metrics(self):
+        with self._lock:
+            return {**self.stats, 'memory_bytes': int(self._vectors.nbytes + self._codes.nbytes),
+                    'approximate': self._size > self.exact_max}
+
+@st.cache_resource
+def get_similarity_index():
+    # None when disabled (SIMILAR_BOOKS=0) or NumPy is not installed
+    if os.getenv('SIMILAR_BOOKS', '1') == '0':
+        return None
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    return SimilarityIndex(np)
+
+def similar_books(book_id, k=6):
+    # Search-card rows for the books most like book_id, each with its
+    # 'similarity'; None when the index is unavailable
+    index = get_similarity_index()
+    if index is None:
+        return None
+    started = time.perf_counter()
+    try:
+        index.refresh()
+        matches = index.similar(book_id, k)
+    except Exception as e:
+        st.warning(f"Similar books unavailable: {str(e)}")
+        return None
+    get_query_profiler().record("similar_books", time.perf_counter() - started, rows=len(matches or ()))
+    if not matches:
+        return []
+    rows = execute_query(
+        f"SELECT {SEARCH_COLUMNS} FROM books WHERE book_id IN ({', '.join(['%s'] * len(matches))})",
+        [book_id for book_id, _ in matches], name="similar_books:rows"
+    ) or []
+    by_id = {row['book_id']: row for row in rows}
+    return [{**by_id[book_id], 'similarity': score} for book_id, score in matches if book_id in by_id]
+
+# ──────────────────────────────────────────────
+# 2m. Import Jobs
+# ──────────────────────────────────────────────
+# Search-page imports run on a few worker threads shared by every session, so
+# a large import neither blocks its page nor outlives the rerun. Jobs live in
+# an in-process table that pages poll for progress. A free worker takes the
+# oldest queued job of the session with the fewest jobs running, so a session
+# that queues many imports cannot starve the others.
+IMPORT_JOB_ACTIVE = ('queued', 'running')
+
+class ImportJobs:
+    def __init__(self, workers=2, max_queued=5, history=100, run=None):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.history = history
+        self._run = run or run_ingest_pipeline
+        self._jobs = OrderedDict()      # job id -> job, in submission order
+        self._running = {}              # owner -> jobs running
+        self._cond = threading.Condition()
+        self._closed = False
+        self.stats = {'submitted': 0, 'rejected': 0, 'done': 0, 'failed': 0, 'cancelled': 0,
+                      'queue_wait_seconds': 0.0, 'max_queue_wait_seconds': 0.0}
+        self._threads = [threading.Thread(target=self._work, name=f"import_jobs_{i}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, owner, query, max_items, label=None, **options):
+        # Queue an import and return its id at once; options go to run_ingest_pipeline
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The import runner is shut down")
+            active = sum(1 for job in self._jobs.values()
+                         if job['owner'] == owner and job['status'] in IMPORT_JOB_ACTIVE)
+            if active >= self.max_queued:
+                self.stats['rejected'] += 1
+                raise RuntimeError(f"{active} imports are already queued or running for this session; "
+                                   "wait for one to finish or cancel it")
+            job_id = uuid.uuid4().hex[:12]
+            self._jobs[job_id] = {
+                'id': job_id, 'owner': owner, 'label': label or query, 'query': query, 'max_items': max_items,
+                'status': 'queued', 'submitted_at': time.time(), 'started_at': None, 'finished_at': None,
+                'pages': 0, 'fetched': 0, 'processed': 0, 'stored': 0, 'rows_per_sec': None,
+                'error': None, 'result': None, 'options': options, 'cancel': threading.Event(),
+            }
+            self.stats['submitted'] += 1
+            self._cond.notify()
+        return job_id
+
+    def cancel(self, job_id, owner=None):
+        # A queued job is dropped; a running one stops after its current page or batch
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or (owner is not None and job['owner'] != owner):
+                return False
+            if job['status'] == 'queued':
+                self._finish(job, 'cancelled')
+            elif job['status'] == 'running':
+                job['cancel'].set()
+            else:
+                return False
+            return True
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return self._view(job) if job else None
+
+    def jobs(self, owner=None):
+        # Newest first
+        with self._cond:
+            return [self._view(job) for job in reversed(self._jobs.values())
+                    if owner is None or job['owner'] == owner]
+
+    def metrics(self):
+        with self._cond:
+            statuses = [job['status'] for job in self._jobs.values()]
+            return {
+                'workers': self.workers,
+                'max_queued_per_session': self.max_queued,
+                'queued': statuses.count('queued'),
+                'running': statuses.count('running'),
+                'sessions': len({job['owner'] for job in self._jobs.values() if job['status'] in IMPORT_JOB_ACTIVE}),
+                **self.stats,
+                'queue_wait_seconds': round(self.stats['queue_wait_seconds'], 3),
+                'max_queue_wait_seconds': round(self.stats['max_queue_wait_seconds'], 3),
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for job in self._jobs.values():
+                if job['status'] == 'queued':
+                    self._finish(job, 'cancelled')
+                elif job['status'] == 'running':
+                    job['cancel'].set()
+            self._cond.notify_all()
+
+    @staticmethod
+    def _view(job):
+        # A copy for the pages: no cancel event or options, times as text
+        started, finished = job['started_at'], job['finished_at']
+        return {
+            **{key: value for key, value in job.items() if key not in ('cancel', 'options')},
+            **{key: datetime.fromtimestamp(job[key]).strftime("%Y-%m-%d %H:%M:%S") if job[key] else None
+               for key in ('submitted_at', 'started_at', 'finished_at')},
+            'seconds': round((finished or time.time()) - started, 3) if started else 0.0,
+        }
+
+    def _next(self):
+        # Fewest running jobs for the owner first, then submission order
+        queued = [job for job in self._jobs.values() if job['status'] == 'queued']
+        return min(queued, key=lambda job: self._running.get(job['owner'], 0), default=None)
+
+    def _finish(self, job, status, error=None):
+        if job['status'] == 'running':
+            self._running[job['owner']] -= 1
+            if not self._running[job['owner']]:
+                del self._running[job['owner']]
+        job['status'] = status
+        job['error'] = error
+        job['finished_at'] = time.time()
+        self.stats[status] += 1
+        # Forget the oldest finished jobs beyond the history bound
+        finished = [job_id for job_id, other in self._jobs.items() if other['status'] not in IMPORT_JOB_ACTIVE]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def _progress(self, job, result):
+        with self._cond:
+            for key in ('pages', 'fetched', 'processed', 'stored'):
+                job[key] = result[key]
+            seconds = time.time() - job['started_at']
+            job['rows_per_sec'] = round(job['stored'] / seconds, 1) if seconds and job['stored'] else None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next()
+                while job is None and not self._closed:
+                    self._cond.wait()
+                    job = self._next()
+                if job is None:
+                    return
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+                self._running[job['owner']] = self._running.get(job['owner'], 0) + 1
+                waited = job['started_at'] - job['submitted_at']
+                self.stats['queue_wait_seconds'] += waited
+                self.stats['max_queue_wait_seconds'] = max(self.stats['max_queue_wait_seconds'], waited)
+
+            try:
+                result = self._run(job['query'], job['max_items'], progress=lambda result: self._progress(job, result),
+                                   cancel=job['cancel'], **job['options'])
+                error = "; ".join(result['errors']) or None
+                status = 'cancelled' if result['cancelled'] else ('failed' if error else 'done')
+            except Exception as e:
+                result, error, status = None, str(e), 'failed'
+            with self._cond:
+                if result is not None:
+                    self._progress(job, result)
+                job['result'] = result
+                self._finish(job, status, error)
+            get_query_profiler().record("import_job", time.time() - job['started_at'],
+                                        rows=job['stored'], error=error, sql=job['query'])
+
+@st.cache_resource
+def get_import_jobs():
+    return ImportJobs(
+        workers=int(os.getenv('IMPORT_WORKERS', 2)),
+        max_queued=int(os.getenv('IMPORT_JOBS_PER_SESSION', 5)),
+        history=int(os.getenv('IMPORT_JOB_HISTORY', 100)),
+    )
+
+def session_owner():
+    # Stable id of this browser session; its import jobs are filed under it
+    return st.session_state.setdefault('session_owner', uuid.uuid4().hex)
+
 # ──────────────────────────────────────────────
 # 3. Page Components
 # ──────────────────────────────────────────────
@@ -161,48 +4202,128 @@ def show_home():
     - Querying the database
     - Statistics and Explore community features
     """)
-    st.image("https://images.unsplash.com/photo-1544716278-ca5e3f4abd8c", width=300)
+    st.image(thumbnail_source('home', HOME_IMAGE_URL, 600), width=300)
+
+def submit_import(query, max_items, **options):
+    # Queue an import for this session; returns the job id, or None when refused.
+    # Batches of a few pages keep the stored-rows progress moving.
+    options.setdefault('batch_size', min(int(os.getenv('STORE_BATCH_SIZE', 500)), 5 * BOOKS_API_PAGE_SIZE))
+    try:
+        return get_import_jobs().submit(session_owner(), query, max_items, **options)
+    except RuntimeError as e:
+        st.error(f"❌ {str(e)}")
+        return None
+
+def import_job_progress(job_id):
+    job = get_import_jobs().get(job_id)
+    if job is None or job['status'] not in IMPORT_JOB_ACTIVE:
+        # Finished: rerun the whole page so it can show the results
+        st.rerun()
+    if job['status'] == 'queued':
+        st.info(f"⏳ Queued: {job['label']} (waiting for a free import worker)")
+    else:
+        rate = f", {job['rows_per_sec']} rows/s" if job['rows_per_sec'] else ""
+        st.progress(min(job['fetched'] / job['max_items'], 1.0) if job['max_items'] else 0.0,
+                    text=f"🌐 {job['label']}: {job['pages']} pages, {job['fetched']} fetched, "
+                         f"💾 {job['stored']} stored{rate}")
+    if st.button("Cancel import", key=f"import_cancel_{job_id}"):
+        get_import_jobs().cancel(job_id, session_owner())
+        st.rerun()
+
+def import_job_panel(job_id):
+    # Progress of a background import while it is queued or running, polled on
+    # a timer by a fragment so only this panel reruns. Returns the job once it
+    # has finished, None before that.
+    job = get_import_jobs().get(job_id)
+    if job is None:
+        st.warning("⚠️ This import is no longer tracked (the app restarted or it left the job history)")
+        return None
+    if job['status'] in IMPORT_JOB_ACTIVE:
+        fragment = getattr(st, 'fragment', None)
+        if fragment is None:
+            # Streamlit before 1.37: no timed fragments, so refresh by hand
+            import_job_progress(job_id)
+            st.button("Refresh progress", key=f"import_refresh_{job_id}")
+        else:
+            fragment(run_every=float(os.getenv('IMPORT_POLL_SECONDS', 1)))(import_job_progress)(job_id)
+        return None
+    noted = st.session_state.setdefault('noted_import_jobs', set())
+    if job['stored'] and job_id not in noted:
+        # Read-your-writes is tracked per session, so it is noted here rather
+        # than on the worker thread
+        noted.add(job_id)
+        note_session_write()
+    if job['status'] == 'cancelled':
+        st.warning(f"⚠️ Import cancelled after {job['stored']} books were saved")
+    return job
+
 # ──────────────────────────────────────────────
 # 4. Basic Search
 # ──────────────────────────────────────────────
 def basic_search():
     st.header("🔍 Basic Search")
     query = st.text_input("Search term", "python programming")
-    max_results = st.slider("Max results", 1, 40, 10)
+    max_results = st.slider("Max results", 1, 1000, 10)
+    refresh = st.checkbox("Bypass cache (force refresh)", key="basic_refresh")
     
     if st.button("Search"):
-        items = fetch_books(query, max_results)
-        if items:
-            books = [process_book(item) for item in items]
-            st.success(f"Found {len(books)} books")
+        st.session_state['basic_import_job'] = submit_import(query, max_results, refresh=refresh)
+
+    job = import_job_panel(st.session_state['basic_import_job']) if st.session_state.get('basic_import_job') else None
+    if job:
+        result = job['result']
+        if result is None:
+            st.error(f"❌ Import error ({job['error']})")
+            return
+        for error in result['errors']:
+            st.error(f"❌ Import error ({error})")
+        if result['processed'] and not result['cancelled']:
+            st.success(f"Found {result['processed']} books")
             
-            for i, book in enumerate(books[:5]):
-                st.write(f"{i+1}. **{book['title']}** by {book['authors']}")
+            for i, book in enumerate(result['preview']):
+                st.write(f"{i+1}. **{book.title}** by {book.authors}")
             
-        with st.spinner("💾 Saving to database..."):
-                    try:
-                        saved_count = store_books(books)
-                        st.success(f"📚 Successfully saved {saved_count} books to database")
-                    except Exception as e:
-                        st.error(f"❌ Failed to save books: {str(e)}")                       
+            st.success(f"📚 Successfully saved {result['stored']} books to database")
+            with st.expander("Pipeline timing"):
+                st.json(result['stages'])
  
 # ──────────────────────────────────────────────
 # 5. Advanced Search
 # ──────────────────────────────────────────────                      
+def show_similar_to(book_id, title):
+    st.session_state['similar_to'] = (book_id, title)
+
+def hide_similar():
+    st.session_state.pop('similar_to', None)
+
+def similar_books_panel(book_id, title):
+    col1, col2 = st.columns([5, 1])
+    col1.subheader(f"📚 More like “{title}”")
+    col2.button("Close", key="similar_close", on_click=hide_similar)
+    with st.spinner("Finding similar books..."):
+        results = similar_books(book_id, k=int(os.getenv('SIMILAR_BOOKS_K', 6)))
+    if results is None:
+        st.info("Similar books need NumPy (and SIMILAR_BOOKS not set to 0)")
+        return
+    if not results:
+        st.info("No similar books in the catalog yet")
+        return
+    for book in results:
+        col1, col2 = st.columns([1, 4])
+        with col1:
+            if book.get('thumbnail'):
+                st.image(thumbnail_source(book['book_id'], book['thumbnail'], 100), width=70)
+        with col2:
+            st.write(f"**{book['title']}** · {book['authors']}")
+            st.caption(f"{book.get('categories', 'N/A')} · ★{book.get('average_rating', 'N/A')} · "
+                       f"similarity {book['similarity']:.2f}")
+            st.button("More like this", key=f"similar_more_{book['book_id']}",
+                      on_click=show_similar_to, args=(book['book_id'], book['title']))
+    st.markdown("---")
+
 def advanced_search():
 
     st.header("🔍 Advanced Search")
-        
-    # Verify database connection
-    try:
-        conn = get_db_connection()
-        if not conn:
-            st.error("❌ Failed to connect to database")
-            return
-        conn.close()
-    except Exception as e:
-        st.error(f"❌ Database connection error: {str(e)}")
-        return
 
     with st.form("advanced_search_form"):
         col1, col2 = st.columns(2)
@@ -217,8 +4338,15 @@ def advanced_search():
             min_rating = st.slider("Minimum rating", 0.0, 5.0, 3.0)
             min_pages = st.number_input("Minimum pages", 0, 5000, 0)
         
+        refresh = st.checkbox("Bypass cache (force refresh)")
         search_clicked = st.form_submit_button("Search & Import")
 
+    if search_clicked:
+        st.session_state.pop('similar_to', None)
+    elif st.session_state.get('similar_to'):
+        # A "More like this" click reruns the page without the form submit
+        similar_books_panel(*st.session_state['similar_to'])
+
     if search_clicked:
         # Step 1: Build Google Books API query
         api_query_parts = []
@@ -228,436 +4356,744 @@ def advanced_search():
         if year: api_query_parts.append(f"after:{year}-01-01 before:{year}-12-31")
         
         api_query = "+".join(api_query_parts) if api_query_parts else "python"
-        st.write(f"🔍 API Search Query: `{api_query}`")
 
-        # Step 2: Fetch from Google Books API
-        with st.spinner("🌐 Fetching books from Google Books API..."):
-            try:
-                items = fetch_books(api_query, 40)
-                if not items:
-                    st.warning("⚠️ No books found in Google Books API")
-                    return
-                
-                st.success(f"✅ Found {len(items)} books in API results")
+        # Steps 2-4: Fetch from Google Books API, process and filter, store in MySQL.
+        # The stages run concurrently so downloads overlap with database writes,
+        # in an import job on a background worker, so the page stays responsive.
+        def passes_filters(book):
+            # Apply client-side filters
+            return (book.get('average_rating', 0) >= min_rating and
+                    book.get('page_count', 0) >= min_pages)
 
-                # Display raw API results for debugging
-                with st.expander("Show raw API results"):
-                    st.json(items[:1])  # Show first item as sample
+        job_id = submit_import(api_query, 40, book_filter=passes_filters, refresh=refresh)
+        st.session_state['advanced_import'] = job_id and {
+            'job': job_id, 'api_query': api_query, 'title': title, 'author': author, 'genre': genre,
+            'year': year, 'min_rating': min_rating, 'min_pages': min_pages,
+        }
 
-            except Exception as e:
-                st.error(f"❌ API fetch failed: {str(e)}")
-                return
+    # The search reruns (polling, "Save Again") with the values it was submitted with
+    search = st.session_state.get('advanced_import')
+    if search:
+        st.write(f"🔍 API Search Query: `{search['api_query']}`")
+        job = import_job_panel(search['job'])
+        if job is None:
+            return
+        result = job['result']
+        if result is None:
+            st.error(f"❌ Import failed ({job['error']})")
+            return
+
+        for error in result['errors']:
+            st.error(f"❌ Import failed ({error})")
+        if not result['fetched']:
+            st.warning("⚠️ No books found in Google Books API")
+            return
+        st.success(f"✅ Found {result['fetched']} books in API results")
+
+        # Display raw API results for debugging
+        with st.expander("Show raw API results"):
+            st.json([result['sample_item']])  # Show first item as sample
+
+        if not result['processed'] - result['filtered_out']:
+            st.warning("⚠️ No books matched your filters after processing")
+            return
+        st.success(f"📚 {result['processed'] - result['filtered_out']} books passed filters")
+        st.success(f"✅ Saved {result['stored']} books to database")
+        with st.expander("Pipeline timing"):
+            st.json(result['stages'])
 
-        # Step 3: Process and filter books before storing
-        with st.spinner("🔄 Processing and filtering books..."):
-            books_to_store = []
-            for item in items:
+        # Step 5: Query MySQL with exact filters, once per finished import;
+        # polling, "More like this" and "Save Again" reruns reuse the results
+        found = st.session_state.get('advanced_results')
+        if not found or found['job'] != search['job']:
+            with st.spinner("🔍 Searching database..."):
                 try:
-                    book = process_book(item)
-                    # Apply client-side filters
-                    if (book.get('average_rating', 0) >= min_rating and 
-                        book.get('page_count', 0) >= min_pages):
-                        books_to_store.append(book)
+                    found = advanced_search_results(search)
                 except Exception as e:
-                    continue
-            
-            if not books_to_store:
-                st.warning("⚠️ No books matched your filters after processing")
-                return
-            
-            st.success(f"📚 {len(books_to_store)} books passed filters")
+                    st.error(f"❌ Database query failed: {str(e)}")
+                    return
+            st.session_state['advanced_results'] = found
 
-        # Step 4: Store in MySQL
-        with st.spinner("💾 Saving books to database..."):
-            try:
-                saved_count = store_books(books_to_store)
-                st.success(f"✅ Saved {saved_count} books to database")
-                
-                # Verify storage
-                verify_query = "SELECT COUNT(*) as count FROM books"
-                verify_count = execute_query(verify_query)
-                st.info(f"📊 Total books in database now: {verify_count[0]['count']}")
-                
-            except Exception as e:
-                st.error(f"❌ Failed to save books: {str(e)}")
-                return
+        if found['total'] is not None:
+            st.info(f"📊 Total books in database now: {found['total']}")
+        st.write(f"📝 Database Query: `{found['query']}`")
+        st.write(f"🔢 Query Parameters: {found['params']}")
+        results = found['results']
+        if not results:
+            st.warning("⚠️ No books found in database after saving")
+            return
+
+        st.success(f"🎉 Found {len(results)} matching books in database")
+
+        # Display results
+        for book in results:
+            with st.container():
+                col1, col2 = st.columns([1, 4])
+
+                with col1:
+                    if book.get('thumbnail'):
+                        st.image(thumbnail_source(book['book_id'], book['thumbnail'], 200), width=100)
+                    else:
+                        st.write("No cover image")
+
+                with col2:
+                    st.subheader(book['title'])
+                    st.write(f"**By:** {book['authors']}")
+                    st.write(f"**Published:** {book.get('published_year', 'N/A')} | "
+                            f"**Rating:** ★{book.get('average_rating', 'N/A')} "
+                            f"({book.get('ratings_count', 0)} ratings)")
+                    st.write(f"**Pages:** {book.get('page_count', 'N/A')} | "
+                            f"**Genres:** {book.get('categories', 'N/A')}")
+                    if book.get('score') is not None:
+                        st.caption(f"Relevance: {book['score']:.2f}")
+
+                    if st.button("Save Again", key=f"save_{book['book_id']}"):
+                        # The card only carries the search columns; re-save the full
+                        # row so the upsert does not blank the rest of the book
+                        with primary_reads():
+                            stored = execute_query(
+                                f"SELECT {', '.join(BOOK_COLUMNS)} FROM books WHERE book_id = %s",
+                                (book['book_id'],)
+                            )
+                        if stored and store_books(stored):
+                            st.success("Book saved again!")
+                    st.button("More like this", key=f"similar_{book['book_id']}",
+                              on_click=show_similar_to, args=(book['book_id'], book['title']))
+
+        st.write(f"Showing {len(results)} of {len(results)} results")
+
+def advanced_search_results(search):
+    # The catalog size and the books matching a submitted search's filters
+    title, author, genre, year, min_rating, min_pages = (
+        search[key] for key in ('title', 'author', 'genre', 'year', 'min_rating', 'min_pages'))
+    verify_count = execute_query("SELECT COUNT(*) as count FROM books")
 
-        # Small delay to ensure records are committed
+    conditions = []
+    params = {}
 
+    # Author and genre match anywhere in an individual name ("Rowling" finds
+    # "J.K. Rowling"), like the API's inauthor:/subject: did. The join tables
+    # hold one short name per row, so this scans less than the pipe-joined columns.
+    if author:
+        conditions.append("book_id IN (SELECT book_id FROM book_authors WHERE author LIKE %(author)s)")
+        params['author'] = f"%{author}%"
+    if genre:
+        conditions.append("book_id IN (SELECT book_id FROM book_categories WHERE category LIKE %(genre)s)")
+        params['genre'] = f"%{genre}%"
+    if year:
+        # Typed column, so the year, rating and pages filters share one index
+        conditions.append("pub_year = %(year)s" if typed_year(year) else "published_year = %(year)s")
+        params['year'] = typed_year(year) or year
 
-        # Step 5: Query MySQL with exact filters
-        with st.spinner("🔍 Searching database..."):
-            try:
-                conditions = []
-                params = {}
-                
-                if title:
-                    conditions.append("title LIKE %(title)s")
-                    params['title'] = f"%{title}%"
-                if author:
-                    conditions.append("authors LIKE %(author)s")
-                    params['author'] = f"%{author}%"
-                if genre:
-                    conditions.append("categories LIKE %(genre)s")
-                    params['genre'] = f"%{genre}%"
-                if year:
-                    conditions.append("published_year = %(year)s")
-                    params['year'] = year
-                
-                conditions.append(f"average_rating >= {min_rating}")
-                conditions.append(f"page_count >= {min_pages}")
-                
-                query = """
-                SELECT 
-                    book_id, title, authors, published_year,
-                    average_rating, ratings_count, page_count,
-                    categories, thumbnail
-                FROM books
-                """
-                if conditions:
-                    query += " WHERE " + " AND ".join(conditions)
-                query += " ORDER BY average_rating DESC LIMIT 50"
-                
-                st.write(f"📝 Database Query: `{query}`")
-                st.write(f"🔢 Query Parameters: {params}")
-                
-                results = execute_query(query, params)
-                
-                if not results:
-                    st.warning("⚠️ No books found in database after saving")
-                    return
-                
-                st.success(f"🎉 Found {len(results)} matching books in database")
-                
-                # Display results
-                for book in results:
-                    with st.container():
-                        col1, col2 = st.columns([1, 4])
-                        
-                        with col1:
-                            if book.get('thumbnail'):
-                                st.image(book['thumbnail'], width=100)
-                            else:
-                                st.write("No cover image")
-                        
-                        with col2:
-                            st.subheader(book['title'])
-                            st.write(f"**By:** {book['authors']}")
-                            st.write(f"**Published:** {book.get('published_year', 'N/A')} | "
-                                    f"**Rating:** ★{book.get('average_rating', 'N/A')} "
-                                    f"({book.get('ratings_count', 0)} ratings)")
-                            st.write(f"**Pages:** {book.get('page_count', 'N/A')} | "
-                                    f"**Genres:** {book.get('categories', 'N/A')}")
-                            
-                            if st.button("Save Again", key=f"save_{book['book_id']}"):
-                                if store_books([book]):
-                                    st.success("Book saved again!")
-                
-                st.write(f"Showing {len(results)} of {len(results)} results")
+    conditions.append(f"average_rating >= {min_rating}")
+    conditions.append(f"page_count >= {min_pages}")
 
-            except Exception as e:
-                st.error(f"❌ Database query failed: {str(e)}")
+    # The title goes through the FULLTEXT index and ranks the results
+    query, params = book_search_query(title, conditions, params, limit=50)
+    results = execute_query(query, params)
+    if results is None:
+        raise RuntimeError("the search query failed")
+    return {'job': search['job'], 'total': verify_count[0]['count'] if verify_count else None,
+            'query': query, 'params': params, 'results': results}
 
 # ──────────────────────────────────────────────
 # 6. Query Explorer
 # ──────────────────────────────────────────────
-def query_explorer():
-    st.header("📊 Query Explorer")
+# Module level so bookscape_bench.py can time the same SQL the page runs
+EXPLORER_QUERIES = {
+    "1. Check Availability of eBooks vs Physical Books": """
+        SELECT 
+            SUM(is_ebook = 1) as ebook_count,
+            SUM(is_ebook = 0) as physical_count,
+            ROUND(SUM(is_ebook = 1) * 100.0 / COUNT(is_ebook), 2) as ebook_percentage
+        FROM books
+    """,
     
-    queries = {
-        "1. Check Availability of eBooks vs Physical Books": """
-            SELECT 
-                SUM(is_ebook) as ebook_count,
-                COUNT(*) - SUM(is_ebook) as physical_count,
-                ROUND(SUM(is_ebook) * 100.0 / COUNT(*), 2) as ebook_percentage
-            FROM books
-        """,
-        
-        "2. Find the Publisher with the Most Books Published": """
-            SELECT publisher, COUNT(*) as book_count
-            FROM books
-            WHERE publisher != 'Unknown'
-            GROUP BY publisher
-            ORDER BY book_count DESC
-            LIMIT 1
-        """,
-        
-        "3. Identify the Publisher with the Highest Average Rating": """
-            SELECT publisher, AVG(average_rating) as avg_rating
-            FROM books
-            WHERE publisher != 'Unknown'
-            GROUP BY publisher
-            HAVING COUNT(*) > 5
-            ORDER BY avg_rating DESC
-            LIMIT 1
-        """,
-        
-        "4. Get the Top 5 Most Expensive Books by Retail Price": """
-            SELECT title, authors, price, currency
-            FROM books
-            WHERE price > 0
-            ORDER BY price DESC
-            LIMIT 5
-        """,
-        
-        "5. Find Books Published After 2010 with at Least 500 Pages": """
-            SELECT title, authors, published_year, page_count
-            FROM books
-            WHERE published_year > '2010' AND page_count >= 500
-            ORDER BY page_count DESC
-            LIMIT 100
-        """,
-        
-        "6. List Books with Discounts Greater than 20%": """
-            SELECT title, authors, 
-                   price, 
-                   (SELECT AVG(price) FROM books b2 WHERE b2.categories = books.categories) as avg_category_price,
-                   ROUND((1 - (price / (SELECT AVG(price) FROM books b2 WHERE b2.categories = books.categories)) * 100, 2) as discount_percentage
-            FROM books
-            WHERE price > 0
-            HAVING discount_percentage > 20
-            ORDER BY discount_percentage DESC
-            LIMIT 50
-        """,
-        
-        "7. Find the Average Page Count for eBooks vs Physical Books": """
-            SELECT 
-                AVG(CASE WHEN is_ebook = 1 THEN page_count ELSE NULL END) as avg_ebook_pages,
-                AVG(CASE WHEN is_ebook = 0 THEN page_count ELSE NULL END) as avg_physical_pages
-            FROM books
-            WHERE page_count > 0
-        """,
-        
-        "8. Find the Top 3 Authors with the Most Books": """
-            SELECT authors, COUNT(*) as book_count
-            FROM books
-            WHERE authors != 'Unknown'
-            GROUP BY authors
-            ORDER BY book_count DESC
-            LIMIT 3
-        """,
-        
-        "9. List Publishers with More than 10 Books": """
-            SELECT publisher, COUNT(*) as book_count
-            FROM books
-            WHERE publisher != 'Unknown'
-            GROUP BY publisher
-            HAVING COUNT(*) > 10
-            ORDER BY book_count DESC
-        """,
-        
-        "10. Find the Average Page Count for Each Category": """
-            SELECT 
-                categories,
-                AVG(page_count) as avg_page_count,
-                COUNT(*) as book_count
+    "2. Find the Publisher with the Most Books Published": """
+        SELECT publisher, COUNT(*) as book_count,
+               COUNT(DISTINCT COALESCE(work_id, book_id)) as work_count
+        FROM books
+        WHERE publisher != 'Unknown'
+        GROUP BY publisher
+        ORDER BY book_count DESC
+        LIMIT 1
+    """,
+    
+    "3. Identify the Publisher with the Highest Average Rating": """
+        SELECT publisher, AVG(average_rating) as avg_rating
+        FROM books
+        WHERE publisher != 'Unknown'
+        GROUP BY publisher
+        HAVING COUNT(*) > 5
+        ORDER BY avg_rating DESC
+        LIMIT 1
+    """,
+    
+    "4. Get the Top 5 Most Expensive Books by Retail Price": """
+        SELECT title, authors, price, currency
+        FROM books
+        WHERE price > 0
+        ORDER BY price DESC
+        LIMIT 5
+    """,
+    
+    "5. Find Books Published After 2010 with at Least 500 Pages": """
+        SELECT title, authors, published_year, page_count
+        FROM books
+        WHERE pub_year > 2010 AND page_count >= 500
+        ORDER BY page_count DESC
+        LIMIT 100
+    """,
+    
+    "6. List Books with Discounts Greater than 20%": """
+        SELECT books.title, books.authors, 
+               books.price, 
+               category_prices.avg_price as avg_category_price,
+               ROUND((1 - books.price / category_prices.avg_price) * 100, 2) as discount_percentage
+        FROM books
+        JOIN (
+            SELECT categories, AVG(price) as avg_price
             FROM books
-            WHERE categories != '' AND page_count > 0
             GROUP BY categories
-            ORDER BY avg_page_count DESC
-            LIMIT 20
-        """,
-        
-        "11. Retrieve Books with More than 3 Authors": """
-            SELECT title, authors, 
-                   LENGTH(authors) - LENGTH(REPLACE(authors, '|', '')) + 1 as author_count
-            FROM books
-            HAVING author_count > 3
-            ORDER BY author_count DESC
-            LIMIT 50
-        """,
-        
-        "12. Books with Ratings Count Greater Than the Average": """
-            SELECT title, authors, ratings_count, average_rating
-            FROM books
-            WHERE ratings_count > (SELECT AVG(ratings_count) FROM books WHERE ratings_count > 0)
-            ORDER BY ratings_count DESC
-            LIMIT 50
-        """,
-        
-        "13. Books with the Same Author Published in the Same Year": """
-            SELECT authors, published_year, COUNT(*) as book_count
-            FROM books
-            WHERE authors != 'Unknown' AND published_year != ''
-            GROUP BY authors, published_year
-            HAVING COUNT(*) > 1
-            ORDER BY book_count DESC
-            LIMIT 50
-        """,
-        
-        "14. Books with a Specific Keyword in the Title": """
-            SELECT title, authors, published_year
-            FROM books
-            WHERE title LIKE '%machine%'
-            LIMIT 50
-        """,
-        
-        "15. Year with the Highest Average Book Price": """
-            SELECT published_year, AVG(price) as avg_price
-            FROM books
-            WHERE price > 0 AND published_year != ''
-            GROUP BY published_year
-            ORDER BY avg_price DESC
-            LIMIT 1
-        """,
-        
-        "16. Count Authors Who Published 3 Consecutive Years": """
-            WITH author_years AS (
-                SELECT 
-                    authors,
-                    published_year,
-                    LAG(published_year, 1) OVER (PARTITION BY authors ORDER BY published_year) as prev_year,
-                    LAG(published_year, 2) OVER (PARTITION BY authors ORDER BY published_year) as prev_prev_year
-                FROM books
-                WHERE authors != 'Unknown' AND published_year REGEXP '^[0-9]{4}$'
-                GROUP BY authors, published_year
-            )
-            SELECT COUNT(DISTINCT authors) as authors_with_3_consecutive_years
-            FROM author_years
-            WHERE published_year = prev_year + 1 AND published_year = prev_prev_year + 2
-        """,
-        
-        "17. Authors with Multiple Publishers in Same Year": """
+        ) category_prices ON category_prices.categories = books.categories
+        WHERE books.price > 0 AND books.price < category_prices.avg_price * 0.8
+        ORDER BY discount_percentage DESC
+        LIMIT 50
+    """,
+    
+    "7. Find the Average Page Count for eBooks vs Physical Books": """
+        SELECT 
+            AVG(CASE WHEN is_ebook = 1 THEN page_count ELSE NULL END) as avg_ebook_pages,
+            AVG(CASE WHEN is_ebook = 0 THEN page_count ELSE NULL END) as avg_physical_pages
+        FROM books
+        WHERE page_count > 0
+    """,
+    
+    "8. Find the Top 3 Authors with the Most Books": """
+        SELECT author as authors, COUNT(*) as book_count
+        FROM book_authors
+        GROUP BY author
+        ORDER BY book_count DESC
+        LIMIT 3
+    """,
+    
+    "9. List Publishers with More than 10 Books": """
+        SELECT publisher, COUNT(*) as book_count,
+               COUNT(DISTINCT COALESCE(work_id, book_id)) as work_count
+        FROM books
+        WHERE publisher != 'Unknown'
+        GROUP BY publisher
+        HAVING COUNT(*) > 10
+        ORDER BY book_count DESC
+    """,
+    
+    "10. Find the Average Page Count for Each Category": """
+        SELECT 
+            categories,
+            AVG(page_count) as avg_page_count,
+            COUNT(*) as book_count
+        FROM books
+        WHERE categories != '' AND page_count > 0
+        GROUP BY categories
+        ORDER BY avg_page_count DESC
+        LIMIT 20
+    """,
+    
+    "11. Retrieve Books with More than 3 Authors": """
+        SELECT books.title, books.authors, author_counts.author_count
+        FROM (
+            SELECT book_id, COUNT(*) as author_count
+            FROM book_authors
+            GROUP BY book_id
+            HAVING COUNT(*) > 3
+        ) author_counts
+        JOIN books ON books.book_id = author_counts.book_id
+        ORDER BY author_counts.author_count DESC
+        LIMIT 50
+    """,
+    
+    "12. Books with Ratings Count Greater Than the Average": """
+        SELECT title, authors, ratings_count, average_rating
+        FROM books
+        WHERE ratings_count > (SELECT AVG(ratings_count) FROM books WHERE ratings_count > 0)
+        ORDER BY ratings_count DESC
+        LIMIT 50
+    """,
+    
+    "13. Books with the Same Author Published in the Same Year": """
+        SELECT ba.author as authors, b.published_year, COUNT(*) as book_count
+        FROM book_authors ba
+        JOIN books b ON b.book_id = ba.book_id
+        WHERE b.published_year != ''
+        GROUP BY ba.author, b.published_year
+        HAVING COUNT(*) > 1
+        ORDER BY book_count DESC
+        LIMIT 50
+    """,
+    
+    "14. Books with a Specific Keyword in the Title": """
+        SELECT title, authors, published_year
+        FROM books
+        WHERE title LIKE '%machine%'
+        LIMIT 50
+    """,
+    
+    "15. Year with the Highest Average Book Price": """
+        SELECT pub_year as published_year, AVG(price) as avg_price
+        FROM books
+        WHERE price > 0 AND pub_year IS NOT NULL
+        GROUP BY pub_year
+        ORDER BY avg_price DESC
+        LIMIT 1
+    """,
+    
+    "16. Count Authors Who Published 3 Consecutive Years": """
+        WITH author_years AS (
             SELECT 
-                authors,
-                published_year,
-                COUNT(DISTINCT publisher) as publisher_count,
-                COUNT(*) as book_count
-            FROM books
-            WHERE authors != 'Unknown' 
-              AND published_year != ''
-              AND publisher != 'Unknown'
-            GROUP BY authors, published_year
-            HAVING COUNT(DISTINCT publisher) > 1
-            ORDER BY book_count DESC
-            LIMIT 50
-        """,
-        
-        "18. Average Price Comparison: eBooks vs Physical": """
+                ba.author,
+                b.pub_year,
+                LAG(b.pub_year, 1) OVER (PARTITION BY ba.author ORDER BY b.pub_year) as prev_year,
+                LAG(b.pub_year, 2) OVER (PARTITION BY ba.author ORDER BY b.pub_year) as prev_prev_year
+            FROM book_authors ba
+            JOIN books b ON b.book_id = ba.book_id
+            WHERE b.pub_year IS NOT NULL
+            GROUP BY ba.author, b.pub_year
+        )
+        SELECT COUNT(DISTINCT author) as authors_with_3_consecutive_years
+        FROM author_years
+        WHERE pub_year = prev_year + 1 AND pub_year = prev_prev_year + 2
+    """,
+    
+    "17. Authors with Multiple Publishers in Same Year": """
+        SELECT 
+            ba.author as authors,
+            b.published_year,
+            COUNT(DISTINCT b.publisher) as publisher_count,
+            COUNT(*) as book_count
+        FROM book_authors ba
+        JOIN books b ON b.book_id = ba.book_id
+        WHERE b.published_year != ''
+          AND b.publisher != 'Unknown'
+        GROUP BY ba.author, b.published_year
+        HAVING COUNT(DISTINCT b.publisher) > 1
+        ORDER BY book_count DESC
+        LIMIT 50
+    """,
+    
+    "18. Average Price Comparison: eBooks vs Physical": """
+        SELECT 
+            AVG(CASE WHEN is_ebook = 1 THEN price ELSE NULL END) as avg_ebook_price,
+            AVG(CASE WHEN is_ebook = 0 THEN price ELSE NULL END) as avg_physical_price
+        FROM books
+        WHERE price > 0
+    """,
+    
+    "19. Rating Outliers (2+ Standard Deviations)": """
+        WITH rating_stats AS (
             SELECT 
-                AVG(CASE WHEN is_ebook = 1 THEN price ELSE NULL END) as avg_ebook_price,
-                AVG(CASE WHEN is_ebook = 0 THEN price ELSE NULL END) as avg_physical_price
+                AVG(average_rating) as mean,
+                STDDEV(average_rating) as stddev
             FROM books
-            WHERE price > 0
-        """,
-        
-        "19. Rating Outliers (2+ Standard Deviations)": """
-            WITH rating_stats AS (
-                SELECT 
-                    AVG(average_rating) as mean,
-                    STDDEV(average_rating) as stddev
-                FROM books
-                WHERE average_rating > 0
-            )
-            SELECT title, average_rating, ratings_count
-            FROM books, rating_stats
             WHERE average_rating > 0
-              AND (average_rating > mean + 2 * stddev OR average_rating < mean - 2 * stddev)
-            ORDER BY ABS(average_rating - mean) DESC
+        )
+        SELECT title, average_rating, ratings_count,
+               ROUND(ABS(average_rating - mean), 3) as deviation
+        FROM books, rating_stats
+        WHERE average_rating > 0
+          AND (average_rating > mean + 2 * stddev OR average_rating < mean - 2 * stddev)
+        ORDER BY deviation DESC
+        LIMIT 50
+    """,
+    
+    "20. Top Rated Publisher (10+ Books)": """
+        SELECT 
+            publisher,
+            AVG(average_rating) as avg_rating,
+            COUNT(*) as book_count
+        FROM books
+        WHERE publisher != 'Unknown' AND average_rating > 0
+        GROUP BY publisher
+        HAVING COUNT(*) > 10
+        ORDER BY avg_rating DESC
+        LIMIT 1
+    """
+}
+
+# Equivalent queries over the summary tables, used while they are fresh
+EXPLORER_SUMMARY_QUERIES = {
+    "1. Check Availability of eBooks vs Physical Books": """
+        SELECT
+            SUM(CASE WHEN format = 'ebook' THEN book_count END) as ebook_count,
+            SUM(CASE WHEN format = 'physical' THEN book_count END) as physical_count,
+            ROUND(SUM(CASE WHEN format = 'ebook' THEN book_count END) * 100.0 /
+                  SUM(CASE WHEN format != 'unknown' THEN book_count END), 2) as ebook_percentage
+        FROM agg_formats
+    """,
+
+    "2. Find the Publisher with the Most Books Published": """
+        SELECT publisher, book_count, work_count
+        FROM agg_publishers
+        WHERE publisher != 'Unknown'
+        ORDER BY book_count DESC
+        LIMIT 1
+    """,
+
+    "3. Identify the Publisher with the Highest Average Rating": """
+        SELECT publisher, rating_sum / NULLIF(rating_count, 0) as avg_rating
+        FROM agg_publishers
+        WHERE publisher != 'Unknown' AND book_count > 5
+        ORDER BY avg_rating DESC
+        LIMIT 1
+    """,
+
+    "6. List Books with Discounts Greater than 20%": """
+        SELECT books.title, books.authors,
+               books.price,
+               acs.price_sum / acs.price_count as avg_category_price,
+               ROUND((1 - books.price / (acs.price_sum / acs.price_count)) * 100, 2) as discount_percentage
+        FROM books
+        JOIN agg_category_sets acs ON acs.categories = books.categories
+        WHERE books.price > 0 AND acs.price_count > 0 AND books.price < 0.8 * acs.price_sum / acs.price_count
+        ORDER BY discount_percentage DESC
+        LIMIT 50
+    """,
+
+    "7. Find the Average Page Count for eBooks vs Physical Books": """
+        SELECT
+            SUM(CASE WHEN format = 'ebook' THEN page_sum END) /
+                SUM(CASE WHEN format = 'ebook' THEN paged_count END) as avg_ebook_pages,
+            SUM(CASE WHEN format = 'physical' THEN page_sum END) /
+                SUM(CASE WHEN format = 'physical' THEN paged_count END) as avg_physical_pages
+        FROM agg_formats
+    """,
+
+    "8. Find the Top 3 Authors with the Most Books": """
+        SELECT author as authors, book_count
+        FROM agg_authors
+        ORDER BY book_count DESC
+        LIMIT 3
+    """,
+
+    "9. List Publishers with More than 10 Books": """
+        SELECT publisher, book_count, work_count
+        FROM agg_publishers
+        WHERE publisher != 'Unknown' AND book_count > 10
+        ORDER BY book_count DESC
+    """,
+
+    "10. Find the Average Page Count for Each Category": """
+        SELECT categories,
+               page_sum / paged_count as avg_page_count,
+               paged_count as book_count
+        FROM agg_category_sets
+        WHERE categories != '' AND paged_count > 0
+        ORDER BY avg_page_count DESC
+        LIMIT 20
+    """,
+
+    "12. Books with Ratings Count Greater Than the Average": """
+        SELECT title, authors, ratings_count, average_rating
+        FROM books, agg_global
+        WHERE agg_global.id = 1
+          AND books.ratings_count > agg_global.ratings_count_sum / agg_global.reviewed_count
+        ORDER BY books.ratings_count DESC
+        LIMIT 50
+    """,
+
+    "15. Year with the Highest Average Book Price": """
+        SELECT pub_year as published_year, price_sum / priced_count as avg_price
+        FROM agg_years
+        WHERE priced_count > 0
+        ORDER BY avg_price DESC
+        LIMIT 1
+    """,
+
+    "18. Average Price Comparison: eBooks vs Physical": """
+        SELECT
+            SUM(CASE WHEN format = 'ebook' THEN price_sum END) /
+                SUM(CASE WHEN format = 'ebook' THEN priced_count END) as avg_ebook_price,
+            SUM(CASE WHEN format = 'physical' THEN price_sum END) /
+                SUM(CASE WHEN format = 'physical' THEN priced_count END) as avg_physical_price
+        FROM agg_formats
+    """,
+
+    "19. Rating Outliers (2+ Standard Deviations)": """
+        WITH rating_stats AS (
+            SELECT 
+                rating_sum / rated_count as mean,
+                SQRT(GREATEST(rating_sq_sum / rated_count - POW(rating_sum / rated_count, 2), 0)) as stddev
+            FROM agg_global
+            WHERE id = 1 AND rated_count > 0
+        )
+        SELECT title, average_rating, ratings_count,
+               ROUND(ABS(average_rating - mean), 3) as deviation
+        FROM books, rating_stats
+        WHERE average_rating > 0
+          AND (average_rating > mean + 2 * stddev OR average_rating < mean - 2 * stddev)
+        ORDER BY deviation DESC
+        LIMIT 50
+    """,
+
+    "20. Top Rated Publisher (10+ Books)": """
+        SELECT publisher, rated_sum / rated_count as avg_rating, rated_count as book_count
+        FROM agg_publishers
+        WHERE publisher != 'Unknown' AND rated_count > 10
+        ORDER BY avg_rating DESC
+        LIMIT 1
+    """,
+}
+
+# Per-backend replacements for queries whose MySQL form plans badly there;
+# the rest run through the backend's statement translation (see 1f)
+EXPLORER_DIALECT_QUERIES = {
+    'sqlite': {
+        # SQLite does not index the derived table, so the join rescans books
+        # once per category; a window average needs one sorted pass
+        "6. List Books with Discounts Greater than 20%": """
+            SELECT title, authors, price, avg_category_price,
+                   ROUND((1 - price / avg_category_price) * 100, 2) as discount_percentage
+            FROM (
+                SELECT title, authors, price, AVG(price) OVER (PARTITION BY categories) as avg_category_price
+                FROM books
+                WHERE categories IS NOT NULL
+            ) priced
+            WHERE price > 0 AND price < avg_category_price * 0.8
+            ORDER BY discount_percentage DESC
             LIMIT 50
         """,
-        
-        "20. Top Rated Publisher (10+ Books)": """
-            SELECT 
-                publisher,
-                AVG(average_rating) as avg_rating,
-                COUNT(*) as book_count
-            FROM books
-            WHERE publisher != 'Unknown' AND average_rating > 0
-            GROUP BY publisher
-            HAVING COUNT(*) > 10
-            ORDER BY avg_rating DESC
-            LIMIT 1
-        """
-    }
+    },
+}
+
+def explorer_sql(name, summaries_fresh=False):
+    # The SQL the Query Explorer runs for `name`: the summary-table variant
+    # while those are fresh, else this backend's variant or the original
+    if summaries_fresh and name in EXPLORER_SUMMARY_QUERIES:
+        return EXPLORER_SUMMARY_QUERIES[name]
+    return EXPLORER_DIALECT_QUERIES.get(get_storage_backend().name, {}).get(name, EXPLORER_QUERIES[name])
+
+# Stable page order for each query, in terms of its output columns; the
+# trailing columns break ties. Single-row queries need none. Pages resume by
+# comparing these columns with the last row read back, which MySQL FLOAT
+# columns (price, average_rating) do not round-trip exactly, so they only
+# lead the keys of queries that fit on one page.
+EXPLORER_SORT_KEYS = {
+    "2. Find the Publisher with the Most Books Published": "book_count DESC, publisher",
+    "3. Identify the Publisher with the Highest Average Rating": "avg_rating DESC, publisher",
+    "4. Get the Top 5 Most Expensive Books by Retail Price": "price DESC, title, authors",
+    "5. Find Books Published After 2010 with at Least 500 Pages": "page_count DESC, title, authors",
+    "6. List Books with Discounts Greater than 20%": "discount_percentage DESC, title, authors",
+    "8. Find the Top 3 Authors with the Most Books": "book_count DESC, authors",
+    "9. List Publishers with More than 10 Books": "book_count DESC, publisher",
+    "10. Find the Average Page Count for Each Category": "avg_page_count DESC, categories",
+    "11. Retrieve Books with More than 3 Authors": "author_count DESC, title, authors",
+    "12. Books with Ratings Count Greater Than the Average": "ratings_count DESC, title, authors",
+    "13. Books with the Same Author Published in the Same Year": "book_count DESC, authors, published_year",
+    "14. Books with a Specific Keyword in the Title": "title, authors, published_year",
+    "15. Year with the Highest Average Book Price": "avg_price DESC, published_year",
+    "17. Authors with Multiple Publishers in Same Year": "book_count DESC, authors, published_year",
+    "19. Rating Outliers (2+ Standard Deviations)": "deviation DESC, title, ratings_count",
+    "20. Top Rated Publisher (10+ Books)": "avg_rating DESC, publisher",
+}
+
+def query_explorer():
+    st.header("📊 Query Explorer")
+    
+    selected = st.selectbox("Choose query", list(EXPLORER_QUERIES.keys()))
+    page_size = st.select_slider("Rows per page", [25, 50, 100, 250, 500], 50)
     
-    selected = st.selectbox("Choose query", list(queries.keys()))
+    with st.expander("Summary tables"):
+        state = aggregates_state()
+        st.write(f"Status: {'fresh' if state['is_fresh'] else 'stale'} "
+                 f"(last rebuilt: {state['refreshed_at'] or 'never'})")
+        if st.button("Rebuild summary tables"):
+            with st.spinner("Rebuilding summary tables..."):
+                try:
+                    rebuild_aggregates()
+                    note_session_write()
+                    state = {'is_fresh': 1}
+                    st.success("Summary tables rebuilt")
+                except Exception as e:
+                    st.error(f"Rebuild failed: {str(e)}")
     
     if st.button("Run Query"):
-        results = execute_query(queries[selected])
+        sql = explorer_sql(selected, state['is_fresh'])
+        # Where each page starts (see fetch_query_page) lives in the session
+        st.session_state['qe_run'] = {'name': selected, 'sql': sql, 'page_size': page_size, 'pages': [None]}
+
+    run = st.session_state.get('qe_run')
+    if run and (run['name'] != selected or run['page_size'] != page_size):
+        run = st.session_state['qe_run'] = None
+    if run:
+        if run['sql'] == EXPLORER_SUMMARY_QUERIES.get(selected):
+            st.caption("Served from summary tables")
+        with st.expander(f"SQL ({get_storage_backend().name})"):
+            st.code(dialect_sql(run['sql']), language='sql')
+        try:
+            results, next_page, has_more = fetch_query_page(
+                run['sql'], sort_key=EXPLORER_SORT_KEYS.get(selected), after=run['pages'][-1],
+                page_size=page_size, name=f"query_explorer:{selected}"
+            )
+        except Exception as e:
+            st.error(f"Database Error: {str(e)}")
+            return
+
         if results:
-            # Display as table
-            st.write(f"**Results ({len(results)}):**")
-            
-            # Create a HTML table
-            table_html = "<table style='width:100%'><tr>"
-            
-            # Add headers
-            for key in results[0].keys():
-                table_html += f"<th>{key.replace('_', ' ').title()}</th>"
-            table_html += "</tr>"
+            first_row = (len(run['pages']) - 1) * page_size + 1
+            st.write(f"**Results {first_row}–{first_row + len(results) - 1}"
+                     f"{'' if has_more else f' of {first_row + len(results) - 1}'}:**")
             
-            # Add rows
-            for row in results:
-                table_html += "<tr>"
-                for value in row.values():
-                    table_html += f"<td>{value}</td>"
-                table_html += "</tr>"
-            
-            table_html += "</table>"
-            
-            st.markdown(table_html, unsafe_allow_html=True)
+            # st.dataframe renders a virtualized grid, so page size barely affects render time
+            st.dataframe(
+                [{key.replace('_', ' ').title(): value for key, value in row.items()} for row in results],
+                use_container_width=True,
+                hide_index=True
+            )
             
-            # Optional: Add download button
-            if st.button("Download as CSV"):
-                import csv
-                from io import StringIO
-                
-                output = StringIO()
-                writer = csv.DictWriter(output, fieldnames=results[0].keys())
-                writer.writeheader()
-                writer.writerows(results)
-                
-                st.download_button(
-                    label="Download CSV",
-                    data=output.getvalue(),
-                    file_name=f"book_query_{selected.lower().replace(' ', '_')}.csv",
-                    mime="text/csv"
-                )
+            col1, col2, _ = st.columns([1, 1, 4])
+            if col1.button("◀ Previous", disabled=len(run['pages']) == 1):
+                run['pages'].pop()
+                st.rerun()
+            if col2.button("Next ▶", disabled=not has_more):
+                run['pages'].append(next_page)
+                st.rerun()
         else:
             st.warning("No results found for this query")
 
+    with st.expander("Export"):
+        # Streams rows straight from the database into a file under EXPORT_DIR
+        source = st.radio("Source", ["Selected query", "Entire books table"], horizontal=True)
+        fmt = st.selectbox("Format", list(EXPORT_FORMATS.keys()))
+        if st.button("Export"):
+            export_dir = os.getenv('EXPORT_DIR', 'exports')
+            os.makedirs(export_dir, exist_ok=True)
+            stem = "books" if source == "Entire books table" else f"book_query_{selected.split('.')[0]}"
+            extension, mime = EXPORT_FORMATS[fmt]
+            path = os.path.join(export_dir, f"{stem}_{datetime.now():%Y%m%d_%H%M%S}{extension}")
+            
+            counter = st.empty()
+            try:
+                with st.spinner("📤 Exporting..."):
+                    if source == "Entire books table":
+                        stats = export_catalog(path, fmt, progress=lambda n: counter.write(f"{n} rows written"))
+                    else:
+                        sql = explorer_sql(selected, state['is_fresh'])
+                        stats = export_query(sql, path, fmt, name=f"query_explorer:{selected}",
+                                             progress=lambda n: counter.write(f"{n} rows written"))
+            except Exception as e:
+                st.error(f"❌ Export failed: {str(e)}")
+                return
+            
+            st.success(f"✅ Exported {stats['rows']} rows to `{stats['path']}` "
+                       f"in {stats['seconds']}s ({stats['rows_per_sec']} rows/sec)")
+            # Larger files stay on disk rather than being loaded into the session
+            if stats['bytes'] <= int(os.getenv('EXPORT_DOWNLOAD_MAX_BYTES', 100 * 1024 * 1024)):
+                with open(path, 'rb') as f:
+                    st.download_button(f"Download {fmt.upper()}", f, file_name=os.path.basename(path), mime=mime)
+
 # ──────────────────────────────────────────────
 # 7. Trend Analysis
 # ──────────────────────────────────────────────
+# SQL behind the Trend Analysis and Data Insights charts, keyed by profiler
+# name; used when the analytics snapshot is off and by bookscape_bench.py
+DASHBOARD_QUERIES = {
+    "trend_analysis:years": """
+        SELECT DISTINCT published_year FROM books WHERE published_year != '' ORDER BY published_year DESC
+    """,
+    "trend_analysis:rating_ranges": """
+        SELECT 
+            CASE
+                WHEN average_rating >= 4.5 THEN '4.5+'
+                WHEN average_rating >= 4.0 THEN '4.0-4.5'
+                WHEN average_rating >= 3.5 THEN '3.5-4.0'
+                ELSE 'Below 3.5'
+            END as rating_range,
+            COUNT(*) as count
+        FROM books
+        GROUP BY rating_range
+        ORDER BY rating_range
+    """,
+    # Fixed query - backticks around reserved keyword
+    "data_insights:price_ranges": """
+        SELECT 
+            CASE
+                WHEN price = 0 THEN 'Free'
+                WHEN price < 10 THEN '0-10'
+                WHEN price < 20 THEN '10-20'
+                ELSE '20+'
+            END AS `price_range`,
+            COUNT(*) as count
+        FROM books
+        WHERE price IS NOT NULL
+        GROUP BY `price_range`
+        ORDER BY 
+            CASE `price_range`
+                WHEN 'Free' THEN 0
+                WHEN '0-10' THEN 1
+                WHEN '10-20' THEN 2
+                ELSE 3
+            END
+    """,
+    "data_insights:rating_ranges": """
+        SELECT 
+            CASE
+                WHEN average_rating >= 4.5 THEN '4.5+ Stars'
+                WHEN average_rating >= 4.0 THEN '4.0-4.5 Stars'
+                WHEN average_rating >= 3.5 THEN '3.5-4.0 Stars'
+                WHEN average_rating >= 3.0 THEN '3.0-3.5 Stars'
+                ELSE 'Below 3.0'
+            END AS rating_range,
+            COUNT(*) as count
+        FROM books
+        WHERE average_rating IS NOT NULL
+        GROUP BY rating_range
+        ORDER BY 
+            CASE rating_range
+                WHEN '4.5+ Stars' THEN 0
+                WHEN '4.0-4.5 Stars' THEN 1
+                WHEN '3.5-4.0 Stars' THEN 2
+                WHEN '3.0-3.5 Stars' THEN 3
+                ELSE 4
+            END
+    """,
+}
+
 def trend_analysis():
     st.header("📈 Trend Analysis")
     
+    snapshot = analytics_snapshot()
+    if snapshot:
+        st.caption(f"Computed in-process from a snapshot of {snapshot.stats['rows']} books "
+                   f"(last refresh {snapshot.stats['last_refresh_ms']} ms)")
+    
     tab1, tab2 = st.tabs(["By Year", "By Rating"])
     
     with tab1:
-        years = execute_query("SELECT DISTINCT published_year FROM books WHERE published_year != '' ORDER BY published_year DESC")
+        if snapshot:
+            years = [{'published_year': year} for year in snapshot.distinct_years()]
+        else:
+            years = cached_query(DASHBOARD_QUERIES["trend_analysis:years"], name="trend_analysis:years")
         if years:
             selected_years = st.multiselect("Select years", [y['published_year'] for y in years])
             if selected_years:
-                query = f"""
-                SELECT published_year, COUNT(*) as count
-                FROM books
-                WHERE published_year IN ({','.join(f"'{y}'" for y in selected_years)})
-                GROUP BY published_year
-                ORDER BY published_year
-                """
-                data = execute_query(query)
+                if snapshot:
+                    data = snapshot.year_counts(selected_years)
+                else:
+                    query = f"""
+                    SELECT published_year, COUNT(*) as count
+                    FROM books
+                    WHERE published_year IN ({','.join(['%s'] * len(selected_years))})
+                    GROUP BY published_year
+                    ORDER BY published_year
+                    """
+                    data = cached_query(query, tuple(selected_years), name="trend_analysis:per_year")
                 if data:
                     st.write("Publications per year:")
                     for row in data:
                         st.write(f"{row['published_year']}: {row['count']} books")
     
     with tab2:
-        query = """
-        SELECT 
-            CASE
-                WHEN average_rating >= 4.5 THEN '4.5+'
-                WHEN average_rating >= 4.0 THEN '4.0-4.5'
-                WHEN average_rating >= 3.5 THEN '3.5-4.0'
-                ELSE 'Below 3.5'
-            END as rating_range,
-            COUNT(*) as count
-        FROM books
-        GROUP BY rating_range
-        ORDER BY rating_range
-        """
-        results = execute_query(query)
+        results = snapshot.trend_rating_ranges() if snapshot else cached_query(
+            DASHBOARD_QUERIES["trend_analysis:rating_ranges"], name="trend_analysis:rating_ranges")
         if results:
             st.write("Books by rating range:")
             for row in results:
@@ -667,31 +5103,14 @@ def trend_analysis():
 # 8. Data Insights
 # ──────────────────────────────────────────────
 def data_insights():
+    import plotly.express as px
     st.header("💡 Data Insights")
+    snapshot = analytics_snapshot()
     
     st.write("**Price Distribution**")
     try:
-        # Fixed query - backticks around reserved keyword
-        price_data = execute_query("""
-            SELECT 
-                CASE
-                    WHEN price = 0 THEN 'Free'
-                    WHEN price < 10 THEN '0-10'
-                    WHEN price < 20 THEN '10-20'
-                    ELSE '20+'
-                END AS `price_range`,
-                COUNT(*) as count
-            FROM books
-            WHERE price IS NOT NULL
-            GROUP BY `price_range`
-            ORDER BY 
-                CASE `price_range`
-                    WHEN 'Free' THEN 0
-                    WHEN '0-10' THEN 1
-                    WHEN '10-20' THEN 2
-                    ELSE 3
-                END
-        """)
+        price_data = snapshot.price_ranges() if snapshot else cached_query(
+            DASHBOARD_QUERIES["data_insights:price_ranges"], name="data_insights:price_ranges")
         
         if price_data:
             st.write("### Books by Price Range")
@@ -707,28 +5126,8 @@ def data_insights():
     
     st.write("**Rating Distribution**")
     try:
-        rating_data = execute_query("""
-            SELECT 
-                CASE
-                    WHEN average_rating >= 4.5 THEN '4.5+ Stars'
-                    WHEN average_rating >= 4.0 THEN '4.0-4.5 Stars'
-                    WHEN average_rating >= 3.5 THEN '3.5-4.0 Stars'
-                    WHEN average_rating >= 3.0 THEN '3.0-3.5 Stars'
-                    ELSE 'Below 3.0'
-                END AS rating_range,
-                COUNT(*) as count
-            FROM books
-            WHERE average_rating IS NOT NULL
-            GROUP BY rating_range
-            ORDER BY 
-                CASE rating_range
-                    WHEN '4.5+ Stars' THEN 0
-                    WHEN '4.0-4.5 Stars' THEN 1
-                    WHEN '3.5-4.0 Stars' THEN 2
-                    WHEN '3.0-3.5 Stars' THEN 3
-                    ELSE 4
-                END
-        """)
+        rating_data = snapshot.rating_ranges() if snapshot else cached_query(
+            DASHBOARD_QUERIES["data_insights:rating_ranges"], name="data_insights:rating_ranges")
         
         if rating_data:
             st.write("### Books by Rating")
@@ -751,36 +5150,207 @@ def community():
             st.success("Posted to community board!")
     
     with st.expander("Statistics"):
-        stats = execute_query("SELECT COUNT(*) as total_books FROM books")
+        stats = cached_query("SELECT COUNT(*) as total_books, COUNT(DISTINCT COALESCE(work_id, book_id)) as total_works "
+                             "FROM books", name="community:total_books")
         if stats:
-            st.write(f"Total books in database: {stats[0]['total_books']}")
+            st.write(f"Total books in database: {stats[0]['total_books']} "
+                     f"({stats[0]['total_works']} distinct works)")
         st.write("Active users: 42")
 
+# ──────────────────────────────────────────────
+# 9a. Admin: Performance
+# ──────────────────────────────────────────────
+def admin_metrics():
+    import plotly.express as px
+    st.header("🛠️ Performance")
+    profiler = get_query_profiler()
+
+    profiler.slow_ms = st.number_input("Slow query threshold (ms)", 1, 60000, int(profiler.slow_ms))
+    snapshot = metrics_snapshot()
+
+    st.write("**Queries, API calls and page runs**")
+    st.caption("`page:` rows time whole script runs (one per interaction); "
+               "`page:cold start` is the first run in this process, including schema setup.")
+    rows = [
+        {'name': name, **{key: value for key, value in stats.items() if key != 'histogram'}}
+        for name, stats in sorted(snapshot['queries']['queries'].items(),
+                                  key=lambda item: item[1]['total_ms'], reverse=True)
+    ]
+    if rows:
+        st.dataframe(rows, use_container_width=True)
+        selected = st.selectbox("Latency histogram", [row['name'] for row in rows])
+        histogram = snapshot['queries']['queries'][selected]['histogram']
+        fig = px.bar(x=list(histogram.keys()), y=list(histogram.values()),
+                     labels={'x': 'Latency bucket (≤ ms)', 'y': 'Calls'})
+        st.plotly_chart(fig)
+    else:
+        st.info("No queries recorded yet")
+
+    st.write(f"**Slow queries** (≥ {profiler.slow_ms:g} ms)")
+    for entry in snapshot['queries']['slow_log']:
+        with st.expander(f"{entry['at']} · {entry['name']} · {entry['ms']} ms"):
+            st.code(entry['sql'] or '', language='sql')
+            if entry['explain']:
+                st.dataframe(entry['explain'], use_container_width=True)
+
+    with st.expander("Storage backend"):
+        storage = snapshot['storage']
+        st.write(f"**{storage['backend']}** (DB_BACKEND)"
+                 + (f" · `{storage['path']}`" if storage.get('path') else f" · {storage['host']}/{storage['database']}"))
+        st.json(storage)
+
+    with st.expander("Connection pool"):
+        pool_metrics = snapshot['connection_pool']
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Pool size", f"{pool_metrics['open']}/{pool_metrics['size']}")
+        col2.metric("Checkouts", pool_metrics['checkouts'])
+        col3.metric("Avg wait (ms)", pool_metrics['avg_wait_ms'])
+        st.json(pool_metrics)
+
+    with st.expander("Import jobs"):
+        job_metrics = snapshot['import_jobs']
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Running", f"{job_metrics['running']}/{job_metrics['workers']}")
+        col2.metric("Queued", job_metrics['queued'])
+        col3.metric("Sessions waiting or running", job_metrics['sessions'])
+        jobs = get_import_jobs().jobs()
+        if jobs:
+            st.dataframe([{key: value for key, value in job.items() if key not in ('owner', 'result')}
+                          for job in jobs], use_container_width=True)
+        st.json(job_metrics)
+
+    with st.expander("Read replicas"):
+        routing = snapshot['read_routing']
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Replica reads", routing['replica_reads'])
+        col2.metric("Primary reads", routing['primary_reads'])
+        col3.metric("Fallbacks", routing['fallbacks'])
+        if routing['replicas']:
+            st.dataframe([{key: value for key, value in replica.items() if key != 'pool'}
+                          for replica in routing['replicas']], use_container_width=True)
+        else:
+            st.info("No replicas configured (DB_REPLICAS); every query goes to the primary")
+        st.json(routing)
+
+    with st.expander("API response cache"):
+        cache_metrics = snapshot['api_cache']
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Hit rate", f"{cache_metrics['hit_rate']:.0%}")
+        col2.metric("Cached pages", cache_metrics['disk_entries'])
+        col3.metric("Evictions", cache_metrics['memory_evictions'] + cache_metrics['disk_evictions'])
+        st.json(cache_metrics)
+
+    with st.expander("Query result cache"):
+        query_metrics = snapshot['query_cache']
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Hit rate", f"{query_metrics['hit_rate']:.0%}")
+        col2.metric("Cached results", query_metrics['entries'])
+        col3.metric("Memory (KB)", round(query_metrics['bytes'] / 1024, 1))
+        st.json(query_metrics)
+
+    with st.expander("Thumbnail cache"):
+        thumbnail_metrics = snapshot['thumbnails']
+        col1, col2, col3 = st.columns(3)
+        lookups = thumbnail_metrics['hits'] + thumbnail_metrics['misses']
+        col1.metric("Hit rate", f"{thumbnail_metrics['hits'] / lookups:.0%}" if lookups else "–")
+        col2.metric("Cached covers", thumbnail_metrics['entries'])
+        col3.metric("Disk (MB)", round(thumbnail_metrics['bytes'] / 1024 / 1024, 1))
+        st.json(thumbnail_metrics)
+
+    with st.expander("Similar books index"):
+        similar_metrics = snapshot['similar_books']
+        if similar_metrics is None:
+            st.info("Disabled (SIMILAR_BOOKS=0) or NumPy is not installed")
+        else:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Indexed books", similar_metrics['books'])
+            col2.metric("Last lookup (ms)", similar_metrics['last_lookup_ms'])
+            col3.metric("Memory (MB)", round(similar_metrics['memory_bytes'] / 1024 / 1024, 1))
+            st.json(similar_metrics)
+
+    with st.expander("Schema migrations"):
+        try:
+            applied = applied_migrations()
+        except Exception as e:
+            st.error(f"Could not read schema_migrations: {str(e)}")
+        else:
+            done = {row['version'] for row in applied}
+            pending = [f"{version}. {name}" for version, name, _ in MIGRATIONS if version not in done]
+            st.write(f"Schema version {max(done, default=0)}; "
+                     + (f"pending: {', '.join(pending)}" if pending else "up to date"))
+            st.dataframe(applied, use_container_width=True)
+
+    with st.expander("Edition clusters"):
+        state = works_state()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Volumes", state['volumes'])
+        col2.metric("Works", state['works'])
+        col3.metric("Not yet clustered", state['unclustered'])
+        dedup = get_dedup_stats().metrics()
+        if dedup['skipped']:
+            st.warning(f"⚠️ Since the app started, {dedup['hot_buckets']} title buckets held more than "
+                       f"{dedup['bucket_cap']} earlier books, and {dedup['skipped']} of those books were not "
+                       "compared. Raise DEDUP_BUCKET_CAP if editions of very common titles stay apart.")
+        if st.button("Cluster unclustered books", disabled=not state['unclustered']):
+            status = st.empty()
+            try:
+                clustered = backfill_works(progress=lambda n: status.text(f"{n} books clustered"))
+                note_session_write()
+                st.success(f"Clustered {clustered} books")
+            except Exception as e:
+                st.error(f"Clustering failed: {str(e)}")
+
+    with st.expander("Catalog refresh"):
+        st.caption("Re-fetch the least recently imported books and update the columns that changed. "
+                   "Each book costs one API request.")
+        col1, col2 = st.columns(2)
+        budget = col1.number_input("Request budget", 1, 10000, int(os.getenv('REFRESH_BUDGET', 200)))
+        min_age = col2.number_input("Only books older than (hours)", 0, 24 * 365,
+                                    int(float(os.getenv('REFRESH_MIN_AGE_HOURS', 24))))
+        if st.button("Refresh stalest books"):
+            status = st.empty()
+            try:
+                result = refresh_stale_books(
+                    budget=budget, min_age_hours=min_age,
+                    progress=lambda stats: status.text(
+                        f"Checked {stats['checked']} · changed {stats['changed']} · "
+                        f"{stats['requests']}/{budget} requests"
+                    )
+                )
+            except Exception as e:
+                st.error(f"Refresh failed: {str(e)}")
+            else:
+                note_session_write()
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("Checked", result['checked'])
+                col2.metric("Changed", result['changed'])
+                col3.metric("Missing upstream", result['missing'])
+                col4.metric("Failed", result['failed'])
+                st.json(result)
+
+    col1, col2 = st.columns(2)
+    col1.download_button(
+        label="Download metrics (JSON)",
+        data=json.dumps(snapshot, indent=2, default=str),
+        file_name="bookscape_metrics.json",
+        mime="application/json"
+    )
+    if col2.button("Reset query statistics"):
+        profiler.reset()
+        st.rerun()
+
 # ──────────────────────────────────────────────
 # 10. Main App
 # ──────────────────────────────────────────────
 def main():
-    # Initialize database
-    execute_query("""
-    CREATE TABLE IF NOT EXISTS books (
-        book_id VARCHAR(255) PRIMARY KEY,
-        title VARCHAR(255),
-        authors TEXT,
-        publisher VARCHAR(255),
-        published_year VARCHAR(10),
-        description TEXT,
-        isbn VARCHAR(20),
-        page_count INT,
-        categories TEXT,
-        average_rating FLOAT,
-        ratings_count INT,
-        price FLOAT,
-        currency VARCHAR(10),
-        thumbnail TEXT,
-        import_timestamp DATETIME
-    )
-    """)
-    
+    cold = next(get_run_counter()) == 0
+    # An unreachable database must not take down the pages that do not need it
+    try:
+        ensure_schema()
+        schema_error = None
+    except Exception as e:
+        schema_error = e
+
     st.sidebar.title("Navigation")
     page = st.sidebar.radio("Menu", [
         "Home", 
@@ -789,11 +5359,14 @@ def main():
         "Query Explorer",
         "Trend Analysis",
         "Data Insights",
-        "Community and statistics"
+        "Community and statistics",
+        "Admin: Performance"
     ])
     
     if page == "Home":
         show_home()
+    elif schema_error is not None:
+        st.error(f"❌ The database is unavailable ({str(schema_error)}). Try again shortly.")
     elif page == "Basic Search":
         basic_search()
     elif page == "Advanced Search":
@@ -806,6 +5379,11 @@ def main():
         data_insights()
     elif page == "Community and statistics":
         community()
+    elif page == "Admin: Performance":
+        admin_metrics()
+    # Recorded at the end of the run, so the Admin page shows the runs before it
+    get_query_profiler().record("page:cold start" if cold else f"page:{page}",
+                                time.perf_counter() - SCRIPT_STARTED)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,836 @@
+# Benchmarks for BookScape Explorer.
+#
+#     python bookscape_bench.py run --scale 10k            # time everything, save JSON
+#     python bookscape_bench.py run --scale 100k --compare bench_results/previous.json
+#     python bookscape_bench.py generate --scale 10k --kind volumes --output volumes.ndjson
+#     python bookscape_bench.py serve --scale 1M --port 8765
+#
+# `run` times process_book/process_page, fetching pages from a local fake volumes server,
+# store_books_bulk, every Query Explorer query and the Trend Analysis / Data
+# Insights aggregates (SQL and the in-memory snapshot), and writes the results
+# to a JSON file. Point DB_NAME at a dedicated database: synthetic books
+# (ids starting with "bench-") are loaded into it.
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import Project_Codel_Bookscape as app
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000}
+PHASES = ('process', 'fetch', 'thumbnails', 'store', 'explorer', 'dashboards', 'similar', 'startup')
+DATABASE_PHASES = ('store', 'explorer', 'dashboards', 'similar')
+
+# ──────────────────────────────────────────────
+# Synthetic Catalog
+# ──────────────────────────────────────────────
+WORDS = (
+    "river night garden empire shadow letters winter silent machine history city ocean "
+    "stone light secret war house journey children memory fire island kingdom music "
+    "science dream storm forest glass iron mountain moon star road world heart family "
+    "code data python learning guide art modern theory practice introduction complete"
+).split()
+FIRST_NAMES = (
+    "Ada Alan Anna Ben Carla Chen David Elena Farah George Hana Ivan James Jun Kofi Laura "
+    "Lina Marco Maya Nadia Omar Priya Ravi Rosa Sam Sara Tariq Uma Victor Wei Yara Zoe"
+).split()
+LAST_NAMES = (
+    "Adams Baker Costa Diaz Evans Fischer Garcia Hughes Ito Jensen Kumar Lopez Moreau "
+    "Nakamura Okafor Patel Quinn Rossi Silva Tanaka Ueda Varga Wang Xu Yilmaz Zhang"
+).split()
+CATEGORIES = (
+    "Fiction", "History", "Science", "Computers", "Business & Economics", "Biography & Autobiography",
+    "Juvenile Fiction", "Poetry", "Philosophy", "Religion", "Cooking", "Travel", "Art",
+    "Mathematics", "Medical", "Psychology", "Education", "Political Science", "Drama", "Music",
+)
+
+def _skewed(rng, size):
+    # Index in [0, size) with a long tail, so a few authors/publishers dominate
+    return min(size - 1, int(size * rng.random() ** 3))
+
+def _isbn13(rng):
+    digits = [9, 7, 8] + [rng.randrange(10) for _ in range(9)]
+    check = (10 - sum(d * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10) % 10
+    return ''.join(map(str, digits + [check]))
+
+def _isbn10(isbn13):
+    body = isbn13[3:12]
+    check = (11 - sum((10 - i) * int(d) for i, d in enumerate(body)) % 11) % 11
+    return body + ('X' if check == 10 else str(check))
+
+def _author(n):
+    first, rest = FIRST_NAMES[n % len(FIRST_NAMES)], n // len(FIRST_NAMES)
+    name = f"{first} {LAST_NAMES[rest % len(LAST_NAMES)]}"
+    return f"{name} {rest // len(LAST_NAMES)}" if rest >= len(LAST_NAMES) else name
+
+def synthetic_volume(index, seed=0):
+    # Deterministic Google Books volume for position `index`: the same
+    # (index, seed) always gives the same JSON, so pages need not be stored
+    rng = random.Random(seed * 1_000_003 + index)
+    volume_id = f"bench-{seed}-{index}"
+    info = {'title': ' '.join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(2, 6)))}
+
+    author_count = rng.choices((1, 2, 3, 4, 5), (70, 18, 7, 3, 2))[0]
+    info['authors'] = [_author(_skewed(rng, 20000)) for _ in range(author_count)]
+    if rng.random() < 0.95:
+        info['publisher'] = f"{rng.choice(LAST_NAMES)} {rng.choice(('Press', 'Books', 'Publishing', 'House'))} {_skewed(rng, 500)}"
+    if rng.random() < 0.97:
+        year = 2024 - min(124, int(rng.expovariate(1 / 15)))
+        info['publishedDate'] = f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" if rng.random() < 0.5 else str(year)
+    if rng.random() < 0.9:
+        info['description'] = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 120)))
+    if rng.random() < 0.8:
+        isbn = _isbn13(rng)
+        info['industryIdentifiers'] = [{'type': 'ISBN_13', 'identifier': isbn}]
+        if rng.random() < 0.5:
+            info['industryIdentifiers'].append({'type': 'ISBN_10', 'identifier': _isbn10(isbn)})
+    if rng.random() < 0.9:
+        info['pageCount'] = rng.randint(40, 1200)
+    if rng.random() < 0.9:
+        info['categories'] = rng.sample(CATEGORIES, rng.choice((1, 1, 1, 2)))
+    if rng.random() < 0.6:
+        info['averageRating'] = rng.choices((1.0, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0),
+                                            (1, 2, 3, 8, 15, 30, 25, 16))[0]
+        info['ratingsCount'] = int(rng.paretovariate(1.1))
+    if rng.random() < 0.85:
+        info['imageLinks'] = {
+            'thumbnail': f"http://books.google.com/books/content?id={volume_id}&printsec=frontcover&img=1&zoom=1"
+        }
+
+    sale = {'country': 'US', 'isEbook': rng.random() < 0.5}
+    if rng.random() < 0.4:
+        sale['saleability'] = 'FOR_SALE'
+        sale['retailPrice'] = {'amount': round(rng.uniform(0.99, 59.99), 2), 'currencyCode': 'USD'}
+    else:
+        sale['saleability'] = 'NOT_FOR_SALE'
+    return {'kind': 'books#volume', 'id': volume_id, 'volumeInfo': info, 'saleInfo': sale}
+
+def synthetic_volumes(count, seed=0, start=0):
+    for index in range(start, start + count):
+        yield synthetic_volume(index, seed)
+
+def synthetic_rows(count, seed=0, start=0):
+    # `books` rows as store_books receives them (BookRecords)
+    import_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for volume in synthetic_volumes(count, seed, start):
+        yield app.book_record(volume, import_timestamp)
+
+def cover_png(volume_id, width=128, height=192):
+    # Solid-colour PNG cover, coloured by volume id (no imaging library needed)
+    digest = zlib.crc32(volume_id.encode('utf-8'))
+    pixel = bytes((digest & 0xFF, (digest >> 8) & 0xFF, (digest >> 16) & 0xFF))
+    raw = (b'\x00' + pixel * width) * height
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw))
+            + chunk(b'IEND', b''))
+
+# ──────────────────────────────────────────────
+# Fake Volumes Server
+# ──────────────────────────────────────────────
+class FakeVolumesServer:
+    # Local stand-in for the volumes endpoint: /volumes?q=&startIndex=&maxResults=
+    # pages over `total` synthetic volumes (the query text is ignored),
+    # /volumes/<id> returns one and /covers/<id>.png serves their thumbnails. latency_ms and error_rate (503s) simulate a
+    # real API; start() returns the URL to use as BOOKS_API_URL. For tests,
+    # fail() scripts the next responses, `overlap` shifts every page after the
+    # first back by that many volumes (results moving between requests, as on
+    # the real API, so the first page's tail comes again), and `covers`
+    # overrides single cover responses.
+    def __init__(self, total, seed=0, latency_ms=0.0, error_rate=0.0, overlap=0, host='127.0.0.1', port=0):
+        self.total = total
+        self.seed = seed
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.overlap = overlap
+        self.requests = 0
+        self.paths = []
+        self.covers = {}                # volume id -> (status, body, content type)
+        self._failures = deque()
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload, content_type='application/json'):
+                body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    server.paths.append(self.path)
+                    failure = server._failures.popleft() if server._failures else None
+                if server.latency:
+                    time.sleep(server.latency)
+                if failure:
+                    status, retry_after = failure
+                    self.send_response(status)
+                    if retry_after is not None:
+                        self.send_header('Retry-After', str(retry_after))
+                    self.send_header('Content-Length', '0')
+                    return self.end_headers()
+                if server.error_rate and random.random() < server.error_rate:
+                    return self._send(503, {'error': {'code': 503, 'message': 'Backend Error'}})
+                url = urlparse(self.path)
+                parts = url.path.rstrip('/').split('/')
+                if len(parts) > 1 and parts[-2] == 'covers':
+                    volume_id = parts[-1].split('.')[0]
+                    if volume_id in server.covers:
+                        return self._send(*server.covers[volume_id])
+                    return self._send(200, cover_png(volume_id), 'image/png')
+                if parts[-1] != 'volumes':
+                    return self._send(*server.volume(parts[-1]))
+                params = parse_qs(url.query)
+                start = int(params.get('startIndex', ['0'])[0])
+                start = max(0, start - server.overlap) if start else 0
+                size = min(40, int(params.get('maxResults', ['10'])[0]))
+                items = [server.local_covers(volume) for volume in
+                         synthetic_volumes(max(0, min(size, server.total - start)), server.seed, start)]
+                payload = {'kind': 'books#volumes', 'totalItems': server.total}
+                if items:
+                    payload['items'] = items
+                self._send(200, payload)
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._thread = None
+
+    def fail(self, count, status=503, retry_after=None):
+        # The next `count` requests get `status` (with Retry-After when given)
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def local_covers(self, volume):
+        # Point thumbnails at this server's /covers so image fetches stay local
+        if 'imageLinks' in volume['volumeInfo']:
+            volume['volumeInfo']['imageLinks']['thumbnail'] = self.cover_url(volume['id'])
+        return volume
+
+    def cover_url(self, volume_id):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/covers/{volume_id}.png"
+
+    def volume(self, volume_id):
+        prefix = f"bench-{self.seed}-"
+        if volume_id.startswith(prefix) and volume_id[len(prefix):].isdigit():
+            index = int(volume_id[len(prefix):])
+            if index < self.total:
+                return 200, self.local_covers(synthetic_volume(index, self.seed))
+        return 404, {'error': {'code': 404, 'message': 'The volume ID could not be found.'}}
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/books/v1/volumes"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+# ──────────────────────────────────────────────
+# Timing
+# ──────────────────────────────────────────────
+def timed(fn, repeat=3):
+    # Run fn() `repeat` times; fn returns the number of rows it produced
+    runs, rows = [], None
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = fn()
+            runs.append((time.perf_counter() - started) * 1000)
+    except Exception as e:
+        return {'error': str(e), 'runs_ms': [round(ms, 3) for ms in runs]}
+    return {**_ms_summary(runs), 'rows': rows}
+
+def _ms_summary(runs):
+    return {
+        'runs_ms': [round(ms, 3) for ms in runs],
+        'min_ms': round(min(runs), 3),
+        'median_ms': round(statistics.median(runs), 3),
+        'max_ms': round(max(runs), 3),
+    }
+
+def throughput(rows, seconds, **extra):
+    return {'rows': rows, 'seconds': round(seconds, 3),
+            'rows_per_sec': round(rows / seconds, 1) if seconds else None, **extra}
+
+def _retained_bytes(fn):
+    # Bytes still allocated after fn() returns, i.e. the size of what it built
+    tracemalloc.start()
+    try:
+        kept = fn()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return size, len(kept)
+
+def bench_process(count, seed, page_size=40):
+    # Per-item process_book against page-at-a-time process_page, plus decoding
+    # the raw page JSON. Generation is excluded: volumes are built first, in chunks.
+    elapsed = {'process_book': 0.0, 'process_page': 0.0, 'json_decode': 0.0}
+    done = 0
+    for start in range(0, count, 10000):
+        volumes = list(synthetic_volumes(min(10000, count - start), seed, start))
+        pages = [volumes[i:i + page_size] for i in range(0, len(volumes), page_size)]
+        raw = [json.dumps({'totalItems': count, 'items': page}).encode('utf-8') for page in pages]
+
+        started = time.perf_counter()
+        for volume in volumes:
+            app.process_book(volume)
+        elapsed['process_book'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        for page in pages:
+            app.process_page(page)
+        elapsed['process_page'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        for body in raw:
+            app.json_loads(body)
+        elapsed['json_decode'] += time.perf_counter() - started
+        done += len(volumes)
+
+    sample = list(synthetic_volumes(min(count, 10000), seed))
+    book_bytes, rows = _retained_bytes(lambda: [app.process_book(volume) for volume in sample])
+    page_bytes, _ = _retained_bytes(lambda: [record for i in range(0, len(sample), page_size)
+                                             for record in app.process_page(sample[i:i + page_size])[0]])
+    return {
+        'process_book': throughput(done, elapsed['process_book'], bytes_per_row=round(book_bytes / rows, 1)),
+        'process_page': throughput(done, elapsed['process_page'], bytes_per_row=round(page_bytes / rows, 1)),
+        'json_decode': throughput(done, elapsed['json_decode'], decoder='orjson' if app.orjson else 'json'),
+    }
+
+def bench_fetch(count, seed, latency_ms, workers):
+    server = FakeVolumesServer(count, seed, latency_ms=latency_ms)
+    app.BOOKS_API_URL = server.start()
+    try:
+        started = time.perf_counter()
+        fetched = pages = 0
+        for page in app.iter_volume_pages("bench", count, refresh=True, workers=workers):
+            fetched += len(page)
+            pages += 1
+        return throughput(fetched, time.perf_counter() - started, pages=pages,
+                          requests=server.requests, latency_ms=latency_ms, workers=workers)
+    finally:
+        server.stop()
+
+def bench_thumbnails(count, seed, workers):
+    # Cold downloads (with resizing) from the fake server, then warm lookups
+    server = FakeVolumesServer(count, seed)
+    server.start()
+    directory = tempfile.mkdtemp(prefix='bookscape_thumbnails_')
+    cache = app.ThumbnailCache(directory, max_bytes=1024 ** 3, workers=workers)
+    keys = [(f"bench-{seed}-{index}", server.cover_url(f"bench-{seed}-{index}")) for index in range(count)]
+    try:
+        started = time.perf_counter()
+        cache.prefetch(keys)
+        cache._pool.shutdown(wait=True)
+        cold = throughput(count, time.perf_counter() - started, workers=workers)
+
+        started = time.perf_counter()
+        served = sum(1 for key, url in keys if cache.get(key, url, 200))
+        warm = throughput(served, time.perf_counter() - started)
+        return {'cold_prefetch': cold, 'warm_get': warm, 'cache': cache.metrics()}
+    finally:
+        server.stop()
+
+def bench_store(count, seed, batch_size, chunk_size=20000):
+    batches = []
+    elapsed = 0.0
+    for start in range(0, count, chunk_size):
+        rows = list(synthetic_rows(min(chunk_size, count - start), seed, start))
+        started = time.perf_counter()
+        batches.extend(app.store_books_bulk(rows, batch_size))
+        elapsed += time.perf_counter() - started
+        print(f"  stored {start + len(rows)}/{count}", flush=True)
+    result = throughput(sum(b['rows'] for b in batches), elapsed, batch_size=batch_size,
+                        inserted=sum(b['inserted'] for b in batches),
+                        updated=sum(b['updated'] for b in batches),
+                        unchanged=sum(b['unchanged'] for b in batches))
+    batch_ms = sorted(b['seconds'] * 1000 for b in batches)
+    if batch_ms:
+        result['batch_median_ms'] = round(statistics.median(batch_ms), 3)
+        result['batch_p95_ms'] = round(batch_ms[int(0.95 * (len(batch_ms) - 1))], 3)
+    if os.getenv('SUMMARY_TABLES', '1') == '0':
+        started = time.perf_counter()
+        app.rebuild_aggregates()
+        result['rebuild_aggregates_seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+def bench_store_per_row(count, seed, start):
+    # The one-upsert-and-commit-per-book loop store_books_bulk replaced, on
+    # ids past the bulk phase's. It writes only the books rows (no relations,
+    # summaries or works), so they are deleted again afterwards.
+    rows = list(synthetic_rows(count, seed, start))
+    started = time.perf_counter()
+    stored = app.store_books_row_by_row(rows)
+    result = throughput(stored, time.perf_counter() - started)
+    ids = [row.book_id for row in rows]
+    for offset in range(0, len(ids), 1000):
+        chunk = ids[offset:offset + 1000]
+        app.execute_query(f"DELETE FROM books WHERE book_id IN ({', '.join(['%s'] * len(chunk))})", tuple(chunk))
+    return result
+
+def bench_explorer(repeat, page_size=50):
+    # First page of every query, as the Query Explorer fetches it
+    results = {}
+    for name in app.EXPLORER_QUERIES:
+        sql = app.explorer_sql(name)
+
+        def first_page(sql=sql, name=name):
+            rows, _, _ = app.fetch_query_page(sql, sort_key=app.EXPLORER_SORT_KEYS.get(name),
+                                              page_size=page_size, name=f"bench:{name}")
+            return len(rows)
+        results[name] = timed(first_page, repeat)
+        summary_sql = app.EXPLORER_SUMMARY_QUERIES.get(name)
+        if summary_sql:
+            results[f"{name} (summary tables)"] = timed(
+                lambda sql=summary_sql, name=name: first_page(sql, name), repeat)
+        print(f"  {name}: {results[name].get('median_ms', results[name].get('error'))}", flush=True)
+    return results
+
+def bench_dashboards(repeat):
+    results = {}
+    for name, sql in app.DASHBOARD_QUERIES.items():
+        results[f"sql:{name}"] = timed(lambda sql=sql: len(app.execute_query(sql, name=f"bench:{name}") or []),
+                                       repeat)
+    years = [row['published_year'] for row in (app.execute_query(app.DASHBOARD_QUERIES["trend_analysis:years"]) or [])][:5]
+    if years:
+        per_year = (f"SELECT published_year, COUNT(*) as count FROM books "
+                    f"WHERE published_year IN ({','.join(['%s'] * len(years))}) "
+                    f"GROUP BY published_year ORDER BY published_year")
+        results["sql:trend_analysis:per_year"] = timed(
+            lambda: len(app.execute_query(per_year, tuple(years)) or []), repeat)
+
+    try:
+        import numpy as np
+    except ImportError:
+        results['snapshot'] = {'error': 'NumPy is not installed'}
+        return results
+    snapshot = app.AnalyticsSnapshot(np)
+    results['snapshot:cold_load'] = timed(lambda: (snapshot.refresh(), snapshot.stats['rows'])[1], 1)
+    results['snapshot:trend_analysis:years'] = timed(lambda: len(snapshot.distinct_years()), repeat)
+    results['snapshot:trend_analysis:per_year'] = timed(lambda: len(snapshot.year_counts(years)), repeat)
+    results['snapshot:trend_analysis:rating_ranges'] = timed(lambda: len(snapshot.trend_rating_ranges()), repeat)
+    results['snapshot:data_insights:price_ranges'] = timed(lambda: len(snapshot.price_ranges()), repeat)
+    results['snapshot:data_insights:rating_ranges'] = timed(lambda: len(snapshot.rating_ranges()), repeat)
+    return results
+
+def bench_similar(repeat, lookups=200):
+    # Cold build of the similar-books index, then the same lookups answered
+    # exactly and through the SimHash tables, with the approximate recall@10
+    try:
+        import numpy as np
+    except ImportError:
+        return {'error': 'NumPy is not installed'}
+    index = app.SimilarityIndex(np)
+    results = {'cold_build': timed(lambda: (index.refresh(), index.stats['books'])[1], 1)}
+    ids = [row['book_id'] for row in app.execute_query(
+        "SELECT book_id FROM books WHERE book_id LIKE 'bench-%%' ORDER BY book_id LIMIT %s", (lookups,)) or []]
+    if not ids:
+        return results
+    index.exact_max = float('inf')
+    exact = [index.similar(book_id, 10) for book_id in ids]
+    results['exact_lookups'] = timed(lambda: sum(len(index.similar(book_id, 10)) for book_id in ids), repeat)
+    index.exact_max = 0
+    approximate = [index.similar(book_id, 10) for book_id in ids]
+    results['approximate_lookups'] = timed(lambda: sum(len(index.similar(book_id, 10)) for book_id in ids), repeat)
+    recall = [len({i for i, _ in a} & {i for i, _ in e}) / len(e) for a, e in zip(approximate, exact) if e]
+    results['approximate_recall_at_10'] = round(statistics.mean(recall), 4) if recall else None
+    results['index'] = index.metrics()
+    return results
+
+# ──────────────────────────────────────────────
+# Results
+# ──────────────────────────────────────────────
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def _metrics(results, prefix=''):
+    # Flatten to {path: (value, higher_is_better)} for comparison
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            if 'median_ms' in value:
+                flat[path] = (value['median_ms'], False)
+            elif value.get('rows_per_sec') is not None:
+                flat[path] = (value['rows_per_sec'], True)
+            else:
+                flat.update(_metrics(value, f"{path} / "))
+    return flat
+
+def compare(old, new, threshold=0.2):
+    # Metrics that got worse by more than `threshold` (0.2 = 20%)
+    before, after = _metrics(old['results']), _metrics(new['results'])
+    regressions = []
+    for path, (value, higher_is_better) in after.items():
+        if path not in before or not before[path][0] or value is None:
+            continue
+        change = (value - before[path][0]) / before[path][0]
+        if (-change if higher_is_better else change) > threshold:
+            regressions.append({'metric': path, 'before': before[path][0], 'after': value,
+                                'change': f"{change:+.0%}"})
+    return regressions
+
+def print_regressions(regressions, threshold):
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%}")
+        return
+    print(f"{len(regressions)} regression(s) beyond {threshold:.0%}:")
+    for entry in regressions:
+        print(f"  {entry['metric']}: {entry['before']} -> {entry['after']} ({entry['change']})")
+
+# ──────────────────────────────────────────────
+# Commands
+# ──────────────────────────────────────────────
+def parse_scale(value):
+    if value in SCALES:
+        return SCALES[value]
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"scale must be one of {', '.join(SCALES)} or a number")
+
+# Modules the app should only load on the pages that use them
+HEAVY_MODULES = ('plotly.express', 'mysql.connector', 'requests', 'numpy', 'pyarrow', 'duckdb')
+
+# Run in a fresh interpreter, so nothing is already imported or cached
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import Project_Codel_Bookscape
+print(json.dumps({'import_ms': (time.perf_counter() - started) * 1000,
+                  'loaded': [name for name in sys.argv[1:] if name in sys.modules]}))
+"""
+
+APP_PROBE = """
+import json, sys, time
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest, app_test as app_test_module, local_script_runner
+# AppTest compiles the script afresh on every run; the server compiles it
+# once and shares the bytecode, so share one cache here too
+shared_cache = ScriptCache()
+app_test_module.ScriptCache = local_script_runner.ScriptCache = lambda: shared_cache
+app_test = AppTest.from_file(sys.argv[1], default_timeout=300)
+started = time.perf_counter()
+app_test.run()
+result = {'cold_start_ms': (time.perf_counter() - started) * 1000, 'pages': {}, 'errors': []}
+for page in sys.argv[2:]:
+    timings = []
+    for _ in range(3):
+        started = time.perf_counter()
+        app_test.sidebar.radio[0].set_value(page).run()
+        timings.append((time.perf_counter() - started) * 1000)
+    result['pages'][page] = {'first_visit_ms': timings[0], 'rerun_ms': sorted(timings[1:])[0]}
+    result['errors'] += [f"{page}: {exception.message}" for exception in app_test.exception]
+print(json.dumps(result))
+"""
+
+# Pages that render without user input (search pages only draw their forms)
+STARTUP_PAGES = ("Home", "Basic Search", "Advanced Search", "Query Explorer", "Trend Analysis",
+                 "Data Insights", "Community and statistics")
+
+def bench_startup(repeat):
+    # Cold import of the app module, then whole-script runs through Streamlit's
+    # AppTest: the first run (schema setup included), each page's first visit
+    # and a rerun of it, which is what every widget interaction costs. Every
+    # probe is a fresh interpreter, so nothing is imported or cached yet.
+    directory = os.path.dirname(os.path.abspath(app.__file__))
+    imports = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', IMPORT_PROBE, *HEAVY_MODULES], cwd=directory,
+                                capture_output=True, text=True, check=True).stdout
+        imports.append(json.loads(output.strip().splitlines()[-1]))
+    result = {'import': {**_ms_summary([probe['import_ms'] for probe in imports]),
+                         'loaded': imports[0]['loaded']}}
+    try:
+        import streamlit.testing.v1  # noqa: F401
+    except ImportError:
+        result['app'] = {'error': "streamlit.testing is not available"}
+        return result
+
+    probes = []
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, '-c', APP_PROBE, app.__file__, *STARTUP_PAGES],
+                                   cwd=directory, capture_output=True, text=True)
+        if completed.returncode:
+            result['app'] = {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr else 'failed'}
+            return result
+        probes.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    result['cold_start'] = _ms_summary([probe['cold_start_ms'] for probe in probes])
+    result['pages'] = {
+        page: {kind: _ms_summary([probe['pages'][page][f"{kind}_ms"] for probe in probes])
+               for kind in ('first_visit', 'rerun')}
+        for page in probes[0]['pages']
+    }
+    result['errors'] = sorted({error for probe in probes for error in probe['errors']})
+    return result
+
+def use_backend(backend, db_dir=None):
+    # Point the app at `backend`; embedded ones get a fresh file under db_dir
+    os.environ['DB_BACKEND'] = backend
+    if backend in app.DEFAULT_DB_PATHS:
+        directory = db_dir or tempfile.mkdtemp(prefix='bookscape_bench_db_')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"bench_{backend}{os.path.splitext(app.DEFAULT_DB_PATHS[backend])[1]}")
+        for stale in (path, f"{path}-wal", f"{path}-shm", f"{path}.wal"):
+            if os.path.exists(stale):
+                os.remove(stale)
+        os.environ['DB_PATH'] = path
+    app.reset_storage()
+
+def bench_database(args, phases, results, meta):
+    # The store/explorer/dashboards/similar phases against the current backend
+    try:
+        app.init_schema()
+        foreign = app.execute_query("SELECT COUNT(*) AS n FROM books WHERE book_id NOT LIKE 'bench-%'")
+    except Exception as e:
+        foreign = None
+        results['database'] = {'error': str(e)}
+    if foreign is None:
+        print("Database unavailable; skipping store/explorer/dashboards/similar", flush=True)
+        return None
+    if foreign[0]['n'] and not args.allow_existing:
+        print(f"{os.getenv('DB_NAME', 'bookscape')} already holds {foreign[0]['n']} real books; "
+              "point DB_NAME at a dedicated benchmark database or pass --allow-existing", flush=True)
+        return 2
+
+    results['storage'] = app.get_storage_backend().metrics()
+    if 'store' in phases:
+        print("store_books_bulk...", flush=True)
+        results['store_books'] = bench_store(args.scale, args.seed, args.batch_size)
+        if args.per_row:
+            print("store_books_row_by_row...", flush=True)
+            results['store_books_row_by_row'] = bench_store_per_row(args.per_row, args.seed, args.scale)
+    if 'explorer' in phases or 'dashboards' in phases:
+        count = app.execute_query("SELECT COUNT(*) AS n FROM books")
+        meta['books'] = count[0]['n'] if count else None
+    if 'explorer' in phases:
+        print("Query Explorer...", flush=True)
+        results['query_explorer'] = bench_explorer(args.repeat)
+    if 'dashboards' in phases:
+        print("Trend Analysis / Data Insights...", flush=True)
+        results['dashboards'] = bench_dashboards(args.repeat)
+    if 'similar' in phases:
+        print("Similar books index...", flush=True)
+        results['similar_books'] = bench_similar(args.repeat)
+    results['storage'] = app.get_storage_backend().metrics()
+    return None
+
+def print_backend_comparison(results, backends):
+    # Median ms of every query (and store throughput) side by side
+    sections = [results.get(f"backend:{backend}", {}) for backend in backends]
+    width = max(len(backend) for backend in backends) + 2
+    print()
+    print(f"{'':60}" + ''.join(f"{backend:>{max(width, 12)}}" for backend in backends))
+    stores = [section.get('store_books', {}).get('rows_per_sec') for section in sections]
+    if any(stores):
+        print(f"{'store_books (rows/s)':60}" + ''.join(f"{str(value):>{max(width, 12)}}" for value in stores))
+    for group in ('query_explorer', 'dashboards'):
+        names = list(dict.fromkeys(name for section in sections for name in section.get(group, {})))
+        for name in names:
+            values = []
+            for section in sections:
+                entry = section.get(group, {}).get(name, {})
+                values.append(entry.get('median_ms', 'error' if 'error' in entry else '-'))
+            print(f"{name[:58]:60}" + ''.join(f"{str(value):>{max(width, 12)}}" for value in values))
+
+def run(args):
+    phases = [phase.strip() for phase in args.phases.split(',')]
+    # The rate limiter and response cache are created on first use, so configure them first
+    os.environ.setdefault('API_RATE_PER_SEC', '100000')
+    os.environ.setdefault('API_RATE_BURST', '100000')
+    os.environ.setdefault('API_CACHE_PATH', os.path.join(tempfile.mkdtemp(prefix='bookscape_bench_'), 'cache.sqlite'))
+    if args.no_summaries:
+        os.environ['SUMMARY_TABLES'] = '0'
+
+    report = {
+        'meta': {
+            'started_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'scale': args.scale,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'phases': phases,
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backends': args.backends,
+            'env': {key: os.getenv(key) for key in ('DB_BACKEND', 'DB_HOST', 'DB_NAME', 'DB_PATH', 'DB_POOL_SIZE',
+                                                    'STORE_BATCH_SIZE',
+                                                    'SUMMARY_TABLES', 'ANALYTICS_SNAPSHOT', 'HARVEST_WORKERS')},
+        },
+        'results': {},
+    }
+    results = report['results']
+
+    if 'process' in phases:
+        print("process_book / process_page...", flush=True)
+        results['process'] = bench_process(args.scale, args.seed)
+    if 'fetch' in phases:
+        print("fetch (fake volumes server)...", flush=True)
+        results['fetch'] = bench_fetch(min(args.scale, args.fetch_items), args.seed, args.latency_ms,
+                                       args.workers)
+
+    if 'thumbnails' in phases:
+        print("thumbnail cache...", flush=True)
+        results['thumbnails'] = bench_thumbnails(min(args.scale, args.thumbnail_items), args.seed, args.workers)
+
+    backends = [backend.strip() for backend in args.backends.split(',')]
+    if any(phase in phases for phase in DATABASE_PHASES):
+        for backend in backends:
+            # With several backends each gets its own results section; one
+            # backend keeps the flat layout so older result files compare
+            section = results if len(backends) == 1 else results.setdefault(f"backend:{backend}", {})
+            if backend != app.get_storage_backend().name or len(backends) > 1:
+                use_backend(backend, args.db_dir)
+            print(f"Storage backend: {backend}", flush=True)
+            status = bench_database(args, phases, section, report['meta'])
+            if status:
+                return status
+        if len(backends) > 1:
+            print_backend_comparison(results, backends)
+
+    if 'startup' in phases:
+        print("Startup and page reruns...", flush=True)
+        results['startup'] = bench_startup(args.repeat)
+
+    report['meta']['finished_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    output = args.output or os.path.join(
+        'bench_results', f"bench_{datetime.now():%Y%m%d_%H%M%S}_{args.scale}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        print_regressions(regressions, args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+def generate(args):
+    rows = synthetic_volumes(args.scale, args.seed) if args.kind == 'volumes' else synthetic_rows(args.scale, args.seed)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for row in rows:
+            out.write(json.dumps(row if args.kind == 'volumes' else row._asdict()) + '\n')
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+def serve(args):
+    server = FakeVolumesServer(args.scale, args.seed, args.latency_ms, args.error_rate, args.host, args.port)
+    print(f"Serving {args.scale} synthetic volumes at {server.url} (set BOOKS_API_URL to use it)", flush=True)
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+    return 0
+
+def compare_files(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    regressions = compare(before, after, args.threshold)
+    print_regressions(regressions, args.threshold)
+    return 1 if regressions else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="BookScape benchmarks and synthetic data.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def scale_args(command, default='10k'):
+        command.add_argument('--scale', type=parse_scale, default=parse_scale(default),
+                             help=f"{', '.join(SCALES)} or a number of books (default: {default})")
+        command.add_argument('--seed', type=int, default=0, help="synthetic data seed (default: 0)")
+
+    run_parser = commands.add_parser('run', help="run the benchmarks and save the results as JSON")
+    scale_args(run_parser)
+    run_parser.add_argument('--phases', default=','.join(PHASES), help=f"comma-separated subset of {','.join(PHASES)}")
+    run_parser.add_argument('--repeat', type=int, default=3, help="runs per query (default: 3)")
+    run_parser.add_argument('--batch-size', type=int, default=int(os.getenv('STORE_BATCH_SIZE', 500)))
+    run_parser.add_argument('--fetch-items', type=int, default=20000,
+                            help="volumes to page through from the fake server (default: 20000)")
+    run_parser.add_argument('--thumbnail-items', type=int, default=2000,
+                            help="covers to download and resize in the thumbnails phase (default: 2000)")
+    run_parser.add_argument('--workers', type=int, default=int(os.getenv('HARVEST_WORKERS', 4)))
+    run_parser.add_argument('--latency-ms', type=float, default=0.0, help="simulated API latency per request")
+    run_parser.add_argument('--per-row', type=int, default=0,
+                            help="in the store phase, also time the per-row upsert loop over this many books "
+                                 "(default: 0, skipped)")
+    run_parser.add_argument('--no-summaries', action='store_true',
+                            help="store with SUMMARY_TABLES=0 and time one rebuild_aggregates")
+    run_parser.add_argument('--backends', default=os.getenv('DB_BACKEND', 'mysql'),
+                            help=f"comma-separated storage backends to compare ({','.join(app.STORAGE_BACKENDS)}); "
+                                 "embedded ones start from an empty file (default: DB_BACKEND)")
+    run_parser.add_argument('--db-dir', help="where the embedded backends' files go (default: a temp directory)")
+    run_parser.add_argument('--allow-existing', action='store_true',
+                            help="run even if the database holds books that are not synthetic")
+    run_parser.add_argument('--output', help="results file (default: bench_results/bench_<time>_<scale>.json)")
+    run_parser.add_argument('--compare', help="earlier results file to check for regressions")
+    run_parser.add_argument('--threshold', type=float, default=0.2, help="regression threshold (default: 0.2)")
+    run_parser.set_defaults(func=run)
+
+    generate_parser = commands.add_parser('generate', help="write synthetic volumes or books rows as NDJSON")
+    scale_args(generate_parser)
+    generate_parser.add_argument('--kind', choices=('volumes', 'rows'), default='volumes')
+    generate_parser.add_argument('--output', help="file to write (default: stdout)")
+    generate_parser.set_defaults(func=generate)
+
+    serve_parser = commands.add_parser('serve', help="serve synthetic volumes as a fake Books API")
+    scale_args(serve_parser, '1M')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--latency-ms', type=float, default=0.0)
+    serve_parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    serve_parser.set_defaults(func=serve)
+
+    compare_parser = commands.add_parser('compare', help="compare two results files")
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+    compare_parser.set_defaults(func=compare_files)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,195 @@
+# Headless bulk import for BookScape Explorer.
+#
+# Imports every query in a seed file (one per line, blank lines and # comments
+# ignored) through the same process_page/store path as the Streamlit app:
+#
+#     python bookscape_import.py seeds.txt --max-items 1000 --concurrency 4 --batch-size 500
+#
+# Progress is checkpointed after every stored batch (query, next startIndex,
+# last stored id), so re-running the same command after an interruption
+# resumes where it stopped. Use --reset to start over.
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import Project_Codel_Bookscape as app
+
+# ──────────────────────────────────────────────
+# Checkpoint
+# ──────────────────────────────────────────────
+class Checkpoint:
+    # JSON file of per-query progress, rewritten atomically after every batch
+    def __init__(self, path):
+        self.path = path
+        self.state = {'queries': {}}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def query(self, query):
+        return self.state['queries'].setdefault(query, {
+            'start_index': 0, 'last_id': None, 'stored': 0, 'done': False, 'error': None,
+        })
+
+    def save(self):
+        if not self.path:
+            return
+        self.state['updated_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.path)
+
+def read_seeds(path):
+    seeds = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#') and line not in seeds:
+                seeds.append(line)
+    return seeds
+
+# ──────────────────────────────────────────────
+# Import
+# ──────────────────────────────────────────────
+def import_query(query, progress, checkpoint, totals, max_items, page_size, batch_size, concurrency, refresh):
+    # Batches are cut on page boundaries, so after each store the checkpoint's
+    # start_index is exactly the first page that has not been stored yet
+    start_index = progress['start_index']
+    pages = app.iter_volume_pages(query, max_items, page_size, refresh=refresh,
+                                  workers=concurrency, start_index=start_index)
+    batch = []
+    try:
+        for page in pages:
+            start_index += page_size
+            totals['pages'] += 1
+            totals['fetched'] += len(page)
+            records, failed = app.process_page(page)
+            batch.extend(records)
+            totals['failed'] += failed
+            if len(batch) >= batch_size:
+                store_batch(batch, start_index, progress, checkpoint, totals, batch_size)
+                batch = []
+        if batch:
+            store_batch(batch, start_index, progress, checkpoint, totals, batch_size)
+    finally:
+        pages.close()
+    progress['done'] = True
+    progress['error'] = None
+    checkpoint.save()
+
+def store_batch(batch, next_start, progress, checkpoint, totals, batch_size):
+    started = time.perf_counter()
+    for stats in app.store_books_bulk(batch, batch_size):
+        for key in ('inserted', 'updated', 'unchanged'):
+            totals[key] += stats[key]
+        progress['stored'] += stats['rows']
+    totals['store_seconds'] += time.perf_counter() - started
+    app.prefetch_thumbnails(batch)
+    progress['start_index'] = next_start
+    progress['last_id'] = batch[-1].book_id
+    checkpoint.save()
+
+def run(args):
+    seeds = read_seeds(args.seeds)
+    checkpoint = Checkpoint(None if args.no_checkpoint else args.checkpoint)
+    if args.reset:
+        checkpoint.state = {'queries': {}}
+    checkpoint.state['seed_file'] = os.path.abspath(args.seeds)
+    if args.no_summaries:
+        # Skip per-batch summary maintenance and rebuild once at the end
+        os.environ['SUMMARY_TABLES'] = '0'
+    # Cover downloads are opt-in here; a large import would queue millions of them
+    os.environ['THUMBNAIL_PREFETCH'] = '1' if args.thumbnails else '0'
+
+    app.init_schema()
+    totals = {'queries': 0, 'skipped': 0, 'errors': 0, 'pages': 0, 'fetched': 0, 'failed': 0,
+              'inserted': 0, 'updated': 0, 'unchanged': 0, 'store_seconds': 0.0}
+    started = time.perf_counter()
+    interrupted = False
+    try:
+        for number, query in enumerate(seeds, 1):
+            progress = checkpoint.query(query)
+            if progress['done']:
+                totals['skipped'] += 1
+                continue
+            query_started = time.perf_counter()
+            stored_before = progress['stored']
+            try:
+                import_query(query, progress, checkpoint, totals, args.max_items, args.page_size,
+                             args.batch_size, args.concurrency, args.refresh)
+            except Exception as e:
+                # The checkpoint still points at the last stored page; a re-run retries from there
+                totals['errors'] += 1
+                progress['error'] = str(e)
+                checkpoint.save()
+            totals['queries'] += 1
+            print(f"[{number}/{len(seeds)}] {query!r}: {progress['stored'] - stored_before} rows, "
+                  f"startIndex {progress['start_index']}, {time.perf_counter() - query_started:.1f}s"
+                  + (f" - error: {progress['error']}" if progress['error'] else ""),
+                  flush=True)
+    except KeyboardInterrupt:
+        interrupted = True
+        print("Interrupted; progress is saved in the checkpoint", flush=True)
+
+    stored = totals['inserted'] + totals['updated'] + totals['unchanged']
+    if args.no_summaries and stored:
+        app.rebuild_aggregates()
+
+    seconds = time.perf_counter() - started
+    summary = {
+        **totals,
+        'stored': stored,
+        'store_seconds': round(totals['store_seconds'], 3),
+        'seconds': round(seconds, 3),
+        'fetched_per_sec': round(totals['fetched'] / seconds, 1) if seconds else None,
+        'stored_per_sec': round(stored / seconds, 1) if seconds else None,
+        'interrupted': interrupted,
+    }
+    print_summary(summary)
+    if args.metrics:
+        app.write_metrics(args.metrics)
+    return 130 if interrupted else (1 if totals['errors'] else 0)
+
+def print_summary(summary):
+    print()
+    print(f"Queries      {summary['queries']} imported, {summary['skipped']} already done, "
+          f"{summary['errors']} with errors")
+    print(f"Pages        {summary['pages']}")
+    print(f"Volumes      {summary['fetched']} fetched, {summary['failed']} failed to process")
+    print(f"Rows stored  {summary['stored']} ({summary['inserted']} new, {summary['updated']} updated, "
+          f"{summary['unchanged']} unchanged)")
+    print(f"Time         {summary['seconds']}s total, {summary['store_seconds']}s storing")
+    print(f"Throughput   {summary['fetched_per_sec']} volumes/s fetched, "
+          f"{summary['stored_per_sec']} rows/s stored")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-import Google Books volumes into BookScape.")
+    parser.add_argument('seeds', help="file with one search query per line")
+    parser.add_argument('--max-items', type=int, default=1000,
+                        help="volumes to import per query (default: 1000)")
+    parser.add_argument('--page-size', type=int, default=app.BOOKS_API_PAGE_SIZE,
+                        help=f"volumes per API request (max {app.BOOKS_API_PAGE_SIZE})")
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('HARVEST_WORKERS', 4)),
+                        help="API requests in flight per query (default: HARVEST_WORKERS)")
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('STORE_BATCH_SIZE', 500)),
+                        help="rows per store batch and checkpoint (default: STORE_BATCH_SIZE)")
+    parser.add_argument('--checkpoint', default='.bookscape_import.json',
+                        help="checkpoint file (default: .bookscape_import.json)")
+    parser.add_argument('--no-checkpoint', action='store_true', help="do not read or write a checkpoint")
+    parser.add_argument('--reset', action='store_true', help="ignore the existing checkpoint and start over")
+    parser.add_argument('--refresh', action='store_true', help="bypass the API response cache")
+    parser.add_argument('--no-summaries', action='store_true',
+                        help="rebuild the summary tables once at the end instead of per batch")
+    parser.add_argument('--thumbnails', action='store_true',
+                        help="also download covers into the local thumbnail cache")
+    parser.add_argument('--metrics', help="also write the profiler/cache metrics JSON to this path")
+    args = parser.parse_args(argv)
+    args.page_size = max(1, min(args.page_size, app.BOOKS_API_PAGE_SIZE))
+    return args
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -0,0 +1,58 @@
+# Shared fixtures. The app runs against a throwaway SQLite database (see
+# "Storage backends" in the README), so no MySQL server is needed.
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Project_Codel_Bookscape as bookscape  # noqa: E402
+
+# Outside `streamlit run` every st.* call warns about the missing script context
+logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').setLevel(logging.ERROR)
+
+# Per-process resources that read their settings from the environment
+ENV_RESOURCES = ('get_response_cache', 'get_http_session', 'get_api_rate_limiter', 'get_thumbnail_cache',
+                 'get_query_profiler', 'get_import_jobs', 'get_dedup_stats')
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_BACKEND', 'sqlite')
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'bookscape.sqlite'))
+    monkeypatch.setenv('API_CACHE_PATH', str(tmp_path / 'api_cache.sqlite'))
+    monkeypatch.setenv('THUMBNAIL_DIR', str(tmp_path / 'thumbnails'))
+    monkeypatch.setenv('THUMBNAIL_PREFETCH', '0')
+    monkeypatch.setenv('API_RATE_PER_SEC', '10000')
+    monkeypatch.setenv('API_RATE_BURST', '10000')
+    monkeypatch.delenv('DB_REPLICAS', raising=False)
+    reset(bookscape)
+    yield bookscape
+    reset(bookscape)
+
+def reset(module):
+    module.reset_storage()
+    for name in ENV_RESOURCES:
+        getattr(module, name).clear()
+
+@pytest.fixture
+def db(app):
+    # The app with its schema applied
+    app.init_schema()
+    return app
+
+def volume(book_id, title, authors=('Unknown',), isbn=None, categories=None, description='', **info):
+    # A Books API volume with just the fields a test cares about
+    volume_info = {'title': title, 'authors': list(authors), 'description': description, **info}
+    if isbn:
+        volume_info['industryIdentifiers'] = [{'type': 'ISBN_13' if len(isbn) == 13 else 'ISBN_10',
+                                               'identifier': isbn}]
+    if categories:
+        volume_info['categories'] = list(categories)
+    return {'id': book_id, 'volumeInfo': volume_info, 'saleInfo': {}}
+
+def store(app, *volumes):
+    records, failed = app.process_page(list(volumes))
+    assert not failed
+    return app.store_books(records)
@@ -0,0 +1,59 @@
+import pytest
+
+from conftest import store, volume
+
+SEARCH = {'job': 'job-1', 'api_query': 'inauthor:Herbert', 'title': '', 'author': 'Frank', 'genre': '',
+          'year': '', 'min_rating': 0.0, 'min_pages': 0}
+
+class FinishedJobs:
+    # get_import_jobs() stand-in whose every job has finished
+    def get(self, job_id):
+        result = {'fetched': 2, 'processed': 2, 'filtered_out': 0, 'stored': 2, 'errors': [],
+                  'cancelled': False, 'sample_item': None, 'stages': {}}
+        return {'id': job_id, 'status': 'done', 'stored': 2, 'result': result}
+
+@pytest.fixture
+def page(db):
+    store(db, volume('a', 'Dune', ['Frank Herbert']), volume('b', 'Emma', ['Jane Austen']))
+    state = db.st.session_state
+    state['advanced_import'] = dict(SEARCH)
+    with pytest.MonkeyPatch.context() as patch:
+        # Stands in for the cached get_import_jobs; clear() is what reset_storage calls
+        patch.setattr(db, 'get_import_jobs', FinishedJobs)
+        patch.setattr(db.get_import_jobs, 'clear', lambda: None, raising=False)
+        patch.setattr(db, 'similar_books', lambda book_id, k: [])
+        yield db
+    for key in ('advanced_import', 'advanced_results', 'similar_to', 'noted_import_jobs', 'read_after_version'):
+        state.pop(key, None)
+
+def test_results_are_queried_once_per_finished_import(page, monkeypatch):
+    searches = []
+    search_results = page.advanced_search_results
+    monkeypatch.setattr(page, 'advanced_search_results', lambda search: searches.append(search) or
+                        search_results(search))
+    page.advanced_search()
+    page.advanced_search()
+    assert len(searches) == 1
+    found = page.st.session_state['advanced_results']
+    assert [book['book_id'] for book in found['results']] == ['a'] and found['total'] == 2
+    # A new import runs the query again
+    page.st.session_state['advanced_import'] = {**SEARCH, 'job': 'job-2'}
+    page.advanced_search()
+    assert len(searches) == 2
+
+def test_search_results_stay_visible_next_to_similar_books(page, monkeypatch):
+    panels = []
+    monkeypatch.setattr(page, 'import_job_panel', lambda job_id: panels.append(job_id) or FinishedJobs().get(job_id))
+    page.show_similar_to('a', 'Dune')
+    page.advanced_search()
+    assert panels == ['job-1'] and page.st.session_state['advanced_results']['job'] == 'job-1'
+    page.hide_similar()
+    assert 'similar_to' not in page.st.session_state
+
+@pytest.mark.parametrize('field, value', [('author', 'Rowling'), ('author', 'J.K.'), ('genre', 'Fiction'),
+                                          ('genre', 'Juvenile')])
+def test_author_and_genre_match_any_part_of_a_name(page, field, value):
+    store(page, volume('hp', "Harry Potter and the Philosopher's Stone", ['J.K. Rowling'],
+                       categories=['Juvenile Fiction']))
+    found = page.advanced_search_results({**SEARCH, 'author': '', field: value})
+    assert [book['book_id'] for book in found['results']] == ['hp']
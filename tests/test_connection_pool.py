@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+from conftest import bookscape
+
+class FakeConnection:
+    # Counts the calls that would be a server round trip on MySQL
+    def __init__(self):
+        self.pings = 0
+        self.is_connected_calls = 0
+        self.in_transaction = False
+        self.closed = False
+        self.rollbacks = 0
+        self.connection_id = 1
+        # Set when the server has dropped the session; the next ping reconnects
+        self.dropped = False
+
+    def is_connected(self):
+        self.is_connected_calls += 1
+        return not self.closed
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self.pings += 1
+        if self.dropped and reconnect:
+            self.dropped = False
+            self.connection_id += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+def make_pool(**options):
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+    return bookscape.ConnectionPool(connect=connect, **options), opened
+
+def test_checkout_and_release_do_not_touch_the_server():
+    pool, opened = make_pool(size=2)
+    for _ in range(50):
+        pool.release(pool.checkout())
+    assert len(opened) == 1
+    assert opened[0].pings == 0
+    assert opened[0].is_connected_calls == 0
+    assert pool.metrics()['checkouts'] == 50
+
+def test_connection_idle_past_recycle_is_pinged_once():
+    pool, opened = make_pool(size=1, recycle=0.05)
+    pool.release(pool.checkout())
+    time.sleep(0.06)
+    conn = pool.checkout()
+    assert conn is opened[0] and conn.pings == 1
+    pool.release(conn)
+    pool.release(pool.checkout())
+    assert conn.pings == 1
+    assert pool.metrics()['pings'] == 1
+    assert pool.metrics()['reconnects'] == 0
+
+def test_only_a_ping_that_reconnects_counts_as_a_reconnect():
+    pool, opened = make_pool(size=1, recycle=0)
+    pool.release(pool.checkout())
+    pool.release(pool.checkout())
+    opened[0].dropped = True
+    pool.release(pool.checkout())
+    assert opened[0].pings == 2 and len(opened) == 1
+    assert pool.metrics()['reconnects'] == 1
+
+def test_connection_past_max_lifetime_is_replaced():
+    pool, opened = make_pool(size=1, max_lifetime=0.05)
+    first = pool.checkout()
+    pool.release(first)
+    time.sleep(0.06)
+    second = pool.checkout()
+    assert second is not first and first.closed
+    assert pool.metrics()['expired'] == 1
+    time.sleep(0.06)
+    # Released after its lifetime: closed rather than returned to the pool
+    pool.release(second)
+    assert second.closed and pool.metrics()['idle'] == 0
+
+def test_open_transaction_is_rolled_back_on_release():
+    pool, opened = make_pool(size=1)
+    conn = pool.checkout()
+    conn.in_transaction = True
+    pool.release(conn)
+    assert conn.rollbacks == 1
+
+def test_broken_connection_is_discarded():
+    pool, opened = make_pool(size=1)
+    pool.release(pool.checkout(), broken=True)
+    pool.release(pool.checkout())
+    assert len(opened) == 2 and opened[0].closed
+    assert pool.metrics()['discarded'] == 1
+
+def test_pool_size_bounds_concurrent_checkouts():
+    pool, opened = make_pool(size=2, timeout=0.05)
+    held = [pool.checkout(), pool.checkout()]
+    with pytest.raises(TimeoutError):
+        pool.checkout()
+    assert pool.metrics()['timeouts'] == 1
+
+    # A release hands the slot to a waiting thread
+    pool.timeout = 2
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.checkout()))
+    waiter.start()
+    pool.release(held.pop())
+    waiter.join()
+    assert got and got[0] in opened and len(opened) == 2
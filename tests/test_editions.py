@@ -0,0 +1,80 @@
+import pytest
+
+from conftest import store, volume
+
+def works(app):
+    return {row['book_id']: row['work_id'] for row in app.execute_query("SELECT book_id, work_id FROM books")}
+
+@pytest.mark.parametrize('value, expected', [
+    ('0-261-10221-4', '9780261102217'),
+    ('9780261102217', '9780261102217'),
+    ('978-0-261-10221-7', '9780261102217'),
+    ('0261102215', None),          # bad ISBN-10 check digit
+    ('9780261102218', None),       # bad ISBN-13 check digit
+    ('080442957X', '9780804429573'),
+    ('', None),
+])
+def test_canonical_isbn(app, value, expected):
+    assert app.canonical_isbn(value) == expected
+
+@pytest.mark.parametrize('title', [
+    'The Hobbit', 'The Hobbit: Or There and Back Again', 'The Hobbit (Illustrated Edition)', 'Hobbit, 2nd edition',
+])
+def test_normalize_title_drops_edition_noise(app, title):
+    assert app.normalize_title(title) == 'hobbit'
+
+def test_editions_with_similar_titles_share_a_work(db):
+    store(db, volume('a', 'The Fellowship of the Ring', ['J. R. R. Tolkien']),
+          volume('b', 'The Fellowship of the Ring (Anniversary Edition)', ['J.R.R. Tolkien']),
+          volume('c', 'The Fellowship of the Ring', ['Someone Else']),
+          volume('d', 'The Two Towers', ['J. R. R. Tolkien']))
+    clusters = works(db)
+    assert clusters['a'] == clusters['b'] == 'a'
+    assert clusters['c'] == 'c' and clusters['d'] == 'd'
+
+def test_isbn_10_and_13_listings_share_a_work(db):
+    store(db, volume('a', 'The Hobbit', ['Tolkien'], isbn='0261102214'))
+    store(db, volume('b', 'Hobbit (Collins Modern Classics)', ['Tolkien'], isbn='9780261102217'))
+    assert works(db) == {'a': 'a', 'b': 'a'}
+    row, = db.execute_query("SELECT isbn13 FROM books WHERE book_id = 'a'")
+    assert row['isbn13'] == '9780261102217'
+
+def test_a_bridging_edition_merges_two_works(db):
+    # 'b' matches 'a' by title and 'c' by ISBN, so all three become one work
+    store(db, volume('a', 'Foundation', ['Isaac Asimov']),
+          volume('c', 'Foundation Trilogy Book One', ['Isaac Asimov'], isbn='9780553293357'))
+    assert works(db) == {'a': 'a', 'c': 'c'}
+    store(db, volume('b', 'Foundation: Revised Edition', ['Isaac Asimov'], isbn='0553293354'))
+    assert set(works(db).values()) == {'a'}
+
+def test_threshold_controls_matching(db, monkeypatch):
+    monkeypatch.setenv('DEDUP_THRESHOLD', '0.99')
+    store(db, volume('a', 'Pride and Prejudice', ['Jane Austen']),
+          volume('b', 'Pride and Prejudices', ['Jane Austen']))
+    assert works(db) == {'a': 'a', 'b': 'b'}
+
+def test_reimport_keeps_the_work(db):
+    store(db, volume('a', 'Emma', ['Jane Austen']), volume('b', 'Emma: Annotated Edition', ['Jane Austen']))
+    store(db, volume('b', 'Emma: Annotated Edition', ['Jane Austen']))
+    assert works(db) == {'a': 'a', 'b': 'a'}
+    assert db.works_state() == {'volumes': 2, 'works': 1, 'unclustered': 0}
+
+def test_backfill_clusters_books_stored_without_dedup(db, monkeypatch):
+    monkeypatch.setenv('DEDUP', '0')
+    store(db, volume('a', 'Emma', ['Jane Austen']), volume('b', 'Emma (Penguin Classics)', ['Jane Austen']))
+    assert db.works_state()['unclustered'] == 2
+    assert db.backfill_works() == 2
+    assert works(db) == {'a': 'a', 'b': 'a'}
+
+def test_hot_buckets_are_capped_and_counted(db, monkeypatch):
+    monkeypatch.setenv('DEDUP_BUCKET_CAP', '3')
+    # Far fewer candidates per query than the 6 x 16 shared buckets below
+    monkeypatch.setattr(db, 'WORK_CANDIDATE_PAGE', 5)
+    store(db, *[volume(f'h{i}', 'Poems', ['Anon']) for i in range(6)])
+    assert set(works(db).values()) == {'h0'}
+    # The new book shares every bucket with 6 earlier books and is compared with 3
+    store(db, volume('z', 'Poems', ['Anon']))
+    assert works(db)['z'] == 'h0'
+    metrics = db.get_dedup_stats().metrics()
+    assert metrics['hot_buckets'] == db.LSH_BANDS and metrics['skipped'] == 3 * db.LSH_BANDS
+    assert db.metrics_snapshot()['edition_clusters'] == metrics
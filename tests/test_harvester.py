@@ -0,0 +1,159 @@
+import time
+
+import pytest
+import requests
+
+from bookscape_bench import FakeVolumesServer
+
+@pytest.fixture
+def books_api(app, monkeypatch):
+    servers = []
+
+    def start(total=200, **options):
+        server = FakeVolumesServer(total, **options)
+        monkeypatch.setattr(app, 'BOOKS_API_URL', server.start())
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.stop()
+
+@pytest.fixture
+def no_backoff(app, monkeypatch):
+    # Record the retry delays instead of sleeping through them
+    delays = []
+    real = app._retry_delay
+
+    def record(attempt, response=None):
+        delays.append(real(attempt, response))
+        return 0
+    monkeypatch.setattr(app, '_retry_delay', record)
+    return delays
+
+def ids(items):
+    return [item['id'] for item in items]
+
+def test_pages_come_in_start_index_order(app, books_api):
+    server = books_api(200)
+    pages = list(app.iter_volume_pages("q", 95, page_size=40, workers=3))
+    assert [len(page) for page in pages] == [40, 40, 15]
+    assert ids(sum(pages, [])) == [f"bench-0-{index}" for index in range(95)]
+    assert server.requests == 3
+
+def test_paging_resumes_at_start_index(app, books_api):
+    books_api(200)
+    pages = list(app.iter_volume_pages("q", 120, page_size=40, start_index=80))
+    assert ids(pages[0])[0] == "bench-0-80"
+    assert sum(len(page) for page in pages) == 40
+
+def test_paging_stops_at_the_first_empty_page(app, books_api):
+    books_api(50)
+    pages = list(app.iter_volume_pages("q", 400, page_size=40, workers=1))
+    assert [len(page) for page in pages] == [40, 10]
+
+def test_harvest_dedups_overlapping_pages(app, books_api):
+    books_api(100, overlap=5)
+    result = app.harvest_books("q", max_items=100, page_size=40)
+    assert result['total_items'] == 100
+    assert result['pages'] == 3
+    assert result['duplicates'] == 5
+    assert len(ids(result['items'])) == len(set(ids(result['items']))) == 100
+    assert result['failed_pages'] == []
+
+def test_pipeline_stores_each_volume_once(db, books_api):
+    books_api(100, overlap=5)
+    result = db.run_ingest_pipeline("q", 100, batch_size=30)
+    assert result['errors'] == []
+    assert result['pages'] == 3
+    assert result['duplicates'] == 5
+    # The last request asks for the 20 volumes left of max_items, so the
+    # shifted page ends at 94
+    assert result['stored'] == result['inserted'] == 95
+    assert db.execute_query("SELECT COUNT(*) AS n FROM books")[0]['n'] == 95
+
+@pytest.mark.parametrize('stage', ['process', 'filter'])
+def test_pipeline_stage_failure_ends_the_import(db, books_api, monkeypatch, stage):
+    # The second page (process) or the 51st book (filter) raises; the import
+    # must still finish, with what was stored before it
+    books_api(200)
+    calls = []
+
+    def failing(fn, after):
+        def wrapper(arg):
+            calls.append(arg)
+            if len(calls) > after:
+                raise ValueError("bad book")
+            return fn(arg)
+        return wrapper
+    book_filter = None
+    if stage == 'process':
+        monkeypatch.setattr(db, 'process_page', failing(db.process_page, 1))
+    else:
+        book_filter = failing(lambda book: True, 50)
+    started = time.monotonic()
+    result = db.run_ingest_pipeline("q", 200, batch_size=30, book_filter=book_filter)
+    assert time.monotonic() - started < 5
+    assert result['errors'] == [f"{stage}: bad book"]
+    # The first page was filtered and stored before the failure
+    assert result['stored'] == 40
+
+def test_retryable_errors_are_retried(app, books_api, no_backoff):
+    server = books_api(10)
+    server.fail(2, 503)
+    data = app.request_volumes("q", 10)
+    assert len(data['items']) == 10
+    assert server.requests == 3
+    assert len(no_backoff) == 2
+    assert app.get_query_profiler().snapshot()['queries']['api:volumes']['errors'] == 2
+
+def test_retry_after_is_honoured(app, books_api, no_backoff):
+    server = books_api(10)
+    server.fail(1, 429, retry_after=7)
+    app.request_volumes("q", 10)
+    assert no_backoff == [7.0]
+
+def test_backoff_is_jittered_exponential_and_capped(app):
+    for attempt, cap in ((0, 0.5), (3, 4.0), (10, 30.0)):
+        delays = [app._retry_delay(attempt) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        assert max(delays) > cap / 2
+
+def test_retries_give_up(app, books_api, no_backoff, monkeypatch):
+    monkeypatch.setenv('API_MAX_RETRIES', '2')
+    server = books_api(10)
+    server.fail(5, 503)
+    with pytest.raises(requests.HTTPError):
+        app.request_volumes("q", 10)
+    assert server.requests == 3
+
+def test_client_errors_are_not_retried(app, books_api, no_backoff):
+    server = books_api(10)
+    server.fail(1, 400)
+    with pytest.raises(requests.HTTPError):
+        app.request_volumes("q", 10)
+    assert server.requests == 1 and no_backoff == []
+
+def test_pages_are_cached_in_memory_and_on_disk(app, books_api):
+    server = books_api(100)
+    first = app.get_volumes_page("q", 40, 0)
+    assert app.get_volumes_page("q", 40, 0) == first
+    assert server.requests == 1
+
+    # A new process only has the disk tier
+    app.get_response_cache.clear()
+    assert app.get_volumes_page("q", 40, 0) == first
+    assert server.requests == 1
+    assert app.get_response_cache().metrics()['disk_hits'] == 1
+
+    app.get_volumes_page("q", 40, 0, refresh=True)
+    app.get_volumes_page("q", 40, 40)
+    assert server.requests == 3
+
+def test_cached_pages_expire(app, tmp_path):
+    cache = app.ResponseCache(str(tmp_path / 'ttl.sqlite'), ttl=0.05)
+    key = app.ResponseCache.make_key("q", 10, 0)
+    cache.put(key, {'items': []})
+    assert cache.get(key) == {'items': []}
+    time.sleep(0.1)
+    assert cache.get(key) is None
+    assert cache.metrics()['expired'] == 1
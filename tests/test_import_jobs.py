@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+class FakeImports:
+    # Stands in for run_ingest_pipeline: each import blocks until released
+    # (or cancelled) and records the order the jobs started in
+    def __init__(self):
+        self.started = []
+        self.gates = {}
+        self._lock = threading.Lock()
+
+    def gate(self, query):
+        with self._lock:
+            return self.gates.setdefault(query, threading.Event())
+
+    def __call__(self, query, max_items, progress=None, cancel=None, fail=None):
+        with self._lock:
+            self.started.append(query)
+        if fail:
+            raise RuntimeError(fail)
+        result = {'pages': 1, 'fetched': max_items, 'processed': max_items, 'stored': 0,
+                  'errors': [], 'cancelled': False}
+        progress(result)
+        while not self.gate(query).wait(0.01):
+            if cancel.is_set():
+                return {**result, 'cancelled': True}
+        return {**result, 'stored': max_items}
+
+    def release(self, query):
+        self.gate(query).set()
+
+@pytest.fixture
+def imports():
+    return FakeImports()
+
+@pytest.fixture
+def make_jobs(app, imports):
+    runners = []
+
+    def make(**options):
+        runners.append(app.ImportJobs(run=imports, **options))
+        return runners[-1]
+    yield make
+    for runner in runners:
+        runner.close()
+        for query in list(imports.gates):
+            imports.release(query)
+
+def wait_for(jobs, job_id, *statuses, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = jobs.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.005)
+    raise AssertionError(f"job {job_id} is still {jobs.get(job_id)['status']}")
+
+def test_job_runs_in_the_background_and_reports_progress(make_jobs, imports):
+    jobs = make_jobs(workers=1)
+    job_id = jobs.submit('alice', 'dune', 40, label='Dune')
+    job = wait_for(jobs, job_id, 'running')
+    assert job['label'] == 'Dune' and job['fetched'] == 40 and job['stored'] == 0
+    imports.release('dune')
+    job = wait_for(jobs, job_id, 'done')
+    assert job['stored'] == 40 and job['result']['stored'] == 40 and job['finished_at']
+    assert 'cancel' not in job and jobs.metrics()['done'] == 1
+
+def test_busy_session_does_not_starve_others(make_jobs, imports):
+    jobs = make_jobs(workers=2)
+    alice = [jobs.submit('alice', f'a{i}', 10) for i in range(3)]
+    for job_id in alice[:2]:
+        wait_for(jobs, job_id, 'running')
+    bob = jobs.submit('bob', 'b0', 10)
+    imports.release('a0')
+    # Alice still has a job running and Bob none, so Bob goes first
+    wait_for(jobs, bob, 'running')
+    assert jobs.get(alice[2])['status'] == 'queued'
+    imports.release('a1')
+    wait_for(jobs, alice[2], 'running')
+    assert imports.started == ['a0', 'a1', 'b0', 'a2']
+
+def test_cancel_queued_and_running_jobs(make_jobs, imports):
+    jobs = make_jobs(workers=1)
+    running = jobs.submit('alice', 'slow', 10)
+    queued = jobs.submit('alice', 'next', 10)
+    wait_for(jobs, running, 'running')
+    # Only the owner can cancel
+    assert jobs.cancel(queued, owner='bob') is False
+    assert jobs.cancel(queued, owner='alice') is True
+    assert jobs.get(queued)['status'] == 'cancelled'
+    assert jobs.cancel(running) is True
+    assert wait_for(jobs, running, 'cancelled')['result']['cancelled'] is True
+    assert jobs.cancel(running) is False
+    assert imports.started == ['slow']
+    assert jobs.metrics()['cancelled'] == 2
+
+def test_queue_is_bounded_per_session(make_jobs):
+    jobs = make_jobs(workers=1, max_queued=2)
+    jobs.submit('alice', 'a0', 10)
+    jobs.submit('alice', 'a1', 10)
+    with pytest.raises(RuntimeError, match="already queued or running"):
+        jobs.submit('alice', 'a2', 10)
+    jobs.submit('bob', 'b0', 10)
+    assert jobs.metrics()['rejected'] == 1 and jobs.metrics()['sessions'] == 2
+
+def test_failed_import_is_reported(make_jobs):
+    jobs = make_jobs(workers=1)
+    job_id = jobs.submit('alice', 'broken', 10, fail="API quota exceeded")
+    job = wait_for(jobs, job_id, 'failed')
+    assert job['error'] == "API quota exceeded" and job['result'] is None
+
+def test_finished_jobs_beyond_history_are_forgotten(make_jobs, imports):
+    jobs = make_jobs(workers=1, history=2)
+    ids = []
+    for i in range(4):
+        imports.release(f'q{i}')
+        ids.append(jobs.submit('alice', f'q{i}', 10))
+        wait_for(jobs, ids[-1], 'done')
+    assert [job['id'] for job in jobs.jobs('alice')] == ids[:1:-1]
+    assert jobs.get(ids[0]) is None
+
+def test_close_cancels_everything_and_refuses_new_jobs(make_jobs):
+    jobs = make_jobs(workers=1)
+    running = jobs.submit('alice', 'slow', 10)
+    queued = jobs.submit('alice', 'next', 10)
+    wait_for(jobs, running, 'running')
+    jobs.close()
+    assert jobs.get(queued)['status'] == 'cancelled'
+    wait_for(jobs, running, 'cancelled')
+    with pytest.raises(RuntimeError, match="shut down"):
+        jobs.submit('alice', 'late', 10)
@@ -0,0 +1,78 @@
+import pytest
+
+from conftest import reset
+
+ROWS = [
+    # (id, score, name): ties on score, and NULLs in both columns
+    (1, 5, 'a'), (2, 5, 'b'), (3, 5, 'b'), (4, 4, None), (5, None, 'c'), (6, 4, 'a'),
+    (7, 3, 'b'), (8, None, None), (9, 5, 'b'), (10, 3, 'a'), (11, 4, 'c'), (12, None, 'a'),
+]
+
+@pytest.fixture(params=['sqlite', 'duckdb'])
+def db(request, app, tmp_path, monkeypatch):
+    if request.param == 'duckdb':
+        pytest.importorskip('duckdb')
+        monkeypatch.setenv('DB_BACKEND', 'duckdb')
+        monkeypatch.setenv('DB_PATH', str(tmp_path / 'bookscape.duckdb'))
+        reset(app)
+    app.schema_query("CREATE TABLE paged (id INT PRIMARY KEY, score INT, name VARCHAR(10))")
+    for row in ROWS:
+        app.schema_query("INSERT INTO paged (id, score, name) VALUES (%s, %s, %s)", row)
+    return app
+
+def expected(sort):
+    # Python's idea of the order: NULLs last in either direction
+    rows = [dict(zip(('id', 'score', 'name'), row)) for row in ROWS]
+    for column, descending in reversed(sort):
+        present = sorted((row for row in rows if row[column] is not None),
+                         key=lambda row: row[column], reverse=descending)
+        rows = present + [row for row in rows if row[column] is None]
+    return rows
+
+def all_pages(app, query, sort_key, page_size, params=None):
+    pages, after = [], None
+    while True:
+        rows, after, has_more = app.fetch_query_page(query, params, sort_key=sort_key, after=after,
+                                                     page_size=page_size)
+        pages.append(rows)
+        if not has_more:
+            return pages
+
+@pytest.mark.parametrize('page_size', [1, 2, 5, 50])
+def test_pages_follow_the_sort_key_with_nulls_last(db, page_size):
+    pages = all_pages(db, "SELECT id, score, name FROM paged", "score DESC, name, id", page_size)
+    assert all(len(page) == page_size for page in pages[:-1])
+    assert sum(pages, []) == expected([('score', True), ('name', False), ('id', False)])
+
+@pytest.mark.parametrize('page_size', [1, 2, 3])
+def test_ties_across_a_page_boundary_are_not_lost_or_repeated(db, page_size):
+    # (score, name) does not identify a row: (5, 'b') appears three times
+    pages = all_pages(db, "SELECT score, name FROM paged", "score DESC, name", page_size)
+    rows = [(row['score'], row['name']) for row in sum(pages, [])]
+    assert rows == [(row['score'], row['name']) for row in expected([('score', True), ('name', False)])]
+
+def test_without_a_sort_key_every_column_orders(db):
+    pages = all_pages(db, "SELECT name, id FROM paged WHERE id > %s", None, 4, params=(2,))
+    assert sum(pages, []) == [{'name': row['name'], 'id': row['id']}
+                              for row in expected([('name', False), ('id', False)]) if row['id'] > 2]
+
+def test_named_parameters(db):
+    pages = all_pages(db, "SELECT id FROM paged WHERE score = %(score)s", "id DESC", 2, params={'score': 5})
+    assert [row['id'] for row in sum(pages, [])] == [9, 3, 2, 1]
+
+def test_page_reads_only_what_it_shows(db):
+    rows, after, has_more = db.fetch_query_page("SELECT id FROM paged", sort_key="id", page_size=5)
+    assert [row['id'] for row in rows] == [1, 2, 3, 4, 5] and has_more
+    assert after == ((5,), 1)
+    rows, _, has_more = db.fetch_query_page("SELECT id FROM paged WHERE id > 100", sort_key="id")
+    assert rows == [] and not has_more
+
+def test_explorer_queries_page_through_their_results(db):
+    from conftest import store, volume
+    db.init_schema()
+    store(db, *[volume(f'b{i}', f'Machine Learning {i % 7}', [f'Author {i % 3}']) for i in range(40)])
+    name = "14. Books with a Specific Keyword in the Title"
+    pages = all_pages(db, db.explorer_sql(name), db.EXPLORER_SORT_KEYS[name], 25)
+    assert [len(page) for page in pages] == [25, 15]
+    rows = sum(pages, [])
+    assert rows == sorted(rows, key=lambda row: (row['title'], row['authors'], row['published_year']))
@@ -0,0 +1,45 @@
+from conftest import store, volume
+
+COUNT = "SELECT COUNT(*) AS n FROM books"
+
+def test_results_are_cached_until_the_data_changes(db):
+    cache = db.get_query_cache()
+    store(db, volume('a', 'Dune'))
+    assert db.cached_query(COUNT) == [{'n': 1}]
+    assert db.cached_query(COUNT) == [{'n': 1}]
+    assert cache.metrics()['hits'] == 1
+
+    # store_books bumps the data version, so the next read misses
+    store(db, volume('b', 'Emma'))
+    assert db.cached_query(COUNT) == [{'n': 2}]
+    metrics = cache.metrics()
+    assert metrics['invalidations'] == 1 and metrics['entries'] == 1
+
+def test_writes_from_another_process_are_seen_after_version_ttl(db):
+    cache = db.get_query_cache()
+    cache.version_ttl = 60
+    db.cached_query(COUNT)
+    # A write that does not go through this process's cache (the import CLI)
+    db.execute_query("INSERT INTO books (book_id, title) VALUES ('x', 'Elsewhere')")
+    db.execute_query("UPDATE data_version SET version = version + 1 WHERE id = 1")
+    assert db.cached_query(COUNT) == [{'n': 0}]
+    cache.version_ttl = 0
+    assert db.cached_query(COUNT) == [{'n': 1}]
+
+def test_parameters_are_part_of_the_key(db):
+    store(db, volume('a', 'Dune'), volume('b', 'Emma'))
+    query = "SELECT book_id FROM books WHERE title = %s"
+    assert db.cached_query(query, ('Dune',)) == [{'book_id': 'a'}]
+    assert db.cached_query(query, ('Emma',)) == [{'book_id': 'b'}]
+
+def test_lru_is_bounded_by_bytes(app):
+    cache = app.QueryResultCache(max_bytes=600)
+    rows = [{'text': 'x' * 100}]
+    for key in 'abcdef':
+        cache.put((key, '', 1), rows)
+    metrics = cache.metrics()
+    assert metrics['bytes'] <= 600 and metrics['evictions'] > 0
+    assert cache.get(('a', '', 1)) is None and cache.get(('f', '', 1)) == rows
+    # A single result larger than the whole cache is not kept
+    cache.put(('big', '', 1), [{'text': 'x' * 1000}])
+    assert cache.get(('big', '', 1)) is None
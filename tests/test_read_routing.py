@@ -0,0 +1,107 @@
+import sqlite3
+import time
+
+import pytest
+
+from bookscape_bench import synthetic_rows
+
+@pytest.fixture
+def replica(db, tmp_path):
+    # A second SQLite file as the replica. It only changes when the test
+    # copies the primary over it, so it lags behind every write until then.
+    primary_path = str(tmp_path / 'bookscape.sqlite')
+    replica_path = str(tmp_path / 'replica.sqlite')
+
+    def sync():
+        source, target = sqlite3.connect(primary_path), sqlite3.connect(replica_path)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+    sync()
+    backend = db.SQLiteBackend(replica_path)
+    node = db.Replica('replica', db.ConnectionPool(size=2, connect=backend.connect))
+    node.sync = sync
+    router = db.ReadRouter(db.get_connection_pool(), [node], max_lag=0.2, check_interval=0, retry_after=60)
+    with pytest.MonkeyPatch.context() as patch:
+        # Stands in for the cached get_read_router; clear() is what reset_storage calls
+        patch.setattr(db, 'get_read_router', lambda: router)
+        patch.setattr(db.get_read_router, 'clear', lambda: None, raising=False)
+        yield node
+    node.pool.close()
+    backend.close()
+    db.st.session_state.pop('read_after_version', None)
+
+def count_books(app):
+    return app.execute_query("SELECT COUNT(*) AS n FROM books")[0]['n']
+
+def import_books(app, count, start=0, session=True):
+    # session=False is another session's import: it does not pin reads
+    rows = list(synthetic_rows(count, start=start))
+    return app.store_books(rows) if session else app.store_books_bulk(rows)
+
+def test_reads_go_to_an_up_to_date_replica(db, replica):
+    import_books(db, 5, session=False)
+    replica.sync()
+    assert count_books(db) == 5
+    assert replica.reads == 1
+    # Writes always go to the primary
+    db.execute_query("UPDATE books SET page_count = 1")
+    assert replica.reads == 1
+    assert db.get_read_router().metrics()['replica_reads'] == 1
+
+def test_lagging_replica_serves_stale_reads_until_max_lag(db, replica):
+    import_books(db, 5, session=False)
+    # Behind, but only just: the replica still answers with its old copy
+    assert count_books(db) == 0 and replica.reads == 1
+    time.sleep(0.3)
+    assert count_books(db) == 5
+    metrics = db.get_read_router().metrics()
+    assert metrics['lag_skips'] == 1 and metrics['fallbacks'] == 1
+    assert metrics['replicas'][0]['lag_source'] == 'data version'
+    assert metrics['replicas'][0]['lag_seconds'] > 0.2
+
+    # Caught up: back on the replica
+    replica.sync()
+    assert count_books(db) == 5 and replica.reads == 2
+
+def test_session_reads_its_own_writes(db, replica):
+    import_books(db, 5)
+    version = db.st.session_state['read_after_version']
+    assert version == db.get_read_router().primary_version()
+    # The replica is within max_lag, but has not applied this session's import
+    assert count_books(db) == 5
+    assert replica.reads == 0
+    assert db.get_read_router().metrics()['version_skips'] == 1
+
+    replica.sync()
+    assert count_books(db) == 5 and replica.reads == 1
+
+def test_primary_reads_block_bypasses_the_replica(db, replica):
+    replica.sync()
+    with db.primary_reads():
+        count_books(db)
+    assert replica.reads == 0
+    count_books(db)
+    assert replica.reads == 1
+
+def test_unreachable_replica_falls_back_and_is_skipped(db, replica):
+    def refuse():
+        raise ConnectionError("replica down")
+    replica.pool.close()
+    replica.pool._connect = refuse
+    import_books(db, 3, session=False)
+    assert count_books(db) == 3
+    assert count_books(db) == 3
+    assert replica.errors == 1 and replica.last_error == "replica down"
+    assert db.get_read_router().metrics()['replicas'][0]['up'] is False
+
+def test_query_explorer_pages_read_from_the_replica(db, replica):
+    import_books(db, 30, session=False)
+    replica.sync()
+    name = "14. Books with a Specific Keyword in the Title"
+    _, after, _ = db.fetch_query_page(db.explorer_sql(name), sort_key=db.EXPLORER_SORT_KEYS[name], page_size=10)
+    assert replica.reads == 1
+    db.fetch_query_page(db.explorer_sql(name), sort_key=db.EXPLORER_SORT_KEYS[name], after=after, page_size=10)
+    assert replica.reads == 2
@@ -0,0 +1,68 @@
+import pytest
+
+from conftest import store, volume
+
+def test_migrations_apply_once_in_order(app):
+    app.init_schema()
+    applied = app.applied_migrations()
+    assert [row['version'] for row in applied] == [version for version, _, _ in app.MIGRATIONS]
+    # A second start finds nothing to do
+    assert app.run_migrations(progress=ran_twice) is False
+    app.init_schema()
+    assert len(app.applied_migrations()) == len(app.MIGRATIONS)
+
+def ran_twice(version, name):
+    raise AssertionError(f"migration {version} ({name}) ran twice")
+
+def test_pending_migration_is_applied_on_next_start(db):
+    store(db, volume('a', 'Dune', publishedDate='1965-08-01'), volume('b', 'Undated', publishedDate='c1900'))
+    # Roll the database back to before migration 6: no pub_year values yet
+    db.execute_query("UPDATE books SET pub_year = NULL")
+    db.execute_query("DELETE FROM schema_migrations WHERE version >= 6")
+    steps = []
+    db.run_migrations(progress=lambda version, name: steps.append(version))
+    assert steps == [version for version, _, _ in db.MIGRATIONS if version >= 6]
+    years = {row['book_id']: row['pub_year'] for row in db.execute_query("SELECT book_id, pub_year FROM books")}
+    assert years == {'a': 1965, 'b': None}
+
+def test_ensure_column_and_index_are_idempotent(db):
+    assert db.ensure_column('books', 'pub_year', "SMALLINT") is False
+    assert db.ensure_column('books', 'test_flag', "TINYINT(1)") is True
+    assert db.ensure_column('books', 'test_flag', "TINYINT(1)") is False
+    assert db.ensure_index('books', 'idx_test_flag', "INDEX idx_test_flag (test_flag)") is True
+    assert db.ensure_index('books', 'idx_test_flag', "INDEX idx_test_flag (test_flag)") is False
+
+def test_typed_columns_are_filled_on_store(db):
+    item = volume('a', 'Dune', publishedDate='1965')
+    item['saleInfo'] = {'isEbook': True}
+    store(db, item, volume('b', 'Unknown year', publishedDate='19xx'))
+    rows = db.execute_query("SELECT book_id, pub_year, is_ebook FROM books ORDER BY book_id")
+    assert [(row['pub_year'], row['is_ebook']) for row in rows] == [(1965, 1), (None, None)]
+
+def test_pages_survive_an_unreachable_database(app, tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'missing' / 'bookscape.sqlite'))
+    app.reset_storage()
+    errors = []
+    monkeypatch.setattr(app.st, 'error', errors.append)
+    for page in ("Home", "Query Explorer"):
+        monkeypatch.setattr(app.st.sidebar, 'radio', lambda label, options: page)
+        app.main()
+    # Home renders as usual; the database pages say why they cannot
+    assert ["database is unavailable" in error for error in errors].count(True) == 1
+    assert "database is unavailable" in errors[-1]
+
+def test_failed_schema_setup_is_retried_after_a_while(app, tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'missing' / 'bookscape.sqlite'))
+    app.reset_storage()
+    calls = []
+    init_schema = app.init_schema
+    monkeypatch.setattr(app, 'init_schema', lambda: calls.append(1) or init_schema())
+    for _ in range(3):
+        with pytest.raises(Exception):
+            app.ensure_schema()
+    assert len(calls) == 1
+    # The database comes back; the next run after the retry window sets it up
+    (tmp_path / 'missing').mkdir()
+    monkeypatch.setenv('SCHEMA_RETRY_SECONDS', '0')
+    assert app.ensure_schema() is True
+    assert app.ensure_schema() is True and len(calls) == 2
@@ -0,0 +1,76 @@
+import pytest
+
+from conftest import store, volume
+
+pytest.importorskip('numpy')
+
+CATALOG = [
+    volume('space-1', 'Starship Navigation', ['A. Pilot'], categories=['Science'],
+           description='Orbital mechanics, rockets and interstellar starship navigation between planets'),
+    volume('space-2', 'Rockets and Orbits', ['B. Pilot'], categories=['Science'],
+           description='How rockets reach orbit: orbital mechanics for planets and moons'),
+    volume('space-2b', 'Rockets and Orbits: Revised Edition', ['B. Pilot'], categories=['Science'],
+           description='How rockets reach orbit: orbital mechanics for planets and moons, revised'),
+    volume('cook-1', 'Italian Kitchen', ['C. Chef'], categories=['Cooking'],
+           description='Pasta, risotto and tomato sauces from the Italian kitchen'),
+    volume('cook-2', 'Pasta Every Day', ['D. Chef'], categories=['Cooking'],
+           description='Fresh pasta recipes with tomato, basil and garlic sauces'),
+]
+
+@pytest.fixture
+def catalog(db):
+    store(db, *CATALOG)
+    return db
+
+def test_most_similar_books_come_first(catalog):
+    index = catalog.get_similarity_index()
+    index.refresh()
+    matches = index.similar('space-1', k=3)
+    ids = [book_id for book_id, _ in matches]
+    # One edition per work, never the book itself
+    assert ids[0] in ('space-2', 'space-2b') and 'space-1' not in ids
+    assert not {'space-2', 'space-2b'} <= set(ids)
+    assert all(ids.index(book) > 0 for book in ('cook-1', 'cook-2') if book in ids)
+    scores = [score for _, score in matches]
+    assert scores == sorted(scores, reverse=True) and 0 < scores[0] <= 1
+    assert [book_id for book_id, _ in index.similar('cook-1', k=1)] == ['cook-2']
+
+def test_unknown_book_is_not_indexed(catalog):
+    index = catalog.get_similarity_index()
+    index.refresh()
+    assert index.similar('missing') is None
+
+def test_new_imports_are_picked_up_without_a_rebuild(catalog):
+    index = catalog.get_similarity_index()
+    index.refresh()
+    store(catalog, volume('cook-3', 'Sauces of Italy', ['E. Chef'], categories=['Cooking'],
+                          description='Tomato and basil sauces for fresh pasta, Italian style'))
+    index.refresh()
+    assert index.metrics()['builds'] == 1 and index.metrics()['books'] == 6
+    assert 'cook-3' in [book_id for book_id, _ in index.similar('cook-2', k=2)]
+    # Unchanged data version: refresh does not touch the database
+    refreshes = index.metrics()['refreshes']
+    index.refresh()
+    assert index.metrics()['refreshes'] == refreshes
+
+def test_approximate_lookup_finds_close_matches(catalog):
+    # SimHash candidates only catch close matches, such as a same-titled book by another author
+    store(catalog, volume('cook-1x', 'Italian Kitchen', ['F. Rossi'], categories=['Cooking'],
+                          description='Pasta, risotto and tomato sauces from the Italian kitchen'))
+    index = catalog.get_similarity_index()
+    index.refresh()
+    exact = index.similar('cook-1', k=1)
+    index.exact_max = 0
+    assert index.similar('cook-1', k=1) == exact
+    assert exact[0][0] == 'cook-1x' and exact[0][1] > 0.9
+    assert index.metrics()['approximate_lookups'] == 1
+
+def test_similar_books_returns_search_rows(catalog):
+    rows = catalog.similar_books('cook-1', k=2)
+    assert rows[0]['book_id'] == 'cook-2' and rows[0]['similarity'] > 0
+    assert {'title', 'authors'} <= set(rows[0])
+
+def test_disabled_index(app, monkeypatch):
+    monkeypatch.setenv('SIMILAR_BOOKS', '0')
+    app.get_similarity_index.clear()
+    assert app.similar_books('anything') is None
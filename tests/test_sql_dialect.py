@@ -0,0 +1,79 @@
+import pytest
+
+@pytest.fixture
+def sqlite(app, tmp_path):
+    backend = app.SQLiteBackend(str(tmp_path / 'dialect.sqlite'))
+    yield backend
+    backend.close()
+
+@pytest.fixture
+def duckdb(app, tmp_path):
+    pytest.importorskip('duckdb')
+    backend = app.DuckDBBackend(str(tmp_path / 'dialect.duckdb'))
+    yield backend
+    backend.close()
+
+def only(backend, query, with_params=True):
+    (statement, names), = backend.translate(query, with_params)
+    return statement, names
+
+def test_placeholders_become_qmarks(sqlite):
+    assert only(sqlite, "SELECT * FROM books WHERE book_id = %s AND title LIKE %s") == \
+        ("SELECT * FROM books WHERE book_id = ? AND title LIKE ?", None)
+    assert only(sqlite, "SELECT * FROM books WHERE pub_year = %(year)s OR %(year)s IS NULL") == \
+        ("SELECT * FROM books WHERE pub_year = ? OR ? IS NULL", ['year', 'year'])
+
+def test_literals_and_identifiers(sqlite):
+    # %% is an escaped percent sign only when parameters are bound; quoted
+    # text is never treated as a placeholder
+    assert only(sqlite, "SELECT '%%s', `order` FROM t WHERE a LIKE %s")[0] == \
+        "SELECT '%s', \"order\" FROM t WHERE a LIKE ?"
+    assert only(sqlite, "SELECT '100%%' FROM t", with_params=False)[0] == "SELECT '100%%' FROM t"
+
+def test_upserts(sqlite):
+    assert only(sqlite, "INSERT IGNORE INTO t (a) VALUES (%s)")[0] == "INSERT OR IGNORE INTO t (a) VALUES (?)"
+    assert only(sqlite, "REPLACE INTO t (a) VALUES (%s)")[0] == "INSERT OR REPLACE INTO t (a) VALUES (?)"
+    assert only(sqlite, "INSERT INTO t (a, b) VALUES (%s, %s) ON DUPLICATE KEY UPDATE b = VALUES(b)")[0] == \
+        "INSERT INTO t (a, b) VALUES (?, ?) ON CONFLICT DO UPDATE SET b = excluded.b"
+
+def test_inline_indexes_move_to_create_index(sqlite, duckdb):
+    query = "CREATE TABLE IF NOT EXISTS t (a INT PRIMARY KEY, b INT, INDEX idx_t_b (b), INDEX idx_t_ab (a, b))"
+    statements = [statement for statement, _ in sqlite.translate(query)]
+    assert statements == ["CREATE TABLE IF NOT EXISTS t (a INT PRIMARY KEY, b INT)",
+                          "CREATE INDEX IF NOT EXISTS idx_t_b ON t (b)",
+                          "CREATE INDEX IF NOT EXISTS idx_t_ab ON t (a, b)"]
+    # DuckDB keeps no secondary indexes
+    assert [statement for statement, _ in duckdb.translate(query)] == statements[:1]
+
+def test_dialect_functions(sqlite, duckdb):
+    query = "SELECT 1 FROM t WHERE ts >= NOW() - INTERVAL %s HOUR AND name LIKE %s AND title REGEXP %s"
+    assert only(sqlite, query)[0] == \
+        "SELECT 1 FROM t WHERE ts >= datetime(NOW(), '-' || ? || ' HOURS') AND name LIKE ? AND title REGEXP ?"
+    assert only(duckdb, query)[0] == ("SELECT 1 FROM t WHERE ts >= current_localtimestamp() - ? * INTERVAL 1 HOUR "
+                                      "AND name ILIKE ? AND regexp_matches(title, ?)")
+    assert only(duckdb, "SELECT STDDEV(price) FROM books")[0] == "SELECT STDDEV_POP(price) FROM books"
+
+def test_translations_are_cached(sqlite):
+    query = "SELECT * FROM books WHERE book_id = %s"
+    first = sqlite.translate(query)
+    assert sqlite.translate(query) is first
+    assert sqlite.stats['translations'] == 1
+
+def test_translated_statements_run(sqlite):
+    conn = sqlite.connect()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("CREATE TABLE t (a VARCHAR(10) PRIMARY KEY, b INT, ts DATETIME, INDEX idx_t_b (b))")
+    cursor.execute("INSERT INTO t (a, b, ts) VALUES (%s, %s, NOW()) ON DUPLICATE KEY UPDATE b = VALUES(b)",
+                   ('x', 1))
+    cursor.execute("INSERT INTO t (a, b, ts) VALUES (%s, %s, NOW()) ON DUPLICATE KEY UPDATE b = VALUES(b)",
+                   ('x', 2))
+    cursor.execute("INSERT IGNORE INTO t (a, b, ts) VALUES (%s, %s, NOW())", ('x', 3))
+    conn.commit()
+    cursor.execute("SELECT a, b, GREATEST(b, 5) AS g FROM t WHERE ts >= NOW() - INTERVAL 1 DAY "
+                   "AND a REGEXP %s", ('^x$',))
+    assert cursor.fetchall() == [{'a': 'x', 'b': 2, 'g': 5}]
+    cursor.close()
+    conn.close()
+
+def test_dialect_sql_shows_what_the_backend_runs(app):
+    assert app.dialect_sql("INSERT IGNORE INTO t (a) VALUES (%s)") == "INSERT OR IGNORE INTO t (a) VALUES (%s)"
@@ -0,0 +1,25 @@
+from conftest import volume
+
+def records(app, *volumes):
+    books, failed = app.process_page(list(volumes))
+    assert not failed
+    return books
+
+def test_batch_stats_tell_new_changed_and_unchanged_books_apart(db):
+    first = records(db, volume('a', 'Dune'), volume('b', 'Emma'), volume('c', 'Ulysses'))
+    batch, = db.store_books_bulk(first)
+    assert (batch['inserted'], batch['updated'], batch['unchanged']) == (3, 0, 0)
+    stored_at, = db.execute_query("SELECT import_timestamp FROM books WHERE book_id = 'a'")
+
+    again = records(db, volume('a', 'Dune'), volume('b', 'Emma: Annotated'), volume('d', 'Beloved'))
+    batch, = db.store_books_bulk(again)
+    assert (batch['inserted'], batch['updated'], batch['unchanged']) == (1, 1, 1)
+    # Unchanged books are still written, so incremental readers see the re-import
+    row, = db.execute_query("SELECT import_timestamp FROM books WHERE book_id = 'a'")
+    assert row['import_timestamp'] >= stored_at['import_timestamp']
+    assert db.store_books(again) == 3
+
+def test_row_by_row_reference_path(db):
+    assert db.store_books_row_by_row(records(db, volume('a', 'Dune'), volume('b', 'Emma'))) == 2
+    batch, = db.store_books_bulk(records(db, volume('a', 'Dune'), volume('b', 'Emma')))
+    assert batch['unchanged'] == 2
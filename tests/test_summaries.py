@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from conftest import reset, store, volume
+
+CATEGORY_SETS = [['Computers', 'Cooking'], ['Philosophy'], ['Cooking'], ['Computers'], ['Cooking', 'Philosophy']]
+DATES = ['1999', '2005-03-01', '2010', 'c1900', '2021-11', '']
+# Distinct book counts, so "most books" questions have one answer
+PUBLISHERS = ['Alpha'] * 14 + ['Beta'] * 9 + ['Gamma'] * 7
+AUTHORS = ['Author 0'] * 8 + ['Author 1'] * 6 + ['Author 2'] * 4 + [f'Author {i}' for i in range(3, 15)]
+
+@pytest.fixture(params=['sqlite', 'duckdb'])
+def db(request, app, tmp_path, monkeypatch):
+    if request.param == 'duckdb':
+        pytest.importorskip('duckdb')
+        monkeypatch.setenv('DB_BACKEND', 'duckdb')
+        monkeypatch.setenv('DB_PATH', str(tmp_path / 'bookscape.duckdb'))
+        reset(app)
+    monkeypatch.setenv('STORE_BATCH_SIZE', '7')
+    app.init_schema()
+    return app
+
+def catalog(seed=0, reprice=False):
+    rng = random.Random(seed)
+    books = []
+    for i, publisher in enumerate(PUBLISHERS):
+        item = volume(f'book-{i}', f'Title {i}', [AUTHORS[i]],
+                      categories=CATEGORY_SETS[i % len(CATEGORY_SETS)], publisher=publisher,
+                      publishedDate=DATES[i % len(DATES)], pageCount=rng.randint(50, 900),
+                      averageRating=rng.choice((0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0)),
+                      ratingsCount=rng.randint(0, 500))
+        price = round(rng.uniform(1, 80) * (2 if reprice else 1), 2)
+        item['saleInfo'] = {'isEbook': i % 3 == 0, 'retailPrice': {'amount': price, 'currencyCode': 'USD'}}
+        books.append(item)
+    return books
+
+def normalized(rows):
+    return sorted(tuple((key, round(value, 6) if isinstance(value, float) else value)
+                        for key, value in row.items()) for row in rows)
+
+def assert_summaries_match(app):
+    for name in app.EXPLORER_SUMMARY_QUERIES:
+        live = app.execute_query(app.explorer_sql(name))
+        summary = app.execute_query(app.explorer_sql(name, summaries_fresh=True))
+        assert live is not None and summary is not None, name
+        assert normalized(summary) == normalized(live), name
+
+def test_summaries_answer_like_the_live_queries(db):
+    books = catalog()
+    store(db, *books[:20])
+    assert_summaries_match(db)
+    store(db, *books[20:])
+    assert_summaries_match(db)
+    # Re-imports move books between category sets, years and prices
+    store(db, *[{**item, 'volumeInfo': {**item['volumeInfo'], 'categories': ['Philosophy'], 'publishedDate': '1999'}}
+                for item in catalog(seed=1, reprice=True)[:9]])
+    assert db.aggregates_state()['is_fresh']
+    assert_summaries_match(db)
+
+def test_multi_category_books_are_one_category_set(db):
+    store(db, *catalog())
+    rows = db.execute_query(db.explorer_sql("10. Find the Average Page Count for Each Category",
+                                            summaries_fresh=True))
+    assert {row['categories'] for row in rows} == {'|'.join(names) for names in CATEGORY_SETS}
+    discounted = db.execute_query(db.explorer_sql("6. List Books with Discounts Greater than 20%",
+                                                  summaries_fresh=True))
+    titles = [row['title'] for row in discounted]
+    assert len(titles) == len(set(titles))
+
+def test_missing_ratings_and_prices_are_left_out_of_averages(db):
+    store(db, *catalog())
+    # Rows written before ratings were always filled, or by other tools
+    db.execute_query("UPDATE books SET average_rating = NULL WHERE publisher = 'Beta' AND book_id < 'book-2'")
+    db.execute_query("UPDATE books SET price = NULL WHERE book_id IN ('book-3', 'book-8')")
+    db.rebuild_aggregates()
+    assert_summaries_match(db)
+
+def test_undated_books_are_not_a_year(db):
+    store(db, *catalog())
+    row, = db.execute_query(db.explorer_sql("15. Year with the Highest Average Book Price", summaries_fresh=True))
+    assert isinstance(row['published_year'], int)
+    years = {row['pub_year'] for row in db.execute_query("SELECT pub_year FROM agg_years")}
+    assert years == {1999, 2005, 2010, 2021}
+
+def test_category_set_maintenance_uses_an_index(db):
+    if not db.get_storage_backend().secondary_indexes:
+        pytest.skip("no secondary indexes on this backend")
+    plan = db.execute_query("EXPLAIN QUERY PLAN SELECT book_count FROM agg_category_sets WHERE categories IN ('a', 'b')")
+    assert any('idx_agg_category_sets_categories' in row['detail'] for row in plan)
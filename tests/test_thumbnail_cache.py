@@ -0,0 +1,140 @@
+import os
+import threading
+
+import pytest
+
+from bookscape_bench import FakeVolumesServer, cover_png
+
+@pytest.fixture
+def covers():
+    # FakeVolumesServer doubles as the image host: /covers/<id>.png
+    server = FakeVolumesServer(100)
+    server.start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def make_cache(app, tmp_path):
+    caches = []
+
+    def make(**options):
+        options.setdefault('widths', (100,))
+        cache = app.ThumbnailCache(str(tmp_path / 'thumbnails'), **options)
+        caches.append(cache)
+        return cache
+    yield make
+    for cache in caches:
+        cache._pool.shutdown(wait=True)
+
+def test_miss_downloads_once_then_hits(make_cache, covers):
+    cache = make_cache()
+    url = covers.cover_url('bench-0-1')
+    path = cache.get('book-1', url, width=100, wait=True)
+    assert path and path.endswith('.w100.jpg') and os.path.exists(path)
+    assert cache.get('book-1', url, width=100) == path
+    # The original is kept too, and another width is made from it locally
+    assert cache.get('book-1', url).endswith('.orig.png')
+    assert cache.get('book-1', url, width=50).endswith('.w50.jpg')
+    assert covers.requests == 1
+    metrics = cache.metrics()
+    assert (metrics['misses'], metrics['hits'], metrics['downloads']) == (1, 4, 1)
+    assert metrics['bytes_downloaded'] == len(cover_png('bench-0-1'))
+
+def test_miss_without_wait_returns_none_and_downloads_in_background(make_cache, covers):
+    cache = make_cache()
+    url = covers.cover_url('bench-0-2')
+    assert cache.get('book-2', url, width=100) is None
+    for future in list(cache._pending.values()):
+        future.result()
+    assert cache.get('book-2', url, width=100)
+
+def test_cache_survives_a_restart(make_cache, covers):
+    url = covers.cover_url('bench-0-3')
+    path = make_cache().get('book-3', url, width=100, wait=True)
+    restarted = make_cache()
+    assert restarted.metrics()['entries'] == 1
+    assert restarted.get('book-3', url, width=100) == path
+    assert covers.requests == 1
+
+def test_least_recently_used_covers_are_evicted(make_cache, covers):
+    probe = make_cache()
+    probe.get('probe', covers.cover_url('bench-0-0'), width=100, wait=True)
+    entry = probe.metrics()['bytes']
+    for path in probe._files(probe._digest('probe')):
+        os.remove(path)
+
+    # Room for two covers: reading book-0 again makes book-1 the oldest
+    cache = make_cache(max_bytes=int(entry * 2.5))
+    for index in range(2):
+        cache.get(f'book-{index}', covers.cover_url(f'bench-0-{index}'), width=100, wait=True)
+    cache.get('book-0', covers.cover_url('bench-0-0'), width=100)
+    cache.get('book-2', covers.cover_url('bench-0-2'), width=100, wait=True)
+
+    metrics = cache.metrics()
+    assert metrics['evictions'] == 1 and metrics['entries'] == 2
+    assert metrics['bytes'] <= metrics['max_bytes']
+    assert cache._original(cache._digest('book-1')) is None
+    assert cache._original(cache._digest('book-0')) and cache._original(cache._digest('book-2'))
+
+@pytest.mark.parametrize('response', [
+    (200, b'<html>Not found</html>', 'text/html'),
+    (200, b'\x89PNG\r\n\x1a\nnot really a png', 'image/png'),
+    (404, b'', 'image/png'),
+], ids=['not-an-image', 'corrupt-image', 'missing'])
+def test_bad_images_are_dropped_and_not_retried(make_cache, covers, response):
+    covers.covers['bench-0-4'] = response
+    cache = make_cache()
+    url = covers.cover_url('bench-0-4')
+    assert cache.get('book-4', url, width=100, wait=True) is None
+    assert cache._files(cache._digest('book-4')) == []
+    # Within failure_ttl the failure is remembered rather than fetched again
+    assert cache.get('book-4', url, width=100, wait=True) is None
+    assert cache.prefetch([('book-4', url)]) == 0
+    assert covers.requests == 1
+    metrics = cache.metrics()
+    assert metrics['download_errors'] == 1 and metrics['entries'] == 0
+
+def test_oversized_images_are_dropped(make_cache, covers):
+    covers.covers['bench-0-5'] = (200, cover_png('bench-0-5', 512, 512) + b'\x00' * 300_000, 'image/png')
+    cache = make_cache(max_image_bytes=100_000)
+    assert cache.get('book-5', covers.cover_url('bench-0-5'), width=100, wait=True) is None
+    assert cache._files(cache._digest('book-5')) == []
+    assert cache.metrics()['download_errors'] == 1
+
+def test_failed_download_is_retried_after_failure_ttl(make_cache, covers):
+    covers.fail(1, 503)
+    cache = make_cache(failure_ttl=0)
+    url = covers.cover_url('bench-0-6')
+    assert cache.get('book-6', url, width=100, wait=True) is None
+    assert cache.get('book-6', url, width=100, wait=True)
+    assert covers.requests == 2
+
+def test_concurrent_misses_share_one_download(make_cache, covers):
+    covers.latency = 0.2
+    cache = make_cache(workers=4)
+    url = covers.cover_url('bench-0-7')
+    results = []
+    barrier = threading.Barrier(8)
+
+    def reader():
+        barrier.wait()
+        results.append(cache.get('book-7', url, width=100, wait=True))
+    threads = [threading.Thread(target=reader) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 8 and len(set(results)) == 1 and results[0]
+    assert covers.requests == 1
+    assert cache.metrics()['downloads'] == 1
+
+def test_prefetch_queues_each_uncached_key_once(make_cache, covers):
+    covers.latency = 0.1
+    cache = make_cache()
+    items = [(f'book-{index}', covers.cover_url(f'bench-0-{index}')) for index in range(5)]
+    assert cache.prefetch(items + items[:2] + [('book-x', None)]) == 5
+    for future in list(cache._pending.values()):
+        future.result()
+    assert cache.prefetch(items) == 0
+    assert covers.requests == 5
+    assert all(cache.get(key, url, width=100) for key, url in items)